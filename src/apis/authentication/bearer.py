@@ -1,3 +1,4 @@
+import functools
 import logging
 
 from datetime import datetime
@@ -7,6 +8,7 @@ from django.conf import settings
 
 from django.utils.translation import gettext_lazy as _
 from jwt import exceptions as jwt_exceptions
+from jwt.algorithms import get_default_algorithms
 from rest_framework.authentication import BaseAuthentication, get_authorization_header
 
 from ..base import exceptions as custom_exceptions
@@ -17,6 +19,14 @@ from ..users.db_queries import base as user_base_db_queries
 log = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=4)
+def prepare_key(key: str, alg: str):
+    """
+    parse the verification key once instead of on every decode
+    """
+    return get_default_algorithms()[alg].prepare_key(key)
+
+
 def decode_token(token, verify_signature=True) -> dict:
     """
     DANGER ZONE: Do not set `verify_signature` to False. Setting it to
@@ -26,8 +36,8 @@ def decode_token(token, verify_signature=True) -> dict:
     the response sent back to user
     """
 
-    public_key = settings.PUBLIC_KEY
     alg = settings.SIGNING_ALGORITHM
+    public_key = prepare_key(settings.PUBLIC_KEY, alg)
 
     if verify_signature:
         t = jwt.decode(
@@ -1,11 +1,15 @@
+import base64
 import calendar
+import json
 import mimetypes
 
 from datetime import datetime, timedelta
 from threading import Thread
 
+from asgiref.sync import sync_to_async
 from bson import ObjectId
 from django.contrib.auth.base_user import BaseUserManager
+from django.core.handlers.asgi import ASGIRequest
 from django.core.mail import EmailMessage
 from django.core.management.utils import get_random_string
 
@@ -256,6 +260,52 @@ def send_email(recipient: str, subject: str, body: str):
     queue_task(email_func, recipient, subject, body)
 
 
+def encode_cursor(values: list) -> str:
+    """
+    opaque url safe pagination cursor of the sort key values of a row
+    """
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list | None:
+    """
+    return type: list, the values of a cursor made by `encode_cursor`, None if it is invalid
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+async def iterate_in_thread(iterator):
+    """
+    an async iterator over a sync one, pulling one item at a time in the
+    request's thread, where its database cursor or open file lives.
+    """
+    done = object()
+    while (item := await sync_to_async(next)(iterator, done)) is not done:
+        yield item
+
+
+def is_asgi_request(request) -> bool:
+    """
+    whether the (Django or DRF) request is served over ASGI
+    """
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+def streaming_content(request, iterator):
+    """
+    `iterator` as the content of a streaming response to the request. ASGI
+    buffers sync iterators whole before sending them, so for ASGI requests it
+    is iterated in the request's thread instead.
+    """
+    if is_asgi_request(request):
+        return iterate_in_thread(iterator)
+    return iterator
+
+
 def main():
     year = 2023
     for month in range(1, 13):
@@ -15,6 +15,7 @@ log = logging.getLogger(__name__)
 class BaseAPIView(GenericAPIView, APIView):
     _log = log
     per_page = 10
+    max_per_page = 100
     renderer_classes = [JSONRenderer]
     server_error_msg = 'An error occurred!'
 
@@ -48,6 +49,33 @@ class BaseAPIView(GenericAPIView, APIView):
             **kwargs
         }
 
+    def get_items_per_page(self, request) -> int:
+        """
+        `items_per_page` query param, `self.per_page` if it is invalid, at most `self.max_per_page`
+        """
+        try:
+            items_per_page = int(request.query_params.get('items_per_page', self.per_page))
+        except Exception:  # noqa
+            items_per_page = self.per_page
+        if items_per_page <= 0:
+            items_per_page = self.per_page
+        return min(items_per_page, self.max_per_page)
+
+    def cursor_paginate_response(self, results: list, has_more: bool, before: str | None,  # noqa
+                                 after: str | None, **kwargs) -> dict:
+        """
+        a page of a keyset paginated list, `before` and `after` are the cursors of
+        its first and last items and `has_more` tells whether there are more items
+        in the direction the page was requested in.
+        """
+        return {
+            'results': results,
+            'has_more': has_more,
+            'before': before,
+            'after': after,
+            **kwargs
+        }
+
     def paginate_response2(self, queryset, serializer_data, request, *args, **kwargs) -> dict:  # noqa
         items_per_page = request.query_params.get('items_per_page', self.per_page)
 
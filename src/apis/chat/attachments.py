@@ -0,0 +1,144 @@
+import hashlib
+import os
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .db_queries import base as chat_db_queries
+from .entity.model_helpers import attachment_name
+
+ATTACHMENT_DIR = 'attachments/sha256'
+
+
+def hash_file(file) -> str:
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+class AttachmentError(Exception):
+    pass
+
+
+# a collection deleting the row between the insert and the update of
+# `reference_attachment` is rare, a reference lost to it that often is not
+REFERENCE_ATTEMPTS = 3
+
+
+def store_attachment(file) -> str:
+    """
+    store the uploaded file under its SHA-256 unless a complete copy is
+    stored already. `file.sha256` is set by the upload handlers, which hash the
+    file while it streams in.
+
+    runs before the transaction saving the message, so the file is written
+    without holding the attachment row lock; `reference_attachment` then takes
+    the reference in that transaction.
+    returns the storage name to save as `Message.attachment`.
+    """
+    if not getattr(file, 'sha256', None):
+        file.sha256 = hash_file(file)
+    file_format = os.path.splitext(file.name or '')[1][1:]
+    if not file_format.isalnum() or len(file_format) > 10:
+        file_format = ''
+    name = attachment_name(file.sha256, file_format)
+    _save_attachment_file(name, file)
+    return name
+
+
+def reference_attachment(file, name: str) -> str:
+    """
+    add the reference of the message being saved to the attachment `name`
+    stored by `store_attachment`. Must run in the transaction saving the
+    message: the attachment row is locked until then, so the file can't be
+    collected before the message referencing it is committed.
+    returns `name`.
+    """
+    for _ in range(REFERENCE_ATTEMPTS):
+        if chat_db_queries.reference_attachment(name, file.sha256, file.size):
+            break
+    else:
+        raise AttachmentError('The attachment could not be stored, try again.')
+    # a collection that ran since `store_attachment` deleted the file, it can't
+    # anymore now the row is locked
+    _save_attachment_file(name, file)
+    return name
+
+
+def _save_attachment_file(name: str, file):
+    """
+    write the file to `name` unless a complete copy is there already
+    """
+    if default_storage.exists(name):
+        if default_storage.size(name) == file.size:
+            return
+        default_storage.delete(name)
+    file.seek(0)
+    saved = default_storage.save(name, file)
+    if saved != name:
+        # an identical upload wrote `name` in between and the storage picked
+        # another name for this copy
+        default_storage.delete(saved)
+
+
+def collect_attachments(grace: timedelta, dry_run: bool = False) -> list[str]:
+    """
+    delete the attachments no message has referenced for `grace`.
+    returns the names of the attachments deleted.
+    """
+    before = timezone.now() - grace
+    collected = []
+    for name in chat_db_queries.get_unreferenced_attachment_names(before):
+        if dry_run:
+            collected.append(name)
+            continue
+        with transaction.atomic():
+            attachment = chat_db_queries.lock_unreferenced_attachment(name, before)
+            if attachment is None:
+                # referenced again since it was listed
+                continue
+            attachment.delete()
+            # deleted while the row is locked, a message referencing the file
+            # again waits for this transaction and then stores a new copy
+            default_storage.delete(name)
+        collected.append(name)
+    return collected
+
+
+def collect_orphan_files(grace: timedelta, dry_run: bool = False) -> list[str]:
+    """
+    delete stored attachment files without an attachment row older than `grace`,
+    left behind by uploads whose message was never saved.
+
+    each file is deleted under a placeholder row of its own: a message
+    referencing the file in a transaction not committed yet holds the row, so
+    the placeholder insert waits for it and then conflicts, and the file is kept.
+    returns the names of the files deleted.
+    """
+    before = timezone.now() - grace
+    collected = []
+    if not default_storage.exists(ATTACHMENT_DIR):
+        return collected
+    for directory in default_storage.listdir(ATTACHMENT_DIR)[0]:
+        names = [
+            f'{ATTACHMENT_DIR}/{directory}/{filename}'
+            for filename in default_storage.listdir(f'{ATTACHMENT_DIR}/{directory}')[1]
+        ]
+        known = chat_db_queries.get_attachment_names(names)
+        for name in names:
+            if name in known or default_storage.get_modified_time(name) >= before:
+                continue
+            if not dry_run:
+                with transaction.atomic():
+                    if not chat_db_queries.insert_attachment_placeholder(name):
+                        # referenced since it was listed
+                        continue
+                    default_storage.delete(name)
+                    chat_db_queries.delete_attachment(name)
+            collected.append(name)
+    return collected
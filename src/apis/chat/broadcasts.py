@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .entity.models import Chat
+from .streams import InboxStreams
+
+
+log = logging.getLogger(__name__)
+
+
+def user_group_name(user_id: str) -> str:
+    return f"user_{user_id}"
+
+
+def chat_group_name(chat_id: str) -> str:
+    return f"chat_{chat_id}"
+
+
+def chat_group_names(participant_ids, chat_id: str) -> list[str]:
+    """
+    the groups every socket following the chat is in, the user groups of its
+    participants and the group of the single chat sockets
+    """
+    return [user_group_name(user_id) for user_id in participant_ids] + [chat_group_name(chat_id)]
+
+
+def read_receipts_frame(chat_id: str, reader_id: str, count: int, read_time,
+                        message_ids: list[str] = None, up_to: str = None) -> dict:
+    """
+    the `read_receipts` frame of a reader that read `count` messages of the
+    chat, either the `message_ids` or every message up to `up_to`
+    """
+    return {
+        'type': 'read_receipts',
+        'chat_id': chat_id,
+        'reader_id': reader_id,
+        'message_ids': message_ids,
+        'up_to': up_to,
+        'count': count,
+        'status': "read",
+        'time': read_time.__str__()
+    }
+
+
+async def broadcast_frame(channel_layer, participant_ids: list[str], chat_id: str, event_type: str, frame: dict,
+                          durable=False, **fields):
+    """
+    send a frame that is the same for every recipient to the groups of the
+    chat, see `chat_group_names`. The frame is sent as is with a `frame_id`,
+    the recipients' sockets encode it once per codec and process with
+    `frames.encode_once` instead of each encoding it again.
+    `durable` frames are first appended to the participants' inbox streams.
+    """
+    inbox = InboxStreams(channel_layer)
+    if durable and inbox.enabled:
+        fields['stream_ids'] = await inbox.append(participant_ids, chat_id, frame)
+    event = {'type': event_type, 'frame': frame, 'frame_id': uuid.uuid4().hex, 'chat_id': chat_id, **fields}
+    await asyncio.gather(*(
+        channel_layer.group_send(group, event) for group in chat_group_names(participant_ids, chat_id)
+    ))
+
+
+def broadcast_read_receipts(receipt: dict):
+    """
+    send a `read_receipts` frame made by `read_receipts_frame` outside a socket
+    (e.g. from a view) to every participant of its chat, the way
+    `BaseChatConsumer.read_messages_ws` does.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        participant_ids = list(
+            Chat.participants.through.objects.filter(chat_id=receipt['chat_id']).values_list('user_id', flat=True)
+        )
+        async_to_sync(broadcast_frame)(
+            channel_layer, participant_ids, receipt['chat_id'], 'read_receipts', receipt, durable=True,
+            reader_id=receipt['reader_id'], up_to=receipt['up_to']
+        )
+    except Exception as e:
+        log.error('broadcast_read_receipts@Error')
+        log.error(e)
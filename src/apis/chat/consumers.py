@@ -1,134 +1,846 @@
-import base64
-import json
-import secrets
+import asyncio
+import re
+import time
+from urllib.parse import parse_qs
 
-from asgiref.sync import async_to_sync
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
-from channels.generic.websocket import WebsocketConsumer
-from django.core.exceptions import ObjectDoesNotExist
-from django.core.files.base import ContentFile
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
-from .entity.models import Message, Chat
+from . import broadcasts
+from .attachments import AttachmentError, reference_attachment, store_attachment
+from .broadcasts import chat_group_name, read_receipts_frame, user_group_name
+from .db_queries import base as chat_db_queries
+from .entity.models import Message
 from .entity.serializers import MessageSerializer
+from .frames import FrameError, encode_once, json_codec, negotiate
+from .outbox import SendQueue, SendQueueFull, channel_layer_backlog, transport_write_buffer
+from .presence import PresenceStore
+from .rate_limits import RateLimiter
+from .streams import InboxStreams, parse_stream_id
+from .uploads import AttachmentUpload, UploadError
+from .write_behind import message_writer
 
 
-class ChatConsumer(WebsocketConsumer):
+DEVICE_ID = re.compile(r'[\w-]{1,64}', re.ASCII)
+
+# close code of sockets whose chat messages can't be queued because the client is not reading
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+# in seconds, how often a writer waiting for the client to read checks the server's buffer again
+SEND_BUFFER_POLL_INTERVAL = 0.05
+
+# the `CHAT_RATE_LIMITS` kind each type of frame is taken from, frames of other
+# types are chat messages. `upload_chunk` frames are limited by their size.
+FRAME_RATE_LIMIT_KINDS: dict = {
+    'read_message': 'read',
+    'read_messages': 'read',
+    'typing': 'typing',
+    'subscribe': 'subscribe',
+    'unsubscribe': 'subscribe',
+    'upload_init': 'upload_init',
+    'upload_chunk': None,
+    'upload_abort': 'control',
+    'heartbeat': 'control',
+    'ack': 'control',
+}
+
+
+class BaseChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Shared chat socket logic.
+
+    Every socket joins exactly one channel layer group (`get_group_name`), its
+    user's `user_<id>` group, or the `chat_<id>` group of the single chat
+    sockets, so no socket gets the same event twice. Chat events are sent with
+    the `chat_id` they belong to, to the user groups of the chat's participants
+    and to the chat's group. Sockets only forward events for the chats they are
+    subscribed to, so group memberships (and Redis entries) grow with connected
+    sockets rather than users x chats.
+
+    Frames are JSON text messages unless the client negotiates the
+    `chat.msgpack` subprotocol, which switches both directions to MessagePack
+    binary messages (see `frames`).
+
+    The participants of every subscribed chat are cached in `self.chats` when
+    the socket connects and refreshed through `participants_changed` events.
+
+    Under Daphne, which tells how much of what was sent the client has not read
+    yet, frames are sent from a per-connection task through a bounded
+    `SendQueue`. The task stops sending while Daphne holds more than
+    `CHAT_SEND_BUFFER_HIGH_WATER` unread bytes, so a slow client's frames wait
+    in the queue: receipt, typing and presence frames still waiting are
+    coalesced with newer ones and dropped once `CHAT_SEND_QUEUE_HIGH_WATER`
+    frames are undelivered, and the socket is closed with
+    `SLOW_CONSUMER_CLOSE_CODE` if chat messages would have to be dropped.
+    Other servers get every frame right away.
+
+    Chat messages and read receipts are also appended to every participant's
+    durable inbox stream (see `streams`) before they are broadcast.
+    """
+
+    # subscribe to chats the user is added to while the socket is open
+    subscribe_new_chats = False
+
+    # replay the user's unacknowledged inbox stream entries on connect and tag
+    # forwarded chat events with their `stream_id`
+    use_inbox_stream = False
 
     def __init__(self, *args, **kwargs):
-        super().__init__(args, kwargs)
-        self.chat_name = None
-        self.chat_id = None
+        super().__init__(*args, **kwargs)
+        self.user = None
+        self.group = None
+        self.chats: dict = {}
+        self.upload = None
+        self.upload_chat_id = None
+        self.presence = None
+        self.typing_until: dict = {}
+        self.replayed_ids: set = set()
+        self.codec = json_codec
+        self.outbox = None
+        self.writer = None
+        self.rate_limiter = None
+        self.inbox = None
+        self.replayed_stream_id = None
+        self.device_id = None
+        self.acked_stream_id = None
 
-    def connect(self):
-        self.chat_id = self.scope["url_route"]["kwargs"]["chat_id"]
-        self.chat_name = f"chat_{self.chat_id}"
+    async def get_initial_chats(self) -> dict | None:
+        """
+        load the chats the socket is subscribed to when it connects.
+        return None to reject the connection.
+        """
+        raise NotImplementedError
 
-        async_to_sync(self.channel_layer.group_add)(
-            self.chat_name, self.channel_name  # noqa
+    def get_frame_chat_id(self, content: dict) -> str | None:
+        """
+        return the subscribed chat an incoming frame is for, None if there is none.
+        """
+        raise NotImplementedError
+
+    def get_group_name(self) -> str:
+        """
+        the channel layer group the socket joins
+        """
+        return user_group_name(self.user.id)
+
+    async def send_subscriptions(self):
+        """
+        called once the connection is accepted, before any chat event is sent
+        """
+
+    async def chat_subscribed(self, chat_id: str):
+        """
+        called when a chat the user was just added to is subscribed
+        """
+
+    async def chat_unsubscribed(self, chat_id: str):
+        """
+        called when the user is no longer a participant of a subscribed chat
+        """
+
+    async def connect(self):
+        self.user = self.scope.get("user")
+        if not self.user or not self.user.is_authenticated:
+            await self.close()
+            return
+
+        chats = await self.get_initial_chats()
+        if chats is None:
+            await self.close()
+            return
+        self.chats = chats
+
+        self.group = self.get_group_name()
+        await self.channel_layer.group_add(
+            self.group, self.channel_name  # noqa
         )
-        self.accept()
+        self.rate_limiter = RateLimiter(self.user.id, self.channel_layer)
+        self.inbox = InboxStreams(self.channel_layer)
+        self.codec, subprotocol = negotiate(self.scope.get("subprotocols"))
+        await self.accept(subprotocol)
+        if transport_write_buffer(self.base_send) is not None:
+            self.outbox = SendQueue(
+                settings.CHAT_SEND_QUEUE_HIGH_WATER,
+                backlog=lambda: channel_layer_backlog(self.channel_layer, self.channel_name),
+                write_buffer=lambda: transport_write_buffer(self.base_send) or 0
+            )
+            self.writer = asyncio.create_task(self.drain_outbox())
+        await self.send_subscriptions()
+        await self.replay_history()
+        await self.connect_presence()
 
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(
-            self.chat_name, self.channel_name  # noqa
+    async def disconnect(self, close_code):
+        if self.writer is not None:
+            self.writer.cancel()
+            self.outbox.discard()
+        if self.group is None:
+            return
+        await self.abort_upload()
+        if self.presence is not None and await self.presence.disconnect(self.user.id, self.channel_name):
+            await self.broadcast_presence('offline', last_seen=time.time())
+        await self.channel_layer.group_discard(
+            self.group, self.channel_name  # noqa
         )
 
-    def receive(self, text_data=None, bytes_data=None):
-        text_data_json: dict = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None and not self.codec.binary:
+            await self.upload_chunk(bytes_data)
+            return
+        try:
+            content = self.codec.decode(text_data, bytes_data)
+        except FrameError as e:
+            await self.send_error(str(e))
+            return
+        # every frame is limited here, before any dispatch
+        kind = FRAME_RATE_LIMIT_KINDS.get(content.get("type"), 'message')
+        if kind is not None and not await self.allow(kind):
+            return
+        await self.receive_json(content, **kwargs)
 
-        if "read_message" == text_data_json.get("type"):
-            self.read_message_ws(text_data_json)
+    async def send(self, text_data=None, bytes_data=None, close=False, key=None):
+        """
+        queue a frame, `key` marks frames that may be coalesced with a queued
+        frame of the same key or dropped.
+        """
+        if self.outbox is None:
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+            return
+        if text_data is not None:
+            message = {"type": "websocket.send", "text": text_data}
+        elif bytes_data is not None:
+            message = {"type": "websocket.send", "bytes": bytes_data}
         else:
-            sender = self.scope['user']
-            chat_id = self.chat_id
-            message: str = text_data_json.get("message")
-            attachment = text_data_json.get("attachment")
+            raise ValueError("You must pass one of bytes_data or text_data")
+        try:
+            self.outbox.put(message, key)
+        except SendQueueFull:
+            # the client is not reading, drop it without waiting on its queue
+            self.writer.cancel()
+            await super().close(SLOW_CONSUMER_CLOSE_CODE)
+            return
+        if close:
+            await self.close(close)
 
-            chat = Chat.objects.get(id=chat_id)  # noqa
+    async def send_json(self, content, close=False, key=None):
+        await self.send(**self.codec.encode(content), close=close, key=key)
 
-            participants = chat.participants.all()
-            receiver = [user for user in participants if user != sender][0] if participants else None
+    async def close(self, code=None):
+        if self.outbox is None:
+            await super().close(code)
+            return
+        # close after the frames already queued have been sent
+        if code is not None and code is not True:
+            self.outbox.close({"type": "websocket.close", "code": code})
+        else:
+            self.outbox.close({"type": "websocket.close"})
 
-            if attachment:
-                file_str, file_ext = attachment["data"], attachment["format"]
-                file_data = ContentFile(
-                    base64.b64decode(file_str), name=f"{secrets.token_hex(8)}.{file_ext}"
-                )
-                _message = Message.objects.create(  # noqa
-                    sender=sender,
-                    attachment=file_data,
-                    content=message,
-                    chat=chat,
-                    receiver=receiver
-                )
+    async def drain_outbox(self):
+        while True:
+            await self.outbox.wait()
+            # frames wait in the queue, where they can be coalesced or dropped,
+            # rather than in the server's buffer
+            while (transport_write_buffer(self.base_send) or 0) > settings.CHAT_SEND_BUFFER_HIGH_WATER:
+                await asyncio.sleep(SEND_BUFFER_POLL_INTERVAL)
+            await self.base_send(await self.outbox.get())
+
+    async def receive_json(self, content: dict, **kwargs):
+        frame_type = content.get("type")
+        if "heartbeat" == frame_type:
+            await self.presence.heartbeat(self.user.id, self.channel_name)
+            return
+        if "upload_abort" == frame_type:
+            await self.abort_upload()
+            return
+        if "upload_chunk" == frame_type:
+            # attachment chunks of binary codecs, JSON clients send raw binary messages
+            if not isinstance(content.get("data"), bytes):
+                await self.send_error('upload_chunk data must be binary.')
+                return
+            await self.upload_chunk(content["data"])
+            return
+
+        chat_id = self.get_frame_chat_id(content)
+        if chat_id is None:
+            await self.send_error('Not subscribed to chat.')
+        elif frame_type in ("read_message", "read_messages"):
+            if "read_message" == frame_type:
+                await self.read_message_ws(chat_id, content)
             else:
-                _message = Message.objects.create(  # noqa
-                    sender=sender,
-                    content=message,
-                    chat=chat,
-                    receiver=receiver
-                )
+                await self.read_messages_ws(chat_id, content)
+        elif "typing" == frame_type:
+            await self.typing_ws(chat_id)
+        elif "upload_init" == frame_type:
+            await self.upload_init(chat_id, content)
+        elif content.get("attachment"):
+            await self.send_error('Inline attachments are not supported, use upload_init.')
+        elif "upload_commit" == frame_type:
+            await self.upload_commit(content)
+        else:
+            await self.send_message(chat_id, content.get("message"))
 
-            serializer = MessageSerializer(instance=_message)
-            async_to_sync(self.channel_layer.group_send)(
-                self.chat_name,
-                    {'type': 'chat_message', 'message': serializer.data}  # noqa
-            )
+    async def allow(self, kind: str, amount: float = 1) -> bool:
+        """
+        take from the socket's and user's rate limits, before any database or
+        channel layer work. Rejected frames get a (coalesced) error frame.
+        """
+        retry_after = await self.rate_limiter.check(kind, amount)
+        if not retry_after:
+            return True
+        await self.send_json({
+            'type': 'error',
+            'message': 'Rate limit exceeded.',
+            'kind': kind,
+            'retry_after': round(retry_after, 3)
+        }, key=('rate_limited', kind))
+        return False
 
-    def chat_message(self, event):
-        message_data: dict = event.get("message")
-        self.send(
-            text_data=json.dumps({
-                'type': 'chat_message',
-                'message': message_data,
-            })
+    def get_receiver(self, chat_id: str):
+        return next((user for user in self.chats[chat_id] if user.id != self.user.id), None)
+
+    def get_partner_ids(self) -> set:
+        return {user.id for users in self.chats.values() for user in users if user.id != self.user.id}
+
+    async def broadcast_frame(self, chat_id: str, event_type: str, frame: dict, durable=False, **fields):
+        """
+        broadcast a frame that is the same for every participant of the chat,
+        see `broadcasts.broadcast_frame`. The recipients' sockets encode it
+        once per codec and process with `send_frame`.
+        """
+        await broadcasts.broadcast_frame(
+            self.channel_layer, [user.id for user in self.chats[chat_id]], chat_id, event_type, frame,
+            durable, **fields
         )
 
-    def read_message_ws(self, event):
-        message_id: str = event.get("message_id")
-        user_id = self.scope["user"].id
+    async def send_frame(self, event, key=None):
+        payload = encode_once(event["frame_id"], event["frame"], self.codec)
+        if self.use_inbox_stream:
+            stream_id = event.get("stream_ids", {}).get(self.user.id)
+            if stream_id is not None:
+                if (self.replayed_stream_id is not None
+                        and parse_stream_id(stream_id) <= self.replayed_stream_id):
+                    # already sent from the stream on connect
+                    return
+                payload = self.codec.add_field(payload, 'stream_id', stream_id)
+        await self.send(**self.codec.frame(payload), key=key)
+
+    async def send_message(self, chat_id: str, content: str, attachment=None):
+        if self.typing_until.pop(chat_id, None):
+            # a sent message ends the typing indicator
+            await self.presence.stop_typing(chat_id, self.user.id)
+        if settings.CHAT_WRITE_BEHIND and attachment is None:
+            # attachments still go through `create_message` so the file is in
+            # storage before its url is broadcast
+            message_data = self.queue_message(chat_id, content)
+        else:
+            message_data = await self.create_message(chat_id, content, attachment)
+        await self.broadcast_frame(chat_id, 'chat_message', {
+            'type': 'chat_message',
+            'message': message_data,
+        }, durable=True, message_id=message_data['id'])
+
+    async def send_error(self, message: str):
+        await self.send_json({
+            'type': 'error',
+            'message': message,
+        })
+
+    async def upload_init(self, chat_id: str, event):
+        """
+        start a chunked attachment upload, the file is then sent as binary
+        frames (`upload_chunk` frames over msgpack) followed by an
+        `upload_commit` frame carrying the message text.
+        only one upload can be in flight per socket.
+        """
+        await self.abort_upload()
         try:
-            message = Message.objects.get(id=message_id)  # noqa
-            if user_id != message.receiver.id:
-                self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': 'Invalid user',
-                }))
-                return
-            if message.is_read:
-                self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'message': 'Message already read',
-                }))
-                return
+            self.upload = AttachmentUpload(event.get("format", ""), int(event.get("size") or 0))
+        except (UploadError, TypeError, ValueError) as e:
+            await self.send_error(str(e) or 'Invalid upload.')
+            return
+        self.upload_chat_id = chat_id
+        await self.send_json({
+            'type': 'upload_ready',
+            'chat_id': chat_id,
+            'chunk_size': settings.CHAT_ATTACHMENT_CHUNK_SIZE,
+        })
 
-            message.is_read = True
-            message.read_time = timezone.now()
-            message.save()
-            async_to_sync(self.channel_layer.group_send)(
-                self.chat_name,
-                {  # noqa
-                    'type': 'read_receipt',
-                    'message_id': message_id,
-                    'status': "read",
-                    'time': message.read_time.__str__()
-                }
-            )
-        except ObjectDoesNotExist:
-            self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'Message not found.',
-            }))
+    async def upload_chunk(self, chunk: bytes):
+        if self.upload is None:
+            await self.send_error('No upload in progress.')
+            return
+        if not await self.allow('attachment_bytes', len(chunk)):
+            await self.abort_upload()
+            return
+        try:
+            await sync_to_async(self.upload.write, thread_sensitive=False)(chunk)
+        except UploadError as e:
+            await self.abort_upload()
+            await self.send_error(str(e))
+
+    async def upload_commit(self, event):
+        if self.upload is None or self.upload_chat_id not in self.chats:
+            await self.abort_upload()
+            await self.send_error('No upload in progress.')
+            return
+        upload, self.upload = self.upload, None
+        try:
+            await self.send_message(self.upload_chat_id, event.get("message") or "", upload.complete())
+        except (UploadError, AttachmentError) as e:
+            await self.send_error(str(e))
+        finally:
+            upload.close()
+
+    async def abort_upload(self):
+        if self.upload is not None:
+            self.upload.close()
+            self.upload = None
+
+    async def connect_presence(self):
+        self.presence = PresenceStore(self.channel_layer)
+        if await self.presence.connect(self.user.id, self.channel_name):
+            await self.broadcast_presence('online')
+        if self.presence.enabled:
+            statuses = await asyncio.gather(*(
+                self.presence.get_status(user_id) for user_id in self.get_partner_ids()
+            ))
+            for status in statuses:
+                await self.presence_update(status)
+
+    async def broadcast_presence(self, status: str, last_seen: float = None):
+        event = {
+            'type': 'presence_update',
+            'user_id': self.user.id,
+            'status': status,
+            'last_seen': last_seen
+        }
+        groups = [user_group_name(user_id) for user_id in self.get_partner_ids()]
+        groups += [chat_group_name(chat_id) for chat_id in self.chats]
+        await asyncio.gather(*(self.channel_layer.group_send(group, event) for group in groups))
+
+    async def presence_update(self, event):
+        if event.get("user_id") not in self.get_partner_ids():
+            return
+        await self.send_json({
+            'type': 'presence',
+            'user_id': event.get("user_id"),
+            'status': event.get("status"),
+            'last_seen': event.get("last_seen")
+        }, key=('presence', event.get("user_id")))
+
+    async def typing_ws(self, chat_id: str):
+        # coalesce locally first so a burst of keystrokes costs no Redis round trip,
+        # `start_typing` then coalesces across every socket of the user
+        now = time.monotonic()
+        if now < self.typing_until.get(chat_id, 0.0):
+            return
+        self.typing_until[chat_id] = now + settings.CHAT_TYPING_INTERVAL
+        if await self.presence.start_typing(chat_id, self.user.id):
+            await self.broadcast_frame(chat_id, 'typing_update', {
+                'type': 'typing',
+                'chat_id': chat_id,
+                'user_id': self.user.id,
+                'expires_in': settings.CHAT_TYPING_INTERVAL
+            }, user_id=self.user.id)
+
+    async def typing_update(self, event):
+        if event.get("chat_id") not in self.chats or event.get("user_id") == self.user.id:
+            return
+        await self.send_frame(event, key=('typing', event.get("chat_id"), event.get("user_id")))
 
-    def read_receipt(self, event):
+    async def replay_history(self):
+        """
+        send the messages the client missed since the `since` message id in the
+        query string (`?since=<message_id>`), oldest first, as `history` frames of
+        at most `CHAT_REPLAY_BATCH_SIZE` messages. The last frame has `has_more`
+        False, or `truncated` True when more than `CHAT_REPLAY_MAX_MESSAGES` were
+        missed and the rest must be fetched over http.
+        Live events are only handled once `connect` returns, so they always
+        follow the replayed messages.
+        """
+        since = parse_qs(self.scope.get("query_string", b"").decode()).get("since")
+        if not since:
+            return
+        cursor = await self.get_replay_cursor(since[-1])
+        if cursor is None:
+            await self.send_error('Invalid since cursor.')
+            return
+
+        replayed, messages = 0, []
+        while True:
+            limit = min(settings.CHAT_REPLAY_BATCH_SIZE, settings.CHAT_REPLAY_MAX_MESSAGES - replayed)
+            messages, cursor, has_more = await self.load_history(cursor, limit)
+            replayed += len(messages)
+            truncated = has_more and replayed >= settings.CHAT_REPLAY_MAX_MESSAGES
+            await self.send_json({
+                'type': 'history',
+                'messages': messages,
+                'has_more': has_more and not truncated,
+                'truncated': truncated,
+            })
+            if not has_more or truncated:
+                break
+        # messages sent while the last batch was loaded are also queued as live
+        # events, skip those so they are not delivered twice
+        self.replayed_ids = {message['id'] for message in messages}
+
+    async def replay_inbox_stream(self):
+        """
+        send the inbox stream entries after the device's last `ack`, oldest first,
+        each with its `stream_id`, then an `inbox_replayed` frame with their count.
+        Entries of chats the socket is not subscribed to are skipped.
+        """
+        if not self.inbox.enabled:
+            return
+        batch_size = settings.CHAT_REPLAY_BATCH_SIZE
+        after = await self.inbox.get_ack(self.user.id, self.device_id)
+        self.acked_stream_id = parse_stream_id(after)
+        replayed = 0
+        while True:
+            if self.outbox is not None:
+                # leave room in the send queue for a whole batch
+                await self.outbox.join(max(0, settings.CHAT_SEND_QUEUE_HIGH_WATER - batch_size))
+            entries = await self.inbox.read(self.user.id, after, batch_size)
+            for stream_id, chat_id, payload in entries:
+                if chat_id not in self.chats or payload is None:
+                    continue
+                if self.codec is not self.inbox.codec:
+                    payload = self.codec.dumps(self.inbox.codec.decode(bytes_data=payload))
+                await self.send(**self.codec.frame(self.codec.add_field(payload, 'stream_id', stream_id)))
+                replayed += 1
+            if entries:
+                after = entries[-1][0]
+            if len(entries) < batch_size:
+                break
+        if after is not None:
+            # entries appended while the stream was read are also queued as live
+            # events, skip those so they are not delivered twice
+            self.replayed_stream_id = parse_stream_id(after)
+        await self.send_json({
+            'type': 'inbox_replayed',
+            'count': replayed,
+        })
+
+    async def ack_ws(self, event):
+        """
+        acknowledge every inbox stream entry up to and including `stream_id`
+        for the socket's device, they are not replayed to it again.
+        """
+        stream_id = event.get("stream_id")
+        parsed = parse_stream_id(stream_id)
+        if parsed is None:
+            await self.send_error('stream_id must be an inbox stream id.')
+            return
+        if self.acked_stream_id is not None and parsed <= self.acked_stream_id:
+            # already acknowledged
+            return
+        self.acked_stream_id = parsed
+        await self.inbox.ack(self.user.id, self.device_id, stream_id)
+
+    async def chat_message(self, event):
+        if event.get("chat_id") not in self.chats:
+            return
+        if self.replayed_ids and event.get("message_id") in self.replayed_ids:
+            return
+        await self.send_frame(event)
+
+    async def participants_changed(self, event):
+        chat_id = event.get("chat_id")
+        if chat_id not in self.chats and not self.subscribe_new_chats:
+            return
+        chats = await self.load_chats([chat_id])
+        if chat_id in chats:
+            is_new = chat_id not in self.chats
+            self.chats[chat_id] = chats[chat_id]
+            if is_new:
+                await self.chat_subscribed(chat_id)
+        elif self.chats.pop(chat_id, None) is not None:
+            self.typing_until.pop(chat_id, None)
+            await self.chat_unsubscribed(chat_id)
+
+    async def read_message_ws(self, chat_id: str, event):
         message_id: str = event.get("message_id")
-        status: str = event.get("status")
-        time: str = event.get("time")
+        read_time, error = await self.mark_message_read(chat_id, message_id)
+        if error:
+            await self.send_error(error)
+            return
 
-        self.send(text_data=json.dumps({
+        await self.broadcast_frame(chat_id, 'read_receipt', {
             'type': 'read_receipt',
+            'chat_id': chat_id,
             'message_id': message_id,
-            'status': status,
-            'time': time
-        }))
+            'status': "read",
+            'time': read_time.__str__()
+        }, durable=True)
+
+    async def read_messages_ws(self, chat_id: str, event):
+        """
+        acknowledge many messages at once, either a list of `message_ids` or every
+        message up to and including the `up_to` message id.
+        """
+        message_ids = event.get("message_ids")
+        up_to = event.get("up_to")
+        if message_ids is not None:
+            if (not isinstance(message_ids, list) or not message_ids
+                    or len(message_ids) > settings.CHAT_READ_MESSAGES_MAX_IDS
+                    or not all(isinstance(message_id, str) for message_id in message_ids)):
+                await self.send_error(
+                    f'message_ids must be a list of 1 to {settings.CHAT_READ_MESSAGES_MAX_IDS} message ids.'
+                )
+                return
+            up_to = None
+        elif not isinstance(up_to, str) or not up_to:
+            await self.send_error('Either message_ids or up_to is required.')
+            return
+
+        count, read_time = await self.mark_messages_read(chat_id, message_ids, up_to)
+        receipt = read_receipts_frame(chat_id, self.user.id, count, read_time, message_ids, up_to)
+        if count:
+            await self.broadcast_frame(
+                chat_id, 'read_receipts', receipt, durable=True, reader_id=self.user.id, up_to=up_to
+            )
+        else:
+            # nothing changed, only the reader needs the acknowledgement
+            await self.send_json(receipt)
+
+    async def read_receipts(self, event):
+        if event.get("chat_id") not in self.chats:
+            return
+        if event.get("up_to"):
+            # a later `up_to` receipt of the same reader covers the earlier one
+            key = ('read_up_to', event.get("chat_id"), event.get("reader_id"))
+        else:
+            # never coalesced
+            key = object()
+        await self.send_frame(event, key=key)
+
+    async def read_receipt(self, event):
+        if event.get("chat_id") not in self.chats:
+            return
+        await self.send_frame(event, key=('read', event.get("chat_id"), event.get("message_id")))
+
+    @database_sync_to_async
+    def load_chats(self, chat_ids: list[str] = None) -> dict:
+        """
+        load the participants of the user's chats (only `chat_ids` if given)
+        in one query.
+        return type: dict of chat id to its list of participants, chats the
+        user is not a participant of are left out.
+        """
+        users, chats = {}, {}
+        for membership in chat_db_queries.get_chat_memberships(self.user.id, chat_ids):
+            user = users.setdefault(membership.user_id, membership.user)
+            chats.setdefault(membership.chat_id, []).append(user)
+        return chats
+
+    @database_sync_to_async
+    def get_replay_cursor(self, message_id: str) -> tuple | None:
+        """
+        return type: tuple (timestamp, id) of the message if it belongs to a
+        subscribed chat, otherwise None.
+        """
+        if settings.CHAT_WRITE_BEHIND:
+            # the cursor and the messages after it may not have been flushed yet
+            message_writer.flush()
+        return Message.objects.filter(  # noqa
+            id=message_id, chat_id__in=list(self.chats)
+        ).values_list('timestamp', 'id').first()
+
+    @database_sync_to_async
+    def load_history(self, cursor: tuple, limit: int) -> tuple:
+        """
+        load the next batch of subscribed chat messages after the cursor.
+        return type: tuple (serialized messages, next cursor, has_more)
+        """
+        messages = list(chat_db_queries.get_messages_after(list(self.chats), *cursor, limit=limit + 1))
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if messages:
+            cursor = (messages[-1].timestamp, messages[-1].id)
+        read_pointers = chat_db_queries.get_read_pointers({message.chat_id for message in messages})
+        return MessageSerializer(
+            instance=messages, many=True, context={'read_pointers': read_pointers}
+        ).data, cursor, has_more
+
+    @database_sync_to_async
+    def create_message(self, chat_id: str, content: str, attachment=None) -> dict:
+        """
+        persist the message against the cached chat membership and serialize it.
+        `attachment` is a completed upload, it is stored under its hash here
+        unless the same file is stored already.
+        """
+        attachment_name = store_attachment(attachment) if attachment is not None else None
+        with transaction.atomic():
+            _message = Message.objects.create(  # noqa
+                sender=self.user,
+                attachment=reference_attachment(attachment, attachment_name) if attachment is not None else None,
+                content=content,
+                chat_id=chat_id,
+                receiver=self.get_receiver(chat_id)
+            )
+            chat_db_queries.increment_unread_counts(chat_id, self.user.id)
+        return MessageSerializer(instance=_message).data
+
+    def queue_message(self, chat_id: str, content: str) -> dict:
+        """
+        build the message with its id and timestamp assigned up front and hand
+        it to the write-behind batcher, no database round trip on the send path.
+        """
+        _message = Message(
+            sender=self.user,
+            content=content,
+            chat_id=chat_id,
+            receiver=self.get_receiver(chat_id)
+        )
+        message_writer.add(_message)
+        return MessageSerializer(instance=_message).data
+
+    @database_sync_to_async
+    def mark_messages_read(self, chat_id: str, message_ids: list[str] | None, up_to: str | None) -> tuple:
+        """
+        return type: tuple (number of messages marked as read, read_time)
+        """
+        if settings.CHAT_WRITE_BEHIND:
+            # acknowledged messages may not have been flushed yet
+            message_writer.flush()
+        read_time = timezone.now()
+        count = chat_db_queries.mark_messages_read(
+            self.user.id, chat_id, read_time, message_ids=message_ids, up_to=up_to
+        )
+        return count, read_time
+
+    @database_sync_to_async
+    def mark_message_read(self, chat_id: str, message_id: str) -> tuple:
+        """
+        move the connected user's read pointer up to the message.
+        return type: tuple (read_time, error), where `error` is None on success.
+        """
+        user_id = self.user.id
+        messages = Message.objects.filter(id=message_id, chat_id=chat_id)  # noqa
+        message = messages.first()
+        if message is None and settings.CHAT_WRITE_BEHIND:
+            # the message may have been broadcast but not flushed yet
+            message_writer.flush()
+            message = messages.first()
+        if message is None:
+            return None, 'Message not found.'
+        if user_id != message.receiver_id:
+            return None, 'Invalid user'
+
+        read_time = timezone.now()
+        if chat_db_queries.advance_read_pointer(user_id, chat_id, message.timestamp, message.id, read_time) is None:
+            return None, 'Message already read'
+        return read_time, None
+
+
+class ChatConsumer(BaseChatConsumer):
+    """
+    socket for a single chat, `ws/chat/<chat_id>/[?since=<message_id>]`
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chat_id = None
+
+    async def get_initial_chats(self) -> dict | None:
+        # reject sockets whose user is not a participant of the chat
+        self.chat_id = self.scope["url_route"]["kwargs"]["chat_id"]
+        chats = await self.load_chats([self.chat_id])
+        return chats if self.chat_id in chats else None
+
+    def get_frame_chat_id(self, content: dict) -> str | None:
+        return self.chat_id if self.chat_id in self.chats else None
+
+    def get_group_name(self) -> str:
+        return chat_group_name(self.chat_id)
+
+    async def chat_unsubscribed(self, chat_id: str):
+        await self.close()
+
+
+class InboxConsumer(BaseChatConsumer):
+    """
+    one socket per user and device for all their chats,
+    `ws/inbox/[?device=<device id>][&since=<message_id>]`.
+
+    Every chat the user belongs to is subscribed on connect, as are chats the
+    user is added to later. Frames sent by the client carry the `chat_id` they
+    are for, and chats can be (un)subscribed with `subscribe`/`unsubscribe` frames.
+    A `since` cursor replays the messages missed in every subscribed chat.
+
+    Chat messages and receipts carry the `stream_id` of the user's inbox stream
+    entry. Entries after the device's last `ack` frame (`{"type": "ack",
+    "stream_id": ...}`) are replayed on connect, so delivery is at least once
+    and clients skip frames they already processed (by message id) after a
+    reconnect. Each device of a user (`device`, up to 64 letters, digits, `_`
+    or `-`) acknowledges on its own, sockets without one share the `default`
+    device.
+    """
+
+    subscribe_new_chats = True
+    use_inbox_stream = True
+
+    async def get_initial_chats(self) -> dict | None:
+        # reject sockets with an invalid device id
+        device = parse_qs(self.scope.get("query_string", b"").decode()).get("device", ["default"])[-1]
+        if not DEVICE_ID.fullmatch(device):
+            return None
+        self.device_id = device
+        return await self.load_chats()
+
+    async def send_subscriptions(self):
+        await self.send_json({
+            'type': 'subscribed',
+            'chat_ids': list(self.chats),
+        })
+
+    async def receive_json(self, content: dict, **kwargs):
+        frame_type = content.get("type")
+        if "subscribe" == frame_type:
+            await self.subscribe(content.get("chat_id"))
+        elif "unsubscribe" == frame_type:
+            await self.unsubscribe(content.get("chat_id"))
+        elif "ack" == frame_type:
+            await self.ack_ws(content)
+        else:
+            await super().receive_json(content, **kwargs)
+
+    async def replay_history(self):
+        await super().replay_history()
+        await self.replay_inbox_stream()
+
+    def get_frame_chat_id(self, content: dict) -> str | None:
+        chat_id = content.get("chat_id")
+        return chat_id if chat_id in self.chats else None
+
+    async def subscribe(self, chat_id: str):
+        if not isinstance(chat_id, str) or not chat_id:
+            await self.send_error('chat_id is required.')
+            return
+        if chat_id not in self.chats:
+            chats = await self.load_chats([chat_id])
+            if chat_id not in chats:
+                await self.send_error('Invalid chat_id!')
+                return
+            self.chats[chat_id] = chats[chat_id]
+        await self.chat_subscribed(chat_id)
+
+    async def unsubscribe(self, chat_id: str):
+        if self.chats.pop(chat_id, None) is not None:
+            self.typing_until.pop(chat_id, None)
+        await self.chat_unsubscribed(chat_id)
+
+    async def chat_subscribed(self, chat_id: str):
+        await self.send_json({
+            'type': 'subscribed',
+            'chat_ids': [chat_id],
+        })
+
+    async def chat_unsubscribed(self, chat_id: str):
+        await self.send_json({
+            'type': 'unsubscribed',
+            'chat_ids': [chat_id],
+        })
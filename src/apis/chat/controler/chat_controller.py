@@ -1,21 +1,46 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+from ..attachments import AttachmentError
+from ..downloads import attachment_response
+from ..export import accepts_gzip, ndjson_chunks
+from ..outbox import send_queue_stats
 from ..service.chat_service import ChatService
-from ..entity.serializers import ChatSerializer, MessageSerializer
-from ...base import responses as base_repo_responses, views as base_repo_views
+from ..uploads import HashingUploadHandler
+from ..write_behind import message_writer
+from ..entity.serializers import ChatListSerializer, ChatSerializer, MessageSearchSerializer, MessageSerializer
+from ...base import helpers as base_repo_helpers, responses as base_repo_responses, views as base_repo_views
 from ...users.db_queries import base as user_db_queries
 
 
 class ChatAPIView(base_repo_views.UserAuthenticationAPIView):
     def get(self, request):  # noqa
+        """
+        the user's chats, most recently active first, `?before=<cursor>` pages
+        to less recently active chats using the `before` cursor of a previous page.
+        """
         try:
             user_id: str = self.request.user_id
 
-            user = user_db_queries.get_user_by_id(user_id)
             chat_service = ChatService()
-            chats = chat_service.get_chat(user)
+            before = request.query_params.get('before')
+            cursor = None
+            if before:
+                cursor = chat_service.parse_chat_cursor(before)
+                if cursor is None:
+                    return base_repo_responses.http_response_400(
+                        'Invalid before cursor!'
+                    )
+            chats, has_more = chat_service.list_chats(user_id, self.get_items_per_page(request), cursor)
 
-            serializer = ChatSerializer(chats, many=True)
+            serializer = ChatListSerializer(chats, many=True)
             return base_repo_responses.http_response_200(
-                'Chat retrieved successfully!', data=self.paginate_response(serializer.data, request)
+                'Chat retrieved successfully!', data=self.cursor_paginate_response(
+                    serializer.data, has_more,
+                    before=chat_service.chat_cursor(chats[-1]) if chats else before or None,
+                    after=None
+                )
             )
         except Exception as e:
             self._log.error('ChatAPIView.get@Error')
@@ -50,6 +75,8 @@ class MessageAPIView(base_repo_views.UserAuthenticationAPIView):
 
     def post(self, request, chat_id):  # noqa
         try:
+            # hash the attachment while it is received, before `request.data` parses the body
+            request._request.upload_handlers = [HashingUploadHandler(request._request)]  # noqa
             data: dict = request.data
             sender_id: str = request.user_id
             content: str = data.get('message')
@@ -66,19 +93,50 @@ class MessageAPIView(base_repo_views.UserAuthenticationAPIView):
                 return base_repo_responses.http_response_404(
                     'Invalid chat_id!'
                 )
+        except AttachmentError as e:
+            return base_repo_responses.http_response_409(str(e))
         except Exception as e:
             self._log.error('MessageAPIView.post@Error')
             self._log.error(e)
             return base_repo_responses.http_response_500(self.server_error_msg)
 
     def get(self, request, chat_id):  # noqa
+        """
+        newest messages first, `?before=<cursor>` pages back to older messages and
+        `?after=<cursor>` forward to newer ones, using the `before`/`after`
+        cursors of a previous page.
+        """
         try:
             chat_service = ChatService()
-            messages = chat_service.list_messages(chat_id)
-            if messages is not None:
-                serializer = MessageSerializer(messages, many=True)
+            cursors: dict = {}
+            for direction in ('before', 'after'):
+                cursor = request.query_params.get(direction)
+                if cursor:
+                    cursors[direction] = chat_service.parse_message_cursor(cursor)
+                    if cursors[direction] is None:
+                        return base_repo_responses.http_response_400(
+                            f'Invalid {direction} cursor!'
+                        )
+            if len(cursors) > 1:
+                return base_repo_responses.http_response_400(
+                    'Only one of before and after can be used!'
+                )
+
+            page = chat_service.list_messages(chat_id, self.get_items_per_page(request), **cursors)
+            if page is not None:
+                messages, has_more = page
+                serializer = MessageSerializer(
+                    messages, many=True, context={'read_pointers': chat_service.get_read_pointers([chat_id])}
+                )
+                # an empty page keeps the cursor it was requested with
                 return base_repo_responses.http_response_200(
-                    'Messages retrieved successfully!', data=self.paginate_response(serializer.data, request)
+                    'Messages retrieved successfully!', data=self.cursor_paginate_response(
+                        serializer.data, has_more,
+                        before=chat_service.message_cursor(messages[-1]) if messages
+                        else request.query_params.get('before'),
+                        after=chat_service.message_cursor(messages[0]) if messages
+                        else request.query_params.get('after')
+                    )
                 )
             else:
                 return base_repo_responses.http_response_404(
@@ -90,13 +148,132 @@ class MessageAPIView(base_repo_views.UserAuthenticationAPIView):
             return base_repo_responses.http_response_500(self.server_error_msg)
 
 
+class MessageSearchAPIView(base_repo_views.UserAuthenticationAPIView):
+    def get(self, request):  # noqa
+        """
+        messages of the user's chats matching `?q=<query>`, best match first,
+        `?chat_id=<chat_id>` searches a single chat and `?after=<cursor>` pages
+        to worse matches using the `after` cursor of a previous page.
+        """
+        try:
+            query: str = request.query_params.get('q', '').strip()
+            if not query:
+                return base_repo_responses.http_response_400(
+                    'q is required!'
+                )
+
+            chat_service = ChatService()
+            after = request.query_params.get('after')
+            cursor = None
+            if after:
+                cursor = chat_service.parse_search_cursor(after)
+                if cursor is None:
+                    return base_repo_responses.http_response_400(
+                        'Invalid after cursor!'
+                    )
+            messages, has_more = chat_service.search_messages(
+                request.user_id, query, self.get_items_per_page(request), cursor,
+                request.query_params.get('chat_id') or None
+            )
+
+            serializer = MessageSearchSerializer(messages, many=True, context={
+                'read_pointers': chat_service.get_read_pointers({message.chat_id for message in messages})
+            })
+            return base_repo_responses.http_response_200(
+                'Messages retrieved successfully!', data=self.cursor_paginate_response(
+                    serializer.data, has_more,
+                    before=None,
+                    after=chat_service.search_cursor(messages[-1]) if messages else after or None
+                )
+            )
+        except Exception as e:
+            self._log.error('MessageSearchAPIView.get@Error')
+            self._log.error(e)
+            return base_repo_responses.http_response_500(self.server_error_msg)
+
+
+class ExportChatAPIView(base_repo_views.UserAuthenticationAPIView):
+    def get(self, request, chat_id):  # noqa
+        """
+        stream every message of the chat, oldest first, as newline delimited
+        JSON, gzipped if the client accepts it.
+        """
+        try:
+            chat_service = ChatService()
+            lines = chat_service.export_messages(chat_id, request.user_id)
+            if lines is None:
+                return base_repo_responses.http_response_404(
+                    'Invalid chat_id!'
+                )
+
+            gzip = accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            chunks = ndjson_chunks(lines, settings.CHAT_EXPORT_CHUNK_SIZE, gzip=gzip)
+            response = StreamingHttpResponse(
+                base_repo_helpers.streaming_content(request, chunks), content_type='application/x-ndjson'
+            )
+            response['Content-Disposition'] = f'attachment; filename="{chat_id}.ndjson"'
+            if gzip:
+                response['Content-Encoding'] = 'gzip'
+            patch_vary_headers(response, ('Accept-Encoding',))
+            return response
+        except Exception as e:
+            self._log.error('ExportChatAPIView.get@Error')
+            self._log.error(e)
+            return base_repo_responses.http_response_500(self.server_error_msg)
+
+
+class AttachmentAPIView(base_repo_views.UserAuthenticationAPIView):
+    def get(self, request, message_id):  # noqa
+        """
+        download the message's attachment, `Range` and conditional requests
+        are supported
+        """
+        try:
+            chat_service = ChatService()
+            name = chat_service.get_message_attachment(message_id, request.user_id)
+            response = attachment_response(request, name) if name is not None else None
+            if response is None:
+                return base_repo_responses.http_response_404(
+                    'Invalid message_id!'
+                )
+            return response
+        except Exception as e:
+            self._log.error('AttachmentAPIView.get@Error')
+            self._log.error(e)
+            return base_repo_responses.http_response_500(self.server_error_msg)
+
+
+class ReadAllMessagesAPIView(base_repo_views.UserAuthenticationAPIView):
+    def put(self, request, chat_id, message_id=None):
+        """
+        read every message of the chat, or every message up to `message_id`
+        """
+        try:
+            chat_service = ChatService()
+            receipt = chat_service.read_messages(chat_id, request.user_id, message_id)
+            if receipt is not None:
+                return base_repo_responses.http_response_200(
+                    'Messages read successfully!', data=receipt
+                )
+            else:
+                return base_repo_responses.http_response_404(
+                    'Invalid chat_id or message_id!'
+                )
+        except Exception as e:
+            self._log.error('ReadAllMessagesAPIView.put@Error')
+            self._log.error(e)
+            return base_repo_responses.http_response_500(self.server_error_msg)
+
+
 class ReadMessageAPIView(base_repo_views.UserAuthenticationAPIView):
     def put(self, request, message_id):
         try:
             chat_service = ChatService()
             message = chat_service.read_message(message_id, request.user_id)
             if message is not None:
-                serializer = MessageSerializer(message)
+                serializer = MessageSerializer(
+                    message, context={'read_pointers': chat_service.get_read_pointers([message.chat_id])}
+                )
                 return base_repo_responses.http_response_200(
                     'Messages read successfully!', data=serializer.data
                 )
@@ -108,3 +285,23 @@ class ReadMessageAPIView(base_repo_views.UserAuthenticationAPIView):
             self._log.error('ReadMessageAPIView.put@Error')
             self._log.error(e)
             return base_repo_responses.http_response_500(self.server_error_msg)
+
+
+class ChatMetricsAPIView(base_repo_views.AdminAuthenticationAPIView):
+    def get(self, request):  # noqa
+        """
+        gauges of the process serving the request: the websocket send queues
+        (frames undelivered and bytes the clients have not read) and the
+        write-behind message queue
+        """
+        try:
+            return base_repo_responses.http_response_200(
+                'Chat metrics fetched successfully!', data={
+                    'send_queues': send_queue_stats(),
+                    'write_behind': message_writer.stats(),
+                }
+            )
+        except Exception as e:
+            self._log.error('ChatMetricsAPIView.get@Error')
+            self._log.error(e)
+            return base_repo_responses.http_response_500(self.server_error_msg)
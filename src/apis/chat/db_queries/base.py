@@ -1,6 +1,10 @@
-from django.db.models import Count
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Count, F, FloatField, Q
+from django.db.models.functions import Cast
+from django.utils import timezone
 
-from ..entity import models as chat_models
+from ..entity import model_helpers as chat_model_helpers, models as chat_models
 
 
 def get_chat_by_id(chat_id: str):
@@ -10,10 +14,91 @@ def get_chat_by_id(chat_id: str):
         return None
 
 
+def get_direct_chat(direct_key: str):
+    return chat_models.Chat.objects.filter(direct_key=direct_key).first()  # noqa
+
+
+def insert_direct_chat(direct_key: str):
+    """
+    insert the direct chat with `INSERT ... ON CONFLICT DO NOTHING`, so a
+    concurrent insert of the same key waits for the other transaction and
+    then gets the chat it created.
+    return type: tuple (chat, whether it was created)
+    """
+    new_chat = chat_models.Chat(direct_key=direct_key)
+    chat_models.Chat.objects.bulk_create([new_chat], ignore_conflicts=True)  # noqa
+    chat = get_direct_chat(direct_key)
+    return chat, chat.id == new_chat.id
+
+
 def get_messages_by_chat_id(chat_id: str):
     return chat_models.Message.objects.filter(chat_id=chat_id)  # noqa
 
 
+def get_messages_page(chat_id: str, limit: int, before: tuple = None, after: tuple = None):
+    """
+    up to `limit` messages of the chat, keyset paginated on (timestamp, id):
+    the newest messages older than the `before` (timestamp, id) cursor, newest
+    first, or the oldest messages newer than the `after` cursor, oldest first.
+    Without a cursor the newest messages are returned.
+    """
+    messages = chat_models.Message.objects.filter(  # noqa
+        chat_id=chat_id
+    ).select_related('sender', 'receiver')
+    if after is not None:
+        timestamp, message_id = after
+        return messages.filter(
+            Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id)
+        ).order_by('timestamp', 'id')[:limit]
+    if before is not None:
+        timestamp, message_id = before
+        messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+    return messages.order_by('-timestamp', '-id')[:limit]
+
+
+def get_export_rows(chat_id: str, chunk_size: int):
+    """
+    every message of the chat, oldest first, as (id, sender id, sender username,
+    receiver id, receiver username, content, timestamp, attachment) tuples read from a server side cursor
+    `chunk_size` rows at a time, so no model instances are built and memory
+    does not grow with the chat.
+    """
+    return chat_models.Message.objects.filter(  # noqa
+        chat_id=chat_id
+    ).order_by('timestamp', 'id').values_list(
+        'id', 'sender_id', 'sender__username', 'receiver_id', 'receiver__username', 'content', 'timestamp',
+        'attachment'
+    ).iterator(chunk_size=chunk_size)
+
+
+def search_messages(user_id: str, query: str, limit: int, after: tuple = None, chat_id: str = None):
+    """
+    up to `limit` messages of the user's chats, or of `chat_id` only, matching
+    the web search style `query`, best match first, keyset paginated on
+    (rank, timestamp, id) from the `after` cursor. Matches come from the GIN
+    index on `message_search_vector`, so only matching rows are ranked.
+    """
+    search_query = SearchQuery(query, config=chat_model_helpers.SEARCH_CONFIG, search_type='websearch')
+    chats = chat_models.ChatMember.objects.filter(user_id=user_id)  # noqa
+    if chat_id is not None:
+        chats = chats.filter(chat_id=chat_id)
+    messages = chat_models.Message.objects.alias(  # noqa
+        search_vector=chat_model_helpers.message_search_vector()
+    ).filter(
+        chat_id__in=chats.values('chat_id'), search_vector=search_query
+    ).annotate(
+        # `ts_rank` is a real, as a double it survives the round trip through a cursor exactly
+        rank=Cast(SearchRank(F('search_vector'), search_query), FloatField())
+    ).select_related('sender', 'receiver')
+    if after is not None:
+        rank, timestamp, message_id = after
+        messages = messages.filter(
+            Q(rank__lt=rank) | Q(rank=rank, timestamp__lt=timestamp) |
+            Q(rank=rank, timestamp=timestamp, id__lt=message_id)
+        )
+    return messages.order_by('-rank', '-timestamp', '-id')[:limit]
+
+
 def get_message_by_id(message_id: str):
     try:
         return chat_models.Message.objects.get(id=message_id)  # noqa
@@ -21,9 +106,249 @@ def get_message_by_id(message_id: str):
         return None
 
 
-def get_messages_by_receiver(receiver_id: str, chat_id: str):
+def get_member_message_attachment(message_id: str, user_id: str) -> str | None:
+    """
+    the attachment name of the message if the user is a participant of its chat.
+    """
     return chat_models.Message.objects.filter(  # noqa
-        receiver_id=receiver_id,
-        chat_id=chat_id,
-        is_read=False
+        id=message_id, chat__members__user_id=user_id, attachment__gt=''
+    ).values_list('attachment', flat=True).first()
+
+
+def get_chat_list(user_id: str, limit: int, preview_length: int, before: tuple = None):
+    """
+    up to `limit` of the user's chats, most recently active first, keyset
+    paginated on (last_activity, id) from the `before` cursor. Each chat is
+    annotated with its last message (content cut to `preview_length`), read
+    with one lateral lookup of the (chat, timestamp, id) index, and the user's
+    unread count from the membership row the chats are found by. Participants
+    are prefetched, so a page is two queries however many chats it has.
+    """
+    params = [preview_length, user_id]
+    keyset = ''
+    if before is not None:
+        keyset = 'WHERE (page.last_activity, page.id) < (%s, %s)'
+        params += list(before)
+    return chat_models.Chat.objects.raw(f'''
+        SELECT * FROM (
+            SELECT chat.*, member.unread_count,
+                   last_message.id AS last_message_id,
+                   left(last_message.content, %s) AS last_message_content,
+                   last_message.sender_id AS last_message_sender_id,
+                   last_message.timestamp AS last_message_timestamp,
+                   last_message.attachment AS last_message_attachment,
+                   COALESCE(last_message.timestamp, chat.date_created) AS last_activity
+            FROM {chat_models.Chat._meta.db_table} chat
+            JOIN {chat_models.ChatMember._meta.db_table} member ON member.chat_id = chat.id AND member.user_id = %s
+            LEFT JOIN LATERAL (
+                SELECT id, content, sender_id, timestamp, attachment
+                FROM {chat_models.Message._meta.db_table}
+                WHERE chat_id = chat.id
+                ORDER BY timestamp DESC, id DESC
+                LIMIT 1
+            ) last_message ON true
+        ) page {keyset}
+        ORDER BY page.last_activity DESC, page.id DESC
+        LIMIT %s
+    ''', params + [limit]).prefetch_related('participants')  # noqa
+
+
+def get_chat_memberships(user_id: str, chat_ids: list[str] = None):
+    """
+    participant rows (with their user) of every chat the user belongs to,
+    restricted to `chat_ids` if given.
+    """
+    chats = chat_models.Chat.objects.filter(participants__id=user_id)  # noqa
+    if chat_ids is not None:
+        chats = chats.filter(id__in=chat_ids)
+    return chat_models.ChatMember.objects.filter(  # noqa
+        chat_id__in=chats.values('id')
+    ).select_related('user')
+
+
+def is_chat_member(chat_id: str, user_id: str) -> bool:
+    return chat_models.ChatMember.objects.filter(chat_id=chat_id, user_id=user_id).exists()  # noqa
+
+
+def get_read_pointers(chat_ids: list[str]) -> dict:
+    """
+    return type: dict of (chat id, user id) to the member's read pointer as a
+    tuple (last read timestamp, last read message id, last read at), for every
+    member of the chats that has read anything.
+    """
+    members = chat_models.ChatMember.objects.filter(  # noqa
+        chat_id__in=chat_ids, last_read_timestamp__isnull=False
+    ).values_list('chat_id', 'user_id', 'last_read_timestamp', 'last_read_message_id', 'last_read_at')
+    return {(chat_id, user_id): pointer for chat_id, user_id, *pointer in members}
+
+
+def increment_unread_counts(chat_id: str, sender_id: str, count: int = 1) -> int:
+    """
+    add `count` new messages of the sender to the unread count of every other member of the chat
+    """
+    return chat_models.ChatMember.objects.filter(  # noqa
+        chat_id=chat_id
+    ).exclude(user_id=sender_id).update(unread_count=F('unread_count') + count)
+
+
+def advance_read_pointer(reader_id: str, chat_id: str, timestamp, message_id: str, read_time) -> int | None:
+    """
+    move the reader's read pointer in the chat forward to the (`timestamp`,
+    `message_id`) message, and take the other participants' messages it passes
+    off their unread count, in one UPDATE statement. The membership row is
+    locked before the messages between the old and the new pointer are counted
+    (an index range scan of just the newly read messages), so concurrent reads
+    of the same member are serialized rather than retried.
+    return type: int, the number of other participants' messages newly read,
+    None if the pointer is already at or past the message.
+    """
+    member_table = chat_models.ChatMember._meta.db_table  # noqa
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            WITH member AS (
+                SELECT id, last_read_timestamp, last_read_message_id FROM {member_table}
+                WHERE chat_id = %(chat_id)s AND user_id = %(reader_id)s
+                FOR UPDATE
+            ), newly_read AS (
+                SELECT count(*) AS count FROM {chat_models.Message._meta.db_table} message, member
+                WHERE message.chat_id = %(chat_id)s AND message.sender_id <> %(reader_id)s
+                    AND (message.timestamp, message.id) <= (%(timestamp)s, %(message_id)s)
+                    AND (member.last_read_timestamp IS NULL
+                        OR message.timestamp > member.last_read_timestamp
+                        OR (message.timestamp = member.last_read_timestamp
+                            AND message.id > member.last_read_message_id))
+            )
+            UPDATE {member_table} pointer
+            SET last_read_message_id = %(message_id)s, last_read_timestamp = %(timestamp)s,
+                last_read_at = %(read_time)s, unread_count = GREATEST(pointer.unread_count - newly_read.count, 0)
+            FROM member, newly_read
+            WHERE pointer.id = member.id
+                AND (member.last_read_timestamp IS NULL
+                    OR %(timestamp)s > member.last_read_timestamp
+                    OR (%(timestamp)s = member.last_read_timestamp AND %(message_id)s > member.last_read_message_id))
+            RETURNING newly_read.count
+        ''', {
+            'chat_id': chat_id, 'reader_id': reader_id, 'timestamp': timestamp,
+            'message_id': message_id, 'read_time': read_time,
+        })
+        row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+
+def mark_messages_read(reader_id: str, chat_id: str, read_time, message_ids: list[str] = None,
+                       up_to: str = None) -> int:
+    """
+    advance the reader's read pointer in the chat to the latest of the
+    `message_ids`, or to the `up_to` message, so every message sent up to it
+    is read. Messages themselves are not updated.
+    returns the number of other participants' messages newly read.
+    """
+    messages = chat_models.Message.objects.filter(chat_id=chat_id)  # noqa
+    if message_ids is not None:
+        messages = messages.filter(id__in=message_ids)
+    else:
+        messages = messages.filter(id=up_to)
+    target = messages.order_by('-timestamp', '-id').values_list('timestamp', 'id').first()
+    if target is None:
+        return 0
+    return advance_read_pointer(reader_id, chat_id, *target, read_time) or 0
+
+
+def get_messages_after(chat_ids: list[str], timestamp, message_id: str, limit: int):
+    """
+    up to `limit` messages of the chats sent after the (`timestamp`, `message_id`)
+    cursor, oldest first. Keyset on (timestamp, id) so each batch is an index
+    range scan no matter how long the history is.
+    """
+    return chat_models.Message.objects.filter(  # noqa
+        Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id),
+        chat_id__in=chat_ids
+    ).select_related('sender', 'receiver').order_by('timestamp', 'id')[:limit]
+
+
+def reference_attachment(name: str, sha256: str, size: int) -> int:
+    """
+    add a message reference to the attachment, creating its row if needed. The
+    row stays locked until the transaction ends, so the garbage collector skips it.
+    returns 1, or 0 if the row was deleted in between and it has to be retried.
+    """
+    chat_models.Attachment.objects.bulk_create(  # noqa
+        [chat_models.Attachment(name=name, sha256=sha256, size=size)], ignore_conflicts=True
+    )
+    return chat_models.Attachment.objects.filter(name=name).update(  # noqa
+        ref_count=F('ref_count') + 1, date_updated=timezone.now()
     )
+
+
+def release_attachments(ref_counts: dict[str, int]):
+    """
+    remove the given number of message references from each attachment, in one
+    UPDATE statement
+    """
+    if not ref_counts:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            UPDATE {chat_models.Attachment._meta.db_table} attachment
+            SET ref_count = GREATEST(attachment.ref_count - released.count, 0), date_updated = %s
+            FROM unnest(%s::varchar[], %s::integer[]) AS released (name, count)
+            WHERE attachment.name = released.name
+        ''', [timezone.now(), list(ref_counts), list(ref_counts.values())])
+
+
+def release_message_attachments(messages: Q):
+    """
+    remove the references of the `messages` from their attachments, counted
+    per attachment in one query
+    """
+    release_attachments(dict(
+        chat_models.Message.objects.filter(messages, attachment__gt='').values(  # noqa
+            'attachment'
+        ).annotate(count=Count('id')).order_by().values_list('attachment', 'count')
+    ))
+
+
+def get_unreferenced_attachment_names(before):
+    """
+    names of the attachments no message has referenced since `before`
+    """
+    return chat_models.Attachment.objects.filter(  # noqa
+        ref_count=0, date_updated__lt=before
+    ).values_list('name', flat=True).iterator()
+
+
+def lock_unreferenced_attachment(name: str, before):
+    """
+    lock the attachment row if it is still unreferenced since `before` and not
+    being referenced right now, otherwise return None.
+    """
+    return chat_models.Attachment.objects.select_for_update(skip_locked=True).filter(  # noqa
+        name=name, ref_count=0, date_updated__lt=before
+    ).first()
+
+
+def insert_attachment_placeholder(name: str) -> bool:
+    """
+    insert an unreferenced row for a file without one, so it can be deleted
+    while no message references it. Waits for a transaction inserting the row
+    concurrently.
+    returns whether the row was inserted, False if the attachment has a row.
+    """
+    sha256 = name.rsplit('/', 1)[-1].split('.', 1)[0]
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            INSERT INTO {chat_models.Attachment._meta.db_table}
+                (name, sha256, size, ref_count, date_created, date_updated)
+            VALUES (%(name)s, %(sha256)s, 0, 0, %(now)s, %(now)s)
+            ON CONFLICT (name) DO NOTHING
+            RETURNING name
+        ''', {'name': name, 'sha256': sha256, 'now': timezone.now()})
+        return cursor.fetchone() is not None
+
+
+def delete_attachment(name: str):
+    chat_models.Attachment.objects.filter(name=name).delete()  # noqa
+
+
+def get_attachment_names(names: list[str]) -> set[str]:
+    return set(chat_models.Attachment.objects.filter(name__in=names).values_list('name', flat=True))  # noqa
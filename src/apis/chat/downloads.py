@@ -0,0 +1,139 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+from ..base import helpers as base_repo_helpers
+from .attachments import ATTACHMENT_DIR
+
+BLOCK_SIZE = 64 * 1024
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# served inline, anything else is downloaded so uploaded html or svg never runs on the api's origin
+_INLINE_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp', 'audio/', 'video/', 'application/pdf')
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    return type: tuple (first byte, last byte) of a single `bytes=` range of a
+    file of `size` bytes, (0, -1) if it can't be satisfied, None if the header
+    is missing, invalid (e.g. its last byte is before its first) or asks for
+    several ranges, which are answered with the whole file.
+    """
+    match = _RANGE.match(header.replace(' ', '')) if header else None
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # the last `last` bytes
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        if last and int(last) < int(first):
+            return None
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first > last or first >= size:
+        return 0, -1
+    return first, last
+
+
+def _range_matches(request, etag: str, last_modified: int) -> bool:
+    # `If-Range` only keeps the range if the file is the one the client has part of
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return etag in parse_etags(if_range) and not if_range.startswith('W/')
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _read_range(file, first: int, length: int):
+    with file:
+        file.seek(first)
+        while length > 0:
+            chunk = file.read(min(BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def attachment_response(request, name: str) -> HttpResponse | None:
+    """
+    the stored attachment `name` answering the request's conditional
+    (`If-None-Match`, `If-Modified-Since`) and `Range` headers. With
+    `CHAT_ATTACHMENT_SENDFILE` the bytes are sent by the web server through
+    `X-Accel-Redirect` or `X-Sendfile`, otherwise by Django, with a zero copy
+    `FileResponse` under WSGI for whole files.
+    returns None if the file is missing from storage.
+    """
+    try:
+        path = default_storage.path(name)
+        stat = os.stat(path)
+    except (FileNotFoundError, NotImplementedError):
+        return None
+    size, last_modified = stat.st_size, int(stat.st_mtime)
+    content_addressed = name.startswith(f'{ATTACHMENT_DIR}/')
+    # the content hash is the name of content addressed files
+    etag = quote_etag(os.path.splitext(os.path.basename(name))[0] if content_addressed
+                      else f'{last_modified:x}-{size:x}')
+
+    def with_headers(response: HttpResponse) -> HttpResponse:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Accept-Ranges'] = 'bytes'
+        response['X-Content-Type-Options'] = 'nosniff'
+        if content_addressed:
+            # the content of a content addressed name never changes
+            patch_cache_control(response, private=True, max_age=settings.CHAT_ATTACHMENT_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return with_headers(not_modified)
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    filename = os.path.basename(name)
+    inline = content_type.startswith(_INLINE_TYPES)
+    disposition = f"{'inline' if inline else 'attachment'}; filename=\"{filename}\""
+
+    if settings.CHAT_ATTACHMENT_SENDFILE:
+        # the web server answers `Range` itself
+        response = HttpResponse(content_type=content_type)
+        if settings.CHAT_ATTACHMENT_SENDFILE == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = quote(f'{settings.CHAT_ATTACHMENT_ACCEL_REDIRECT_PREFIX}{name}')
+        else:
+            response['X-Sendfile'] = path
+        response['Content-Disposition'] = disposition
+        return with_headers(response)
+
+    byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    if byte_range is not None and _range_matches(request, etag, last_modified):
+        first, last = byte_range
+        if last < first:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return with_headers(response)
+        length = last - first + 1
+        response = StreamingHttpResponse(
+            base_repo_helpers.streaming_content(request, _read_range(open(path, 'rb'), first, length)),
+            status=206, content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        response['Content-Length'] = str(length)
+        response['Content-Disposition'] = disposition
+        return with_headers(response)
+
+    response = FileResponse(open(path, 'rb'), as_attachment=not inline, filename=filename, content_type=content_type)
+    response.block_size = BLOCK_SIZE
+    if base_repo_helpers.is_asgi_request(request):
+        # ASGI would read the open file into memory first, WSGI servers send it
+        # with sendfile as long as it stays the response's file
+        response.streaming_content = base_repo_helpers.iterate_in_thread(iter(response.streaming_content))
+    return with_headers(response)
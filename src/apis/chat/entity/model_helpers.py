@@ -1,6 +1,20 @@
+from django.contrib.postgres.search import SearchVector
+
 from ...base import helpers as base_repo_helpers, enums as base_repo_enums
 
 
+# text search configuration of the message search index and of search queries
+SEARCH_CONFIG = 'english'
+
+
+def message_search_vector() -> SearchVector:
+    """
+    full text search document of a message, the expression of its search
+    index, so queries have to match on exactly this to use the index
+    """
+    return SearchVector('content', config=SEARCH_CONFIG)
+
+
 def generate_chat_id():
     return base_repo_helpers.generate_model_id(base_repo_enums.ModelPrefixEnum.CHAT)
 
@@ -11,3 +25,19 @@ def generate_message_id():
 
 def generate_receipt_id():
     return base_repo_helpers.generate_model_id(base_repo_enums.ModelPrefixEnum.RECEIPT)
+
+
+def attachment_name(sha256: str, file_format: str) -> str:
+    """
+    storage name of an attachment by its content hash, fanned out over
+    directories by the first two hex digits
+    """
+    suffix = f'.{file_format.lower()}' if file_format else ''
+    return f'attachments/sha256/{sha256[:2]}/{sha256}{suffix}'
+
+
+def direct_chat_key(user_id: str, other_user_id: str) -> str:
+    """
+    the same key for the direct chat of two users whichever of them starts it
+    """
+    return ':'.join(sorted([user_id, other_user_id]))
@@ -1,4 +1,6 @@
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
+from django.utils import timezone
 
 from ...users.models import User
 from . import model_helpers as chat_model_helpers
@@ -7,20 +9,82 @@ from . import model_helpers as chat_model_helpers
 class Chat(models.Model):
     id = models.CharField(primary_key=True, default=chat_model_helpers.generate_chat_id, db_index=True,
                           max_length=60, editable=False, unique=True)
-    participants = models.ManyToManyField(User, related_name='chats')
+    participants = models.ManyToManyField(User, related_name='chats', through='ChatMember')
+    # last activity of chats without messages
+    date_created = models.DateTimeField(default=timezone.now, editable=False)
+    # `direct_chat_key` of the two participants of a direct chat
+    direct_key = models.CharField(max_length=121, null=True, blank=True, unique=True, editable=False)
 
 
 class Message(models.Model):
+    """
+    the table is range partitioned by month on `timestamp` (see `chat.partitions`),
+    so its primary key in the database is (id, timestamp): a unique constraint
+    on a partitioned table has to include the partition key. `id` alone is
+    unique because it is an ObjectId generated by `generate_message_id`, not
+    because of a constraint, so ids must never be assigned by hand.
+    """
     id = models.CharField(primary_key=True, default=chat_model_helpers.generate_message_id, db_index=True,
                           max_length=60, editable=False, unique=True)
     chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages', null=True)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
-    read_time = models.DateTimeField(null=True, blank=True)
+    # not `auto_now_add`, write-behind persistence assigns the timestamp when the
+    # message is broadcast and `bulk_create` must not overwrite it at flush time
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     attachment = models.FileField(upload_to='attachments/', null=True, blank=True)
+    class Meta:
+        indexes = [
+            # keyset pagination of a chat's history on (timestamp, id)
+            models.Index(fields=['chat', 'timestamp', 'id'], name='chat_message_chat_ts_id_idx'),
+            # full text search on the content's document, computed by the index rather than stored
+            GinIndex(chat_model_helpers.message_search_vector(), name='chat_message_search_idx'),
+        ]
+
+
+class ChatMember(models.Model):
+    """
+    a participant of a chat and their read pointer: every message up to
+    (`last_read_timestamp`, `last_read_message`) is read, and `unread_count`
+    other participants' messages were sent after it.
+    """
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='members')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_memberships')
+    # no foreign key constraint, a partitioned chat_message has no unique index on
+    # `id` alone and archived messages stay referenced, `last_read_timestamp` is the pointer.
+    # A deleted message leaves the pointer as it is, which also lets the messages
+    # of a deleted chat or user be deleted in bulk
+    last_read_message = models.ForeignKey(Message, on_delete=models.DO_NOTHING, related_name='+',
+                                          null=True, blank=True, db_constraint=False)
+    last_read_timestamp = models.DateTimeField(null=True, blank=True)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # the table of the former auto-created `Chat.participants` through model
+        db_table = 'chat_chat_participants'
+        unique_together = ('chat', 'user')
+
+
+class Attachment(models.Model):
+    """
+    a stored attachment file, named after the SHA-256 of its content so a file
+    sent many times is stored once. `ref_count` is the number of messages whose
+    `attachment` is this file, files no message references are removed by
+    `collect_chat_attachments` after a grace period.
+    """
+    name = models.CharField(primary_key=True, max_length=255)  # storage name, see `attachment_name`
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    date_created = models.DateTimeField(default=timezone.now, editable=False)
+    # last time a message referenced or released the file
+    date_updated = models.DateTimeField(default=timezone.now)
 
     class Meta:
-        ordering = ('-timestamp',)
+        indexes = [
+            # garbage collection candidates
+            models.Index(fields=['date_updated'], condition=models.Q(ref_count=0),
+                         name='chat_attachment_unref_idx'),
+        ]
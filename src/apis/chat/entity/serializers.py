@@ -18,10 +18,82 @@ class ChatSerializer(serializers.ModelSerializer):
         fields: list[str] = ['id']
 
 
+class ChatListSerializer(serializers.ModelSerializer):
+    """
+    chat with its participants, last message preview and the current user's
+    unread count, for chats annotated by `get_chat_list`
+    """
+    participants = ChatUserSerializer(many=True)
+    last_message = serializers.SerializerMethodField()
+    last_activity = serializers.DateTimeField()
+    unread_count = serializers.IntegerField()
+
+    class Meta:
+        model = Chat
+        fields: list[str] = ['id', 'participants', 'last_message', 'last_activity', 'unread_count']
+
+    def get_last_message(self, chat: Chat) -> dict | None:  # noqa
+        if chat.last_message_id is None:
+            return None
+        return {
+            'id': chat.last_message_id,
+            'sender': chat.last_message_sender_id,
+            'content': chat.last_message_content,
+            'timestamp': serializers.DateTimeField().to_representation(chat.last_message_timestamp),
+            'has_attachment': bool(chat.last_message_attachment),
+        }
+
+
+def is_read_by(pointer: tuple | None, timestamp, message_id: str) -> bool:
+    """
+    whether a read pointer as returned by `get_read_pointers` is at or past the
+    (`timestamp`, `message_id`) message
+    """
+    if pointer is None:
+        return False
+    pointer_timestamp, pointer_message_id, _ = pointer
+    return (timestamp, message_id) <= (pointer_timestamp, pointer_message_id or message_id)
+
+
 class MessageSerializer(serializers.ModelSerializer):
+    """
+    `is_read` and `read_time` come from the receiver's read pointer, passed in
+    the `read_pointers` context as returned by `get_read_pointers`. Messages
+    serialized without it (e.g. just sent) are unread.
+    """
     sender = ChatUserSerializer()
     receiver = ChatUserSerializer()
+    is_read = serializers.SerializerMethodField()
+    read_time = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
-        fields: str = '__all__'
+        fields: list[str] = [
+            'id', 'sender', 'receiver', 'content', 'timestamp', 'is_read', 'read_time', 'attachment', 'chat'
+        ]
+
+    def get_read_pointer(self, message: Message) -> tuple | None:
+        """
+        the receiver's read pointer if it is at or past the message
+        """
+        pointer = self.context.get('read_pointers', {}).get((message.chat_id, message.receiver_id))
+        return pointer if is_read_by(pointer, message.timestamp, message.id) else None
+
+    def get_is_read(self, message: Message) -> bool:
+        return self.get_read_pointer(message) is not None
+
+    def get_read_time(self, message: Message):
+        pointer = self.get_read_pointer(message)
+        if pointer is None or pointer[2] is None:
+            return None
+        return serializers.DateTimeField().to_representation(pointer[2])
+
+
+class MessageSearchSerializer(MessageSerializer):
+    """
+    message matching a search, with the `rank` annotated by `search_messages`
+    """
+    rank = serializers.FloatField()
+
+    class Meta(MessageSerializer.Meta):
+        fields: list[str] = MessageSerializer.Meta.fields + ['rank']
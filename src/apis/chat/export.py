@@ -0,0 +1,69 @@
+import json
+import re
+from typing import Iterable, Iterator
+
+from django.core.files.storage import default_storage
+from django.utils.text import compress_sequence
+from rest_framework import serializers
+
+from .entity.serializers import is_read_by
+
+_datetime_field = serializers.DateTimeField()
+_CODING = re.compile(r'^\s*([^\s;]+)\s*(?:;\s*q\s*=\s*([\d.]+))?', re.IGNORECASE)
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    whether an `Accept-Encoding` header accepts gzip: it names `gzip`, as a
+    whole word like `GZipMiddleware` matches it, or `*`, without `q=0`
+    """
+    for coding in accept_encoding.split(','):
+        match = _CODING.match(coding)
+        if match is None or not re.fullmatch(r'gzip|x-gzip|\*', match.group(1), re.IGNORECASE):
+            continue
+        try:
+            if float(match.group(2) or 1) > 0:
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+def encode_message_row(row: tuple, chat_id: str, read_pointers: dict) -> str:
+    """
+    a message row of `get_export_rows` as a line of JSON in the shape of
+    `MessageSerializer`, without its per-instance field machinery.
+    `read_pointers` are the chat's, as returned by `get_read_pointers`.
+    """
+    message_id, sender_id, sender_username, receiver_id, receiver_username, content, timestamp, attachment = row
+    pointer = read_pointers.get((chat_id, receiver_id))
+    is_read = is_read_by(pointer, timestamp, message_id)
+    return json.dumps({
+        'id': message_id,
+        'sender': {'id': sender_id, 'username': sender_username},
+        'receiver': {'id': receiver_id, 'username': receiver_username} if receiver_id else None,
+        'content': content,
+        'timestamp': _datetime_field.to_representation(timestamp),
+        'is_read': is_read,
+        'read_time': _datetime_field.to_representation(pointer[2]) if is_read and pointer[2] else None,
+        'attachment': default_storage.url(attachment) if attachment else None,
+        'chat': chat_id,
+    }, ensure_ascii=False, separators=(',', ':'))
+
+
+def ndjson_chunks(lines: Iterable[str], batch_size: int, gzip: bool = False) -> Iterator[bytes]:
+    """
+    the lines as newline delimited JSON, one chunk per `batch_size` lines,
+    gzipped as a single stream if `gzip`.
+    """
+    def chunks():
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= batch_size:
+                yield ('\n'.join(batch) + '\n').encode()
+                batch = []
+        if batch:
+            yield ('\n'.join(batch) + '\n').encode()
+
+    return compress_sequence(chunks()) if gzip else chunks()
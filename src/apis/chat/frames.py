@@ -0,0 +1,143 @@
+import json
+from collections import OrderedDict
+
+import msgpack
+
+
+class FrameError(Exception):
+    pass
+
+
+class FrameCodec:
+    """
+    Wire encoding of websocket frames, picked per connection from the
+    subprotocols the client offers (`Sec-WebSocket-Protocol`).
+    """
+
+    subprotocol: str = None
+    # binary codecs carry frames in binary messages, so attachment chunks are
+    # sent as `upload_chunk` frames instead of raw binary messages
+    binary: bool = False
+
+    def dumps(self, content: dict) -> str | bytes:
+        raise NotImplementedError
+
+    def frame(self, payload: str | bytes) -> dict:
+        """
+        return type: dict of `text_data` or `bytes_data` keyword arguments for `send`
+        """
+        raise NotImplementedError
+
+    def encode(self, content: dict) -> dict:
+        return self.frame(self.dumps(content))
+
+    def add_field(self, payload: str | bytes, key: str, value) -> str | bytes:
+        """
+        add a field to an encoded frame without decoding it again
+        """
+        raise NotImplementedError
+
+    def decode(self, text_data: str = None, bytes_data: bytes = None) -> dict:
+        raise NotImplementedError
+
+
+class JSONCodec(FrameCodec):
+    subprotocol = 'chat.json'
+
+    def dumps(self, content: dict) -> str:
+        return json.dumps(content)
+
+    def frame(self, payload: str) -> dict:
+        return {'text_data': payload}
+
+    def add_field(self, payload: str, key: str, value) -> str:
+        field = f'{json.dumps(key)}: {json.dumps(value)}'
+        return f'{{{field}}}' if payload == '{}' else f'{{{field}, {payload[1:]}'
+
+    def decode(self, text_data: str = None, bytes_data: bytes = None) -> dict:
+        if text_data is None:
+            raise FrameError('Expected a text frame.')
+        try:
+            content = json.loads(text_data)
+        except ValueError:
+            raise FrameError('Invalid JSON frame.')
+        if not isinstance(content, dict):
+            raise FrameError('Frame must be an object.')
+        return content
+
+
+class MsgPackCodec(FrameCodec):
+    subprotocol = 'chat.msgpack'
+    binary = True
+
+    def dumps(self, content: dict) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+    def frame(self, payload: bytes) -> dict:
+        return {'bytes_data': payload}
+
+    def add_field(self, payload: bytes, key: str, value) -> bytes:
+        # bump the map length in the header and put the field first
+        field = self.dumps(key) + self.dumps(value)
+        header = payload[0]
+        if header < 0x8f:
+            return bytes([header + 1]) + field + payload[1:]
+        if header == 0x8f:
+            return b'\xde' + (16).to_bytes(2, 'big') + field + payload[1:]
+        if header == 0xde:
+            length = int.from_bytes(payload[1:3], 'big') + 1
+            if length <= 0xffff:
+                return b'\xde' + length.to_bytes(2, 'big') + field + payload[3:]
+            return b'\xdf' + length.to_bytes(4, 'big') + field + payload[3:]
+        length = int.from_bytes(payload[1:5], 'big') + 1
+        return b'\xdf' + length.to_bytes(4, 'big') + field + payload[5:]
+
+    def decode(self, text_data: str = None, bytes_data: bytes = None) -> dict:
+        if bytes_data is None:
+            raise FrameError('Expected a binary frame.')
+        try:
+            content = msgpack.unpackb(bytes_data, raw=False)
+        except (ValueError, msgpack.UnpackException):
+            raise FrameError('Invalid MessagePack frame.')
+        if not isinstance(content, dict):
+            raise FrameError('Frame must be a map.')
+        return content
+
+
+json_codec = JSONCodec()
+
+msgpack_codec = MsgPackCodec()
+
+CODECS: dict = {codec.subprotocol: codec for codec in (json_codec, msgpack_codec)}
+
+
+def negotiate(subprotocols: list[str]) -> tuple:
+    """
+    pick the first subprotocol offered by the client that has a codec,
+    JSON without a subprotocol if there is none.
+    return type: tuple (codec, subprotocol to accept the connection with)
+    """
+    for subprotocol in subprotocols or []:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol], subprotocol
+    return json_codec, None
+
+
+# broadcast frames encoded lately in this process, by frame id and subprotocol
+ENCODED_FRAMES_MAX = 1024
+_encoded_frames: OrderedDict = OrderedDict()
+
+
+def encode_once(frame_id: str, content: dict, codec: FrameCodec) -> str | bytes:
+    """
+    encode a frame fanned out to many sockets once per codec and process: the
+    sockets of this process that receive the frame with the same `frame_id`
+    share the payload, and codecs none of them use are never encoded.
+    """
+    key = (frame_id, codec.subprotocol)
+    payload = _encoded_frames.get(key)
+    if payload is None:
+        payload = _encoded_frames[key] = codec.dumps(content)
+        while len(_encoded_frames) > ENCODED_FRAMES_MAX:
+            _encoded_frames.popitem(last=False)
+    return payload
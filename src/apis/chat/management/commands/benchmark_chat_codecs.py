@@ -0,0 +1,94 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...frames import CODECS
+
+
+def sample_message(index: int) -> dict:
+    """
+    a message as `MessageSerializer` renders it
+    """
+    return {
+        'id': f'message_6ad5223c48ea9255c06c{index:04x}',
+        'sender': {'id': 'user_6ad5223c48ea9255c06ca831', 'username': 'ada.lovelace'},
+        'receiver': {'id': 'user_6ad5223c48ea9255c06ca832', 'username': 'charles.babbage'},
+        'content': 'On my way, should be there in ten minutes. Save me a seat!',
+        'timestamp': '2026-10-18T19:47:08.023625Z',
+        'is_read': False,
+        'read_time': None,
+        'attachment': None,
+        'chat': 'chat_6ad5223c48ea9255c06ca833',
+    }
+
+
+SAMPLE_EVENTS: dict = {
+    'chat_message': {'type': 'chat_message', 'message': sample_message(0)},
+    'read_receipt': {
+        'type': 'read_receipt',
+        'chat_id': 'chat_6ad5223c48ea9255c06ca833',
+        'message_id': 'message_6ad5223c48ea9255c06c0000',
+        'status': 'read',
+        'time': '2026-10-18 19:48:11.532874+00:00'
+    },
+    'read_receipts': {
+        'type': 'read_receipts',
+        'chat_id': 'chat_6ad5223c48ea9255c06ca833',
+        'reader_id': 'user_6ad5223c48ea9255c06ca832',
+        'message_ids': [f'message_6ad5223c48ea9255c06c{i:04x}' for i in range(50)],
+        'up_to': None,
+        'count': 50,
+        'status': 'read',
+        'time': '2026-10-18 19:48:11.532874+00:00'
+    },
+    'typing': {
+        'type': 'typing',
+        'chat_id': 'chat_6ad5223c48ea9255c06ca833',
+        'user_id': 'user_6ad5223c48ea9255c06ca831',
+        'expires_in': 3
+    },
+    'history': {
+        'type': 'history',
+        'messages': [sample_message(i) for i in range(100)],
+        'has_more': True,
+        'truncated': False
+    },
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark payload size and encode/decode CPU of the websocket frame codecs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000, help='encodes and decodes per event and codec')
+
+    def handle(self, *args, **options):
+        """
+        execute command
+        """
+        iterations = options['iterations']
+        self.stdout.write(f"{'event':<14}{'codec':<14}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+        for name, event in SAMPLE_EVENTS.items():
+            # large frames are rarer, keep the run time per event roughly constant
+            rounds = max(1, iterations // len(event.get('messages', [event])))
+            for subprotocol, codec in CODECS.items():
+                frame = codec.encode(event)
+                payload = frame.get('text_data') or frame.get('bytes_data')
+                size = len(payload.encode() if isinstance(payload, str) else payload)
+
+                started = time.process_time()
+                for _ in range(rounds):
+                    codec.encode(event)
+                encode_time = (time.process_time() - started) / rounds
+
+                started = time.process_time()
+                for _ in range(rounds):
+                    codec.decode(**frame)
+                decode_time = (time.process_time() - started) / rounds
+
+                self.stdout.write(
+                    f'{name:<14}{subprotocol:<14}{size:>8}{encode_time * 1e6:>12.2f}{decode_time * 1e6:>12.2f}'
+                )
+        self.stdout.write(self.style.SUCCESS(
+            '==================== Operation Complete! ===================='
+        ))
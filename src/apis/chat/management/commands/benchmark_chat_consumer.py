@@ -0,0 +1,218 @@
+import asyncio
+import math
+import random
+import resource
+import secrets
+import time
+
+from asgiref.sync import sync_to_async
+from channels.layers import InMemoryChannelLayer, channel_layers
+from channels.testing import WebsocketCommunicator
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from ....clients import enums as client_enums
+from ....users.models import User
+from ...entity.models import Chat
+from ...outbox import send_queue_stats
+from ...write_behind import message_writer
+
+
+def current_rss() -> int:
+    """
+    resident set size of this process in bytes
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # peak rather than current RSS, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class BenchmarkChannelLayer(InMemoryChannelLayer):
+    """
+    `InMemoryChannelLayer` expires messages and groups by scanning every channel
+    on each send and receive, which would dominate a run with thousands of
+    sockets. Scan at most once a second instead.
+    """
+
+    _cleaned_at = 0.0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now - self._cleaned_at >= 1:
+            self._cleaned_at = now
+            super()._clean_expired()
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the chat websocket consumers: runs the ASGI application with its '
+        'TokenAuthMiddleware over an in-memory channel layer and the configured database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chats', type=int, default=50, help='number of concurrent chats')
+        parser.add_argument('--group-size', type=int, default=2, help='participants (sockets) per chat')
+        parser.add_argument('--messages', type=int, default=20, help='messages sent per chat')
+        parser.add_argument('--read-ratio', type=float, default=0.0,
+                            help='share of received messages acknowledged with a read_messages frame')
+        parser.add_argument('--endpoint', choices=['chat', 'inbox'], default='chat',
+                            help='connect to ws/chat/<chat_id>/ or ws/inbox/')
+        parser.add_argument('--connect-concurrency', type=int, default=100,
+                            help='sockets opening their connection at the same time')
+        parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for a single frame')
+        parser.add_argument('--write-behind', action='store_true', help='persist messages with CHAT_WRITE_BEHIND')
+        parser.add_argument('--seed', type=int, default=None, help='seed of the send/read mix')
+
+    def handle(self, *args, **options):
+        """
+        execute command
+        """
+        prefix = f'bench_{secrets.token_hex(4)}_'
+        if options['write_behind']:
+            settings.CHAT_WRITE_BEHIND = True
+        # measure throughput, not the message and read rate limits
+        unlimited = {'connection': (math.inf, math.inf), 'user': (math.inf, math.inf)}
+        settings.CHAT_RATE_LIMITS = {**settings.CHAT_RATE_LIMITS, 'message': unlimited, 'read': unlimited}
+        channel_layers.set('default', BenchmarkChannelLayer(capacity=max(100, options['messages'] * 4)))
+        random.seed(options['seed'])
+
+        self.stdout.write(f"seeding {options['chats']} chats of {options['group_size']} users...")
+        try:
+            chats = self._seed(prefix, options['chats'], options['group_size'])
+            results = asyncio.run(self._run(chats, options))
+        finally:
+            message_writer.flush()
+            self._cleanup(prefix)
+        self._report(results)
+        if options['write_behind']:
+            self.stdout.write(f'write-behind: {message_writer.stats()}')
+
+    def _seed(self, prefix: str, number_of_chats: int, group_size: int) -> list[tuple]:
+        """
+        create `group_size` users per chat.
+        return type: list of (chat id, list of tokens), the first token is the sender's
+        """
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}{i}_{j}', role=client_enums.RoleEnum.APP_USER)
+            for i in range(number_of_chats) for j in range(group_size)
+        ])
+        chats = Chat.objects.bulk_create([Chat() for _ in range(number_of_chats)])  # noqa
+        Chat.participants.through.objects.bulk_create([
+            Chat.participants.through(chat_id=chat.id, user_id=user.id)
+            for i, chat in enumerate(chats) for user in users[i * group_size:(i + 1) * group_size]
+        ])
+        # parse the signing key once instead of once per token
+        settings.PRIVATE_KEY = load_pem_private_key(settings.PRIVATE_KEY.encode(), password=None)
+        return [
+            (chat.id, [user.get_token('read write') for user in users[i * group_size:(i + 1) * group_size]])
+            for i, chat in enumerate(chats)
+        ]
+
+    def _cleanup(self, prefix: str):
+        Chat.objects.filter(participants__username__startswith=prefix).delete()  # noqa
+        User.objects.filter(username__startswith=prefix).delete()
+
+    async def _run(self, chats: list[tuple], options: dict) -> dict:
+        from core.sgi.asgi import application
+
+        timeout = options['timeout']
+        messages = options['messages']
+
+        def communicator(chat_id: str, token: str) -> WebsocketCommunicator:
+            path = f'/ws/chat/{chat_id}/' if options['endpoint'] == 'chat' else '/ws/inbox/'
+            return WebsocketCommunicator(
+                application, path, headers=[(b'authorization', f'Bearer {token}'.encode())]
+            )
+
+        sockets = [(chat_id, [communicator(chat_id, token) for token in tokens]) for chat_id, tokens in chats]
+        all_sockets = [socket for _, participants in sockets for socket in participants]
+
+        # connect phase
+        rss_before = current_rss()
+        semaphore = asyncio.Semaphore(options['connect_concurrency'])
+        rejected = 0
+
+        async def connect(socket: WebsocketCommunicator):
+            nonlocal rejected
+            async with semaphore:
+                connected, _ = await socket.connect(timeout=timeout)
+                if not connected:
+                    rejected += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(connect(socket) for socket in all_sockets))
+        connect_time = time.perf_counter() - started
+        rss_per_connection = (current_rss() - rss_before) / max(1, len(all_sockets))
+
+        # drive phase, the first participant of each chat sends and the others receive
+        latencies: list[float] = []
+        read_acks = 0
+
+        async def receive(chat_id: str, socket: WebsocketCommunicator):
+            nonlocal read_acks
+            received = 0
+            while received < messages:
+                frame = await socket.receive_json_from(timeout=timeout)
+                if frame.get('type') != 'chat_message':
+                    continue
+                received += 1
+                latencies.append(time.perf_counter() - float(frame['message']['content']))
+                if random.random() < options['read_ratio']:
+                    read_acks += 1
+                    await socket.send_json_to({
+                        'type': 'read_messages', 'chat_id': chat_id, 'up_to': frame['message']['id']
+                    })
+
+        async def drive(chat_id: str, participants: list[WebsocketCommunicator]):
+            sender, receivers = participants[0], participants[1:]
+            for _ in range(messages):
+                await sender.send_json_to({'chat_id': chat_id, 'message': f'{time.perf_counter()}'})
+            await asyncio.gather(*(receive(chat_id, receiver) for receiver in receivers))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(drive(chat_id, participants) for chat_id, participants in sockets))
+        elapsed = time.perf_counter() - started
+        queue_stats = send_queue_stats()
+
+        await asyncio.gather(*(socket.disconnect() for socket in all_sockets))
+        # the consumers' queries ran on the loop's worker thread, close its connection
+        await sync_to_async(connections.close_all)()
+        return {
+            'sockets': len(all_sockets),
+            'rejected': rejected,
+            'connect_time': connect_time,
+            'rss_per_connection': rss_per_connection,
+            'messages': len(sockets) * messages,
+            'read_acks': read_acks,
+            'elapsed': elapsed,
+            'latencies': latencies,
+            'send_queues': queue_stats,
+        }
+
+    def _report(self, results: dict):
+        latencies = sorted(results['latencies'])
+        elapsed = results['elapsed']
+        self.stdout.write(f"sockets: {results['sockets']} ({results['rejected']} rejected)")
+        self.stdout.write(f"connect rate: {results['sockets'] / results['connect_time']:.1f} sockets/sec")
+        # the test clients live in the same process, so this includes their share
+        self.stdout.write(f"rss per connection: {results['rss_per_connection'] / 1024:.1f} KiB")
+        self.stdout.write(f"messages sent: {results['messages']} ({results['messages'] / elapsed:.1f}/sec)")
+        self.stdout.write(f"read acks sent: {results['read_acks']}")
+        self.stdout.write(f'frames delivered: {len(latencies)} ({len(latencies) / elapsed:.1f}/sec)')
+        self.stdout.write(f'elapsed: {elapsed:.2f}s')
+        for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            self.stdout.write(f'{name} fan-out latency: {percentile(latencies, fraction) * 1000:.1f}ms')
+        self.stdout.write(f"max fan-out latency: {(latencies[-1] if latencies else 0) * 1000:.1f}ms")
+        self.stdout.write(f"send queues: {results['send_queues']}")
+        self.stdout.write(self.style.SUCCESS(
+            '==================== Operation Complete! ===================='
+        ))
@@ -0,0 +1,62 @@
+import time
+import uuid
+
+from channels_redis.core import RedisChannelLayer
+from django.core.management.base import BaseCommand
+
+from ...frames import encode_once, json_codec
+from .benchmark_chat_codecs import sample_message
+
+
+class Command(BaseCommand):
+    help = 'Benchmark CPU per chat message fan-out, encoding per recipient vs once per codec and process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group-sizes', type=int, nargs='+', default=[2, 50, 1000],
+                            help='recipient sockets per message')
+        parser.add_argument('--rounds', type=int, default=200, help='fan-outs measured per group size')
+
+    def handle(self, *args, **options):
+        """
+        execute command
+        """
+        # only used for its (de)serialization, no Redis connection is opened
+        layer = RedisChannelLayer()
+        message = sample_message(0)
+
+        def per_recipient(group_size: int):
+            # the event carries the serializer's dict, every socket encodes the frame
+            event = {'type': 'chat_message', 'chat_id': message['chat'], 'message': message}
+            for _ in range(group_size):
+                received = layer.deserialize(layer.serialize(event))
+                json_codec.encode({'type': 'chat_message', 'message': received['message']})
+
+        def encoded_once(group_size: int):
+            # the event carries the frame and its id, the first socket of the
+            # process encodes it and the others reuse the payload
+            event = {
+                'type': 'chat_message',
+                'chat_id': message['chat'],
+                'message_id': message['id'],
+                'frame': {'type': 'chat_message', 'message': message},
+                'frame_id': uuid.uuid4().hex
+            }
+            for _ in range(group_size):
+                received = layer.deserialize(layer.serialize(event))
+                json_codec.frame(encode_once(received['frame_id'], received['frame'], json_codec))
+
+        self.stdout.write(f"{'recipients':>10}{'per recipient us':>20}{'encoded once us':>18}{'speedup':>10}")
+        for group_size in options['group_sizes']:
+            rounds = max(1, options['rounds'] * 50 // max(group_size, 50))
+            timings = []
+            for fan_out in (per_recipient, encoded_once):
+                started = time.process_time()
+                for _ in range(rounds):
+                    fan_out(group_size)
+                timings.append((time.process_time() - started) / rounds)
+            self.stdout.write(
+                f'{group_size:>10}{timings[0] * 1e6:>20.1f}{timings[1] * 1e6:>18.1f}{timings[0] / timings[1]:>9.2f}x'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            '==================== Operation Complete! ===================='
+        ))
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ... import attachments
+
+
+class Command(BaseCommand):
+    help = ('Delete stored attachments no message has referenced for the grace period, and stored '
+            'attachment files without an attachment row')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=settings.CHAT_ATTACHMENT_GC_GRACE / 3600,
+                            help='hours an attachment has to be unreferenced before it is deleted')
+        parser.add_argument('--skip-orphans', action='store_true',
+                            help='do not scan storage for files without an attachment row')
+        parser.add_argument('--dry-run', action='store_true', help='only list what would be deleted')
+
+    def handle(self, *args, **options):
+        """
+        execute command
+        """
+        grace = timedelta(hours=options['grace_hours'])
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+
+        collected = attachments.collect_attachments(grace, options['dry_run'])
+        for name in collected:
+            self.stdout.write(f'{action} {name}')
+        self.stdout.write(self.style.SUCCESS(f'{action} {len(collected)} unreferenced attachments'))
+
+        if not options['skip_orphans']:
+            orphans = attachments.collect_orphan_files(grace, options['dry_run'])
+            for name in orphans:
+                self.stdout.write(f'{action} orphan {name}')
+            self.stdout.write(self.style.SUCCESS(f'{action} {len(orphans)} orphan attachment files'))
+
+        self.stdout.write(self.style.SUCCESS(
+            '==================== Operation Complete! ===================='
+        ))
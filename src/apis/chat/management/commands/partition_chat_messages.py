@@ -0,0 +1,60 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ... import partitions
+
+
+class Command(BaseCommand):
+    help = ('Create the chat_message partitions of the coming months, then detach the partitions past '
+            'the retention, archive them to gzipped JSON lines and drop them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=settings.CHAT_MESSAGE_PARTITIONS_AHEAD,
+                            help='months after the current one to create partitions for')
+        parser.add_argument('--retention-months', type=int, default=settings.CHAT_MESSAGE_RETENTION_MONTHS,
+                            help='partitions ending before the start of this many months ago are archived')
+        parser.add_argument('--destination', default=settings.CHAT_MESSAGE_ARCHIVE_DESTINATION,
+                            help='local directory or s3://bucket/prefix to write archives to')
+        parser.add_argument('--keep-tables', action='store_true',
+                            help='keep the archived partitions as `<name>_archived` tables instead of dropping them')
+        parser.add_argument('--dry-run', action='store_true', help='only list what would be done')
+
+    def handle(self, *args, **options):
+        """
+        execute command
+        """
+        now = datetime.now(dt_timezone.utc)
+        cutoff = partitions.month_start(now, -options['retention_months'])
+        expired = [
+            partition.name for partition in partitions.list_partitions()
+            if partition.end is not None and partition.end <= cutoff
+        ]
+        # detached by a previous run that did not finish archiving them
+        leftover = partitions.list_detached_partitions()
+
+        if options['dry_run']:
+            self.stdout.write(f'partitions to archive (ending by {cutoff:%Y-%m-%d}): {", ".join(expired) or "none"}')
+            self.stdout.write(f'detached partitions to archive: {", ".join(leftover) or "none"}')
+            return
+
+        for name in partitions.create_partitions(options['months_ahead'], now):
+            self.stdout.write(self.style.SUCCESS(f'Created partition {name}'))
+
+        for name in expired:
+            partitions.detach_partition(name)
+            self.stdout.write(f'Detached partition {name}')
+
+        for name in sorted(set(expired + leftover)):
+            location, rows = partitions.archive_table(name, options['destination'])
+            self.stdout.write(self.style.SUCCESS(f'Archived {rows} messages of {name} to {location}'))
+            partitions.retire_table(name, keep=options['keep_tables'])
+            if options['keep_tables']:
+                self.stdout.write(f'Renamed {name} to {name}_archived')
+            else:
+                self.stdout.write(f'Dropped {name}')
+
+        self.stdout.write(self.style.SUCCESS(
+            '==================== Operation Complete! ===================='
+        ))
@@ -1,3 +1,12 @@
+import asyncio
+import functools
+import hashlib
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
@@ -7,13 +16,130 @@ from ..users.models import User
 from ..users.db_queries import base as user_db_query
 
 
+class TokenCache:
+    """
+    LRU of verified token digests to their JWT payload, an entry is dropped
+    once the token expires. Only touched from the event loop, so no lock.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, digest: str) -> dict | None:
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        payload, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[digest]
+            return None
+        self._entries.move_to_end(digest)
+        return payload
+
+    def set(self, digest: str, payload: dict, expires_at: float):
+        self._entries[digest] = (payload, expires_at)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class UserCache:
+    """
+    users by id, kept for `ttl` seconds
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, user_id: str) -> User | None:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        user, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[user_id]
+            return None
+        return user
+
+    def set(self, user_id: str, user: User):
+        self._entries[user_id] = (user, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+token_cache = TokenCache(settings.CHAT_AUTH_TOKEN_CACHE_SIZE)
+
+user_cache = UserCache(settings.CHAT_AUTH_USER_CACHE_TTL, settings.CHAT_AUTH_TOKEN_CACHE_SIZE)
+
+# signature verification is CPU bound, keep it off the event loop
+verify_executor = ThreadPoolExecutor(
+    max_workers=settings.CHAT_AUTH_VERIFY_WORKERS, thread_name_prefix='jwt-verify'
+)
+
+# verifications in flight, so a burst of sockets with the same token verifies it once
+_pending: dict = {}
+
+
+def _verified(digest: str, future: asyncio.Future):
+    del _pending[digest]
+    if not future.cancelled():
+        # retrieved even if every socket waiting on it is gone
+        future.exception()
+
+
+def verify_token(token_key: str) -> dict:
+    token_auth = bear_token_auth.TokenAuthentication()
+    token_auth_payload, _ = token_auth.authenticate_token(token_key)
+    return token_auth_payload
+
+
+async def get_token_payload(token_key: str) -> dict | None:
+    """
+    return type: dict, the payload of a valid unexpired token, otherwise None
+    """
+    digest = hashlib.sha256(token_key.encode()).hexdigest()
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return payload
+
+    future = _pending.get(digest)
+    if future is None:
+        future = asyncio.get_running_loop().run_in_executor(verify_executor, verify_token, token_key)
+        _pending[digest] = future
+        future.add_done_callback(functools.partial(_verified, digest))
+    # a connect cancelled while waiting must not cancel the verification for
+    # the other sockets with the same token
+    payload = await asyncio.shield(future)
+
+    if not payload or not isinstance(payload, dict):
+        return None
+    if datetime.now() > payload['expiry_time']:
+        # `authenticate_token` also decodes expired tokens
+        return None
+    token_cache.set(digest, payload, payload['expiry_time'].timestamp())
+    return payload
+
+
 @database_sync_to_async
 def get_user(user_id: str) -> User | AnonymousUser:
     user = user_db_query.get_user_by_id(user_id)
     if user:
         return user
     else:
-        AnonymousUser()
+        return AnonymousUser()
+
+
+async def get_cached_user(user_id: str) -> User | AnonymousUser:
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await get_user(user_id)
+        if user.is_authenticated:
+            user_cache.set(user_id, user)
+    return user
 
 
 class TokenAuthMiddleware(BaseMiddleware):
@@ -27,12 +153,11 @@ class TokenAuthMiddleware(BaseMiddleware):
         if b'authorization' in headers:
             token_name, token_key = headers[b'authorization'].decode().split()  # noqa
             if token_name.lower() == 'bearer':
-                token_auth = bear_token_auth.TokenAuthentication()
-                token_auth_payload, _ = token_auth.authenticate_token(token_key)
-                if token_auth_payload and isinstance(token_auth_payload, dict):
+                token_auth_payload = await get_token_payload(token_key)
+                if token_auth_payload:
                     user_id = token_auth_payload.get('sub', '')
                     if user_id:
-                        scope['user'] = await get_user(user_id)
+                        scope['user'] = await get_cached_user(user_id)
                     else:
                         scope['user'] = AnonymousUser()
         return await super().__call__(scope, receive, send)
@@ -0,0 +1,22 @@
+# Generated by Django 5.0 on 2026-10-18 20:10
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # build the index without locking writes to chat_message
+    atomic = False
+
+    dependencies = [
+        ('chat', '0004_message_timestamp_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['chat', 'timestamp', 'id'], name='chat_message_chat_ts_id_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-18 20:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_chat_timestamp_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='date_created',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
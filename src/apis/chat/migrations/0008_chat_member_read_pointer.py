@@ -0,0 +1,55 @@
+# Generated by Django 5.0 on 2026-10-18 20:14
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_chat_member'),
+    ]
+
+    operations = [
+        # point every member at the last message they read and count what came after it
+        migrations.RunSQL(
+            sql=[
+                """
+                UPDATE chat_chat_participants AS member
+                SET last_read_message_id = pointer.id,
+                    last_read_timestamp = pointer.timestamp,
+                    last_read_at = pointer.read_time
+                FROM (
+                    SELECT DISTINCT ON (chat_id, receiver_id) chat_id, receiver_id, id, timestamp, read_time
+                    FROM chat_message
+                    WHERE is_read
+                    ORDER BY chat_id, receiver_id, timestamp DESC, id DESC
+                ) AS pointer
+                WHERE pointer.chat_id = member.chat_id AND pointer.receiver_id = member.user_id
+                """,
+                """
+                UPDATE chat_chat_participants AS member
+                SET unread_count = (
+                    SELECT count(*)
+                    FROM chat_message AS message
+                    WHERE message.chat_id = member.chat_id
+                      AND message.sender_id <> member.user_id
+                      AND (
+                          member.last_read_timestamp IS NULL
+                          OR (message.timestamp, message.id) > (member.last_read_timestamp, member.last_read_message_id)
+                      )
+                )
+                """,
+                # check the new foreign keys now, chat_message is altered next
+                'SET CONSTRAINTS ALL IMMEDIATE',
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='read_time',
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0 on 2026-10-18 20:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_chat_member_read_pointer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='direct_key',
+            field=models.CharField(blank=True, editable=False, max_length=121, null=True, unique=True),
+        ),
+        # key the existing two-participant chats (user ids in byte order, as
+        # `direct_chat_key` sorts them), the oldest one of a pair that was
+        # created more than once keeps the key
+        migrations.RunSQL(
+            sql="""
+            UPDATE chat_chat
+            SET direct_key = pair.direct_key
+            FROM (
+                SELECT DISTINCT ON (pairs.direct_key) pairs.chat_id, pairs.direct_key
+                FROM (
+                    SELECT chat_id, min(user_id COLLATE "C") || ':' || max(user_id COLLATE "C") AS direct_key
+                    FROM chat_chat_participants
+                    GROUP BY chat_id
+                    HAVING count(*) = 2
+                ) AS pairs
+                JOIN chat_chat ON chat_chat.id = pairs.chat_id
+                ORDER BY pairs.direct_key, chat_chat.date_created, chat_chat.id
+            ) AS pair
+            WHERE chat_chat.id = pair.chat_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0 on 2026-10-18 20:19
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # build the index without locking writes to chat_message
+    atomic = False
+
+    dependencies = [
+        ('chat', '0009_chat_direct_key'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='message',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('content', config='english'), name='chat_message_search_idx'),
+        ),
+    ]
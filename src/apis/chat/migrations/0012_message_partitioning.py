@@ -0,0 +1,129 @@
+# Generated by Django 5.0 on 2026-10-18 20:25
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import migrations, transaction
+
+
+def month_start(value, months=0):
+    month = value.year * 12 + value.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_messages(apps, schema_editor):
+    """
+    turn chat_message into a table range partitioned by month on `timestamp`.
+    The existing table becomes the `chat_message_legacy` partition of every
+    message before the first new month, checked and indexed beforehand so it
+    is attached without a scan and writes are only blocked for the renames.
+    """
+    Message = apps.get_model('chat', 'Message')  # noqa
+    table = Message._meta.db_table
+    legacy = f'{table}_legacy'
+    with schema_editor.connection.cursor() as cursor:
+        # a partitioned table's primary key has to include the partition key
+        cursor.execute(
+            f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "{legacy}_id_timestamp_uniq" '
+            f'ON "{table}" ("id", "timestamp")'
+        )
+        cursor.execute(f'SELECT max("timestamp") FROM "{table}"')
+        latest = cursor.fetchone()[0]
+        now = datetime.now(dt_timezone.utc)
+        # a day of headroom so messages sent while this runs still fit in the legacy partition
+        boundary = month_start(max(now, latest or now) + timedelta(days=1), 1)
+        cursor.execute(f'ALTER TABLE "{table}" DROP CONSTRAINT IF EXISTS "{legacy}_range"')
+        cursor.execute(
+            f'ALTER TABLE "{table}" ADD CONSTRAINT "{legacy}_range" CHECK ("timestamp" < %s) NOT VALID', [boundary]
+        )
+        # only takes a lock that lets reads and writes through
+        cursor.execute(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT "{legacy}_range"')
+
+    with transaction.atomic(), schema_editor.connection.cursor() as cursor:
+        # give up rather than queue every query behind the renames
+        cursor.execute("SET LOCAL lock_timeout = '10s'")
+        cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{legacy}"')
+        cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', [legacy])
+        for index, in cursor.fetchall():
+            if not index.startswith(legacy):
+                cursor.execute(f'ALTER INDEX "{index}" RENAME TO "{legacy}{index[len(table):]}"')
+        # the (id, timestamp) index takes over as the primary key, attached to the parent's
+        cursor.execute(f'ALTER TABLE "{legacy}" DROP CONSTRAINT "{legacy}_pkey"')
+        cursor.execute(
+            f'ALTER TABLE "{legacy}" ADD CONSTRAINT "{legacy}_pkey" PRIMARY KEY USING INDEX "{legacy}_id_timestamp_uniq"'
+        )
+
+        cursor.execute(
+            f'CREATE TABLE "{table}" (LIKE "{legacy}" INCLUDING DEFAULTS INCLUDING GENERATED) '
+            f'PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_pkey" PRIMARY KEY ("id", "timestamp")')
+        # the chat id index is covered by the (chat, timestamp, id) index
+        for field in ('sender', 'receiver'):
+            cursor.execute(str(schema_editor._create_index_sql(Message, fields=[Message._meta.get_field(field)])))
+        for index in Message._meta.indexes:
+            cursor.execute(str(index.create_sql(Message, schema_editor)))
+        for field in ('chat', 'sender', 'receiver'):
+            cursor.execute(str(schema_editor._create_fk_sql(
+                Message, Message._meta.get_field(field), '_fk_%(to_table)s_%(to_column)s'
+            )))
+
+        # the legacy table's matching indexes and foreign keys are reused
+        cursor.execute(
+            f'ALTER TABLE "{table}" ATTACH PARTITION "{legacy}" FOR VALUES FROM (MINVALUE) TO (%s)', [boundary]
+        )
+        cursor.execute(f'ALTER TABLE "{legacy}" DROP CONSTRAINT "{legacy}_range"')
+        cursor.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+        for months in range(settings.CHAT_MESSAGE_PARTITIONS_AHEAD + 1):
+            start, end = month_start(boundary, months), month_start(boundary, months + 1)
+            cursor.execute(
+                f'CREATE TABLE "{table}_y{start.year:04d}m{start.month:02d}" PARTITION OF "{table}" '
+                f'FOR VALUES FROM (%s) TO (%s)', [start, end]
+            )
+
+
+def unpartition_messages(apps, schema_editor):
+    """
+    turn chat_message back into a plain table: the rows of every other
+    partition are copied into `chat_message_legacy`, which takes the table's
+    name, indexes and single column primary key back.
+    """
+    Message = apps.get_model('chat', 'Message')  # noqa
+    table = Message._meta.db_table
+    legacy = f'{table}_legacy'
+    columns = ', '.join(f'"{field.column}"' for field in Message._meta.concrete_fields)
+    with transaction.atomic(), schema_editor.connection.cursor() as cursor:
+        cursor.execute("SET LOCAL lock_timeout = '10s'")
+        # check the copied rows' foreign keys now, a table with pending checks can't be altered
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass',
+            [table]
+        )
+        for partition, in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{partition}"')
+            if partition != legacy:
+                cursor.execute(f'INSERT INTO "{legacy}" ({columns}) SELECT {columns} FROM "{partition}"')
+                cursor.execute(f'DROP TABLE "{partition}"')
+        cursor.execute(f'DROP TABLE "{table}"')
+
+        cursor.execute(f'ALTER TABLE "{legacy}" DROP CONSTRAINT "{legacy}_pkey"')
+        cursor.execute(f'ALTER TABLE "{legacy}" RENAME TO "{table}"')
+        cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', [table])
+        for index, in cursor.fetchall():
+            if index.startswith(legacy):
+                cursor.execute(f'ALTER INDEX "{index}" RENAME TO "{table}{index[len(legacy):]}"')
+        cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_pkey" PRIMARY KEY ("id")')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('chat', '0011_message_partitioning_prep'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_messages, unpartition_messages),
+    ]
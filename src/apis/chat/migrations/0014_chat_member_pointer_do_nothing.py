@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-18 21:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_attachment'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatmember',
+            name='last_read_message',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='chat.message'),
+        ),
+    ]
@@ -0,0 +1,182 @@
+import asyncio
+import functools
+import weakref
+from collections import deque
+
+
+class SendQueueFull(Exception):
+    pass
+
+
+class SendQueue:
+    """
+    Bounded queue of outbound websocket messages for one connection, drained
+    by the connection's writer task while the server keeps up with the client.
+
+    Frames that can be lost without breaking the conversation (receipts,
+    typing and presence updates) are queued with a `key`. A frame queued with
+    the key of a frame that is still waiting replaces it in place. Once the
+    frames still undelivered, those queued plus the connection's events
+    waiting in the channel layer (`backlog`), reach `high_water`, keyed frames
+    are dropped to make room for the others. `put` raises `SendQueueFull` when
+    a frame without a key cannot be queued, the connection then has to be
+    closed. Nothing is queued once the queue is closed.
+    """
+
+    def __init__(self, high_water: int, backlog=lambda: 0, write_buffer=lambda: 0):
+        self.high_water = high_water
+        self.backlog = backlog
+        self.write_buffer = write_buffer
+        self._entries: deque = deque()
+        self._keyed: dict = {}
+        self._ready = asyncio.Event()
+        self._sent = asyncio.Event()
+        self.closed = False
+        self.stats: dict = {
+            'sent': 0,
+            'coalesced': 0,
+            'dropped': 0,
+            'max_depth': 0,
+        }
+        _queues.add(self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def depth(self) -> int:
+        """
+        frames not delivered yet, queued or waiting in the channel layer
+        """
+        return len(self._entries) + self.backlog()
+
+    def put(self, message: dict, key=None):
+        if self.closed:
+            return
+        if key is not None and key in self._keyed:
+            self._keyed[key][1] = message
+            self.stats['coalesced'] += 1
+            totals['coalesced'] += 1
+            return
+        if self.depth >= self.high_water:
+            if key is not None:
+                self._dropped(1)
+                return
+            self._drop_keyed()
+            if self.depth >= self.high_water:
+                self.closed = True
+                totals['slow_consumers_closed'] += 1
+                raise SendQueueFull()
+        self._append(message, key)
+
+    def close(self, message: dict):
+        """
+        queue the close message after everything already queued
+        """
+        if not self.closed:
+            self._append(message, None)
+            self.closed = True
+
+    def discard(self):
+        """
+        stop queueing and leave the metrics, once the connection is gone
+        """
+        self.closed = True
+        _queues.discard(self)
+
+    async def wait(self):
+        """
+        wait until a frame is queued
+        """
+        while not self._entries:
+            self._ready.clear()
+            await self._ready.wait()
+
+    async def get(self) -> dict:
+        await self.wait()
+        key, message = self._entries.popleft()
+        if key is not None:
+            del self._keyed[key]
+        self.stats['sent'] += 1
+        totals['sent'] += 1
+        self._sent.set()
+        return message
+
+    async def join(self, depth: int = 0):
+        """
+        wait until at most `depth` frames are queued, or the queue is closed
+        """
+        while len(self._entries) > depth and not self.closed:
+            self._sent.clear()
+            await self._sent.wait()
+
+    def _append(self, message: dict, key):
+        entry = [key, message]
+        self._entries.append(entry)
+        if key is not None:
+            self._keyed[key] = entry
+        self.stats['max_depth'] = max(self.stats['max_depth'], len(self._entries))
+        self._ready.set()
+
+    def _drop_keyed(self):
+        if not self._keyed:
+            return
+        self._dropped(len(self._keyed))
+        self._entries = deque(entry for entry in self._entries if entry[0] is None)
+        self._keyed.clear()
+
+    def _dropped(self, count: int):
+        self.stats['dropped'] += count
+        totals['dropped'] += count
+
+
+_queues = weakref.WeakSet()
+
+totals: dict = {'sent': 0, 'coalesced': 0, 'dropped': 0, 'slow_consumers_closed': 0}
+
+
+def transport_write_buffer(send) -> int | None:
+    """
+    bytes the server holds for the client that the client has not read yet.
+    Daphne's ASGI `send` is bound to the connection's protocol, whose Twisted
+    transport buffers what the socket can't take.
+    return type: int, None if `send` is not Daphne's
+    """
+    protocol = send.args[0] if isinstance(send, functools.partial) and send.args else None
+    transport = getattr(protocol, 'transport', None)
+    # TLS wraps the TCP transport
+    while transport is not None and not hasattr(transport, 'dataBuffer'):
+        transport = getattr(transport, 'transport', None)
+    if transport is None:
+        return None
+    return len(transport.dataBuffer) - transport.offset + transport._tempDataLen  # noqa
+
+
+def channel_layer_backlog(channel_layer, channel_name: str) -> int:
+    """
+    events the channel layer received for the channel that its consumer has
+    not handled yet
+    """
+    # the receive buffers of `RedisChannelLayer`, the queues of `InMemoryChannelLayer`
+    buffers = getattr(channel_layer, 'receive_buffer', None)
+    if buffers is None:
+        buffers = getattr(channel_layer, 'channels', None)
+    queue = buffers.get(channel_name) if isinstance(buffers, dict) else None
+    return queue.qsize() if queue is not None else 0
+
+
+def send_queue_stats() -> dict:
+    """
+    send queue metrics of every open connection of this process
+    """
+    queues = list(_queues)
+    depths = [queue.depth for queue in queues]
+    write_buffers = [queue.write_buffer() for queue in queues]
+    return {
+        'connections': len(depths),
+        'queued_frames': sum(depths),
+        'max_queue_depth': max(depths, default=0),
+        'buffered_bytes': sum(write_buffers),
+        'max_buffered_bytes': max(write_buffers, default=0),
+        **totals,
+    }
@@ -0,0 +1,239 @@
+import gzip
+import os
+import re
+import shutil
+import tempfile
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .db_queries import base as chat_db_queries
+from .entity.models import Message
+
+
+# `chat_message` is range partitioned by `timestamp`, one partition per month
+# named after it, plus `chat_message_legacy` holding the history from before
+# partitioning and `chat_message_default` catching rows no partition covers
+TABLE = Message._meta.db_table
+LEGACY_PARTITION = f'{TABLE}_legacy'
+DEFAULT_PARTITION = f'{TABLE}_default'
+# a default partition detached to create the partitions of its rows, until they are moved
+DETACHED_DEFAULT = f'{TABLE}_default_detached'
+PARTITION_NAME = re.compile(rf'^{TABLE}_(legacy|y\d{{4}}m\d{{2}})$')
+_BOUND = re.compile(r"FROM \((.+)\) TO \((.+)\)")
+
+
+@dataclass
+class Partition:
+    name: str
+    # None for MINVALUE/MAXVALUE
+    start: datetime | None
+    end: datetime | None
+
+
+def month_start(value: datetime, months: int = 0) -> datetime:
+    """
+    midnight UTC of the first day of the month `months` after the one of `value`
+    """
+    month = value.year * 12 + value.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(start: datetime) -> str:
+    return f'{TABLE}_y{start.year:04d}m{start.month:02d}'
+
+
+def _parse_bound(value: str) -> datetime | None:
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def _columns() -> list[str]:
+    # stored columns, generated ones are filled in by postgres
+    return [field.column for field in Message._meta.concrete_fields if not field.generated]
+
+
+def list_partitions() -> list[Partition]:
+    """
+    the range partitions of chat_message, oldest first, without the default partition
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            """,
+            [TABLE]
+        )
+        rows = cursor.fetchall()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND.search(bound)
+        if match is None:
+            continue
+        partitions.append(Partition(name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition.start or datetime.min.replace(tzinfo=dt_timezone.utc))
+
+
+def list_detached_partitions() -> list[str]:
+    """
+    former partitions detached but not archived yet, e.g. by an interrupted archival
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname FROM pg_class c
+            WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace
+            AND c.relname LIKE %s AND NOT c.relispartition
+            """,
+            [f'{TABLE}\\_%']
+        )
+        return sorted(name for name, in cursor.fetchall() if PARTITION_NAME.match(name))
+
+
+def create_partitions(months_ahead: int, now: datetime = None, lock_timeout: str = '10s',
+                      batch_size: int = 5000) -> list[str]:
+    """
+    create the monthly partitions from the current month to `months_ahead`
+    months after it that no partition covers yet, in one transaction that
+    gives up if its locks on chat_message are not granted within `lock_timeout`.
+
+    If the default partition holds rows of the new months it is detached and
+    replaced by an empty one in that transaction, and its rows are then moved
+    back `batch_size` at a time (see `move_detached_default`), so chat_message
+    is never locked for the whole move. Its rows are not visible until moved.
+    returns the names of the partitions created.
+    """
+    now = now or datetime.now(dt_timezone.utc)
+    # finish the move of an interrupted run first
+    move_detached_default(batch_size)
+    partitions = list_partitions()
+    months = []
+    for offset in range(months_ahead + 1):
+        start, end = month_start(now, offset), month_start(now, offset + 1)
+        if not any(
+            (partition.start is None or partition.start < end) and (partition.end is None or partition.end > start)
+            for partition in partitions
+        ):
+            months.append((start, end))
+
+    if months:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SET LOCAL lock_timeout = %s', [lock_timeout])
+            in_new_months = ' OR '.join(['("timestamp" >= %s AND "timestamp" < %s)'] * len(months))
+            cursor.execute(f'SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE {in_new_months} LIMIT 1',
+                           [bound for month in months for bound in month])
+            if cursor.fetchone() is not None:
+                cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{DEFAULT_PARTITION}"')
+                cursor.execute(f'ALTER TABLE "{DEFAULT_PARTITION}" RENAME TO "{DETACHED_DEFAULT}"')
+                cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{TABLE}" DEFAULT')
+            # the default partition is empty or only has rows of other months, so this is a quick scan
+            for start, end in months:
+                cursor.execute(
+                    f'CREATE TABLE "{partition_name(start)}" PARTITION OF "{TABLE}" FOR VALUES FROM (%s) TO (%s)',
+                    [start, end]
+                )
+    move_detached_default(batch_size)
+    return [partition_name(start) for start, _ in months]
+
+
+def move_detached_default(batch_size: int = 5000) -> int:
+    """
+    move the rows of a default partition detached by `create_partitions` back
+    into chat_message, `batch_size` rows per transaction, and drop it once it
+    is empty. Picks up where an interrupted move stopped.
+    returns the number of rows moved.
+    """
+    columns = ', '.join(f'"{column}"' for column in _columns())
+    moved = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not _table_exists(cursor, DETACHED_DEFAULT):
+                return moved
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM "{DETACHED_DEFAULT}" WHERE ctid = ANY(ARRAY('
+                f'SELECT ctid FROM "{DETACHED_DEFAULT}" LIMIT %s)) RETURNING {columns}) '
+                f'INSERT INTO "{TABLE}" ({columns}) SELECT {columns} FROM moved',
+                [batch_size]
+            )
+            moved += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                cursor.execute(f'DROP TABLE "{DETACHED_DEFAULT}"')
+
+
+def _table_exists(cursor, name: str) -> bool:
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [f'"{name}"'])
+    return cursor.fetchone()[0]
+
+
+def detach_partition(name: str, lock_timeout: str = '10s'):
+    """
+    detach the partition, a catalog only change. DETACH ... CONCURRENTLY is not
+    allowed with a default partition, so give up rather than queue queries on
+    chat_message behind it if the lock is not granted within `lock_timeout`.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SET LOCAL lock_timeout = %s', [lock_timeout])
+        cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+
+
+def archive_table(name: str, destination: str, chunk_size: int = 2000) -> tuple[str, int]:
+    """
+    write every row of the detached partition as a line of JSON to a gzipped
+    `<name>.jsonl.gz` in the `destination` directory, or under the
+    `s3://bucket/prefix` of S3 compatible storage.
+    return type: tuple (archive location, number of rows archived)
+    """
+    columns = ', '.join(f'"{column}"' for column in _columns())
+    rows = 0
+    handle, path = tempfile.mkstemp(suffix='.jsonl.gz')
+    try:
+        with os.fdopen(handle, 'wb') as file, gzip.GzipFile(fileobj=file, mode='wb') as archive:
+            # a server side cursor, so the partition is never held in memory
+            with transaction.atomic(), connection.chunked_cursor() as cursor:
+                cursor.execute(f'SELECT row_to_json(t)::text FROM (SELECT {columns} FROM "{name}") t')
+                while batch := cursor.fetchmany(chunk_size):
+                    archive.write(''.join(f'{line}\n' for line, in batch).encode())
+                    rows += len(batch)
+        location = _store_archive(path, f'{name}.jsonl.gz', destination)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return location, rows
+
+
+def _store_archive(path: str, filename: str, destination: str) -> str:
+    if destination.startswith('s3://'):
+        # only needed when archiving to S3
+        import boto3
+
+        bucket, _, prefix = destination[len('s3://'):].partition('/')
+        key = f"{prefix.rstrip('/')}/{filename}" if prefix else filename
+        boto3.client('s3', endpoint_url=settings.CHAT_MESSAGE_ARCHIVE_S3_ENDPOINT_URL).upload_file(path, bucket, key)
+        return f's3://{bucket}/{key}'
+    os.makedirs(destination, exist_ok=True)
+    location = os.path.join(destination, filename)
+    # written next to its final name and renamed, so a partial archive never has it
+    os.replace(shutil.copyfile(path, f'{location}.part'), location)
+    return location
+
+
+def retire_table(name: str, keep: bool = False):
+    """
+    release the attachments referenced by an archived partition's messages and
+    drop it, or rename it to `<name>_archived` if `keep`. Both happen in one
+    transaction so a rerun after a failure never releases them twice.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT "attachment", count(*) FROM "{name}" WHERE "attachment" > \'\' GROUP BY "attachment"'
+        )
+        chat_db_queries.release_attachments(dict(cursor.fetchall()))
+        if keep:
+            cursor.execute(f'ALTER TABLE "{name}" RENAME TO "{name}_archived"')
+        else:
+            cursor.execute(f'DROP TABLE "{name}"')
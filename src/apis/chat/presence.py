@@ -0,0 +1,140 @@
+import logging
+import time
+
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+
+
+log = logging.getLogger(__name__)
+
+
+class PresenceStore:
+    """
+    Online/last-seen presence and typing indicators, kept only in the Redis
+    instance the channel layer already uses and expired with TTLs.
+
+    Each user has a sorted set of their open connections scored by the time the
+    connection expires. A heartbeat pushes the score (and the key TTL) forward, so
+    connections of a crashed worker drop out on their own. A user is online while
+    the set holds at least one unexpired connection.
+
+    Presence is disabled (every call is a no-op) when the channel layer is not
+    Redis backed, e.g. the in-memory layer.
+    """
+
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.enabled = isinstance(channel_layer, RedisChannelLayer)
+
+    def _key(self, *parts) -> str:
+        return ':'.join([self.channel_layer.prefix, *parts])
+
+    def _connection(self, user_id: str):
+        # all of a user's keys live on the same host so they can share a pipeline
+        return self.channel_layer.connection(self.channel_layer.consistent_hash(user_id))
+
+    async def connect(self, user_id: str, channel_name: str) -> bool:
+        """
+        register an open connection for the user.
+        return type: bool, True if the user was offline before this connection.
+        """
+        if not self.enabled:
+            return False
+        key, now = self._key('presence', user_id), time.time()
+        try:
+            async with self._connection(user_id).pipeline(transaction=True) as pipe:
+                pipe.zremrangebyscore(key, '-inf', now)
+                pipe.zcard(key)
+                pipe.zadd(key, {channel_name: now + settings.CHAT_PRESENCE_TTL})
+                pipe.expire(key, settings.CHAT_PRESENCE_TTL)
+                _, open_connections, _, _ = await pipe.execute()
+            return open_connections == 0
+        except Exception as e:
+            log.error('PresenceStore.connect@Error')
+            log.error(e)
+            return False
+
+    async def heartbeat(self, user_id: str, channel_name: str):
+        if not self.enabled:
+            return
+        key = self._key('presence', user_id)
+        try:
+            async with self._connection(user_id).pipeline(transaction=True) as pipe:
+                pipe.zadd(key, {channel_name: time.time() + settings.CHAT_PRESENCE_TTL})
+                pipe.expire(key, settings.CHAT_PRESENCE_TTL)
+                await pipe.execute()
+        except Exception as e:
+            log.error('PresenceStore.heartbeat@Error')
+            log.error(e)
+
+    async def disconnect(self, user_id: str, channel_name: str) -> bool:
+        """
+        drop a closed connection and record the user's last seen time.
+        return type: bool, True if the user has no open connection left.
+        """
+        if not self.enabled:
+            return False
+        key, now = self._key('presence', user_id), time.time()
+        try:
+            async with self._connection(user_id).pipeline(transaction=True) as pipe:
+                pipe.zrem(key, channel_name)
+                pipe.zremrangebyscore(key, '-inf', now)
+                pipe.zcard(key)
+                pipe.set(self._key('last_seen', user_id), now, ex=settings.CHAT_LAST_SEEN_TTL)
+                _, _, open_connections, _ = await pipe.execute()
+            return open_connections == 0
+        except Exception as e:
+            log.error('PresenceStore.disconnect@Error')
+            log.error(e)
+            return False
+
+    async def get_status(self, user_id: str) -> dict:
+        """
+        return type: dict with the user's `status` ('online' or 'offline') and
+        `last_seen` unix timestamp (None if unknown).
+        """
+        status = {'user_id': user_id, 'status': 'offline', 'last_seen': None}
+        if not self.enabled:
+            return status
+        try:
+            async with self._connection(user_id).pipeline(transaction=False) as pipe:
+                pipe.zcount(self._key('presence', user_id), time.time(), '+inf')
+                pipe.get(self._key('last_seen', user_id))
+                open_connections, last_seen = await pipe.execute()
+        except Exception as e:
+            log.error('PresenceStore.get_status@Error')
+            log.error(e)
+            return status
+        if open_connections:
+            status['status'] = 'online'
+        if last_seen is not None:
+            status['last_seen'] = float(last_seen)
+        return status
+
+    async def start_typing(self, chat_id: str, user_id: str) -> bool:
+        """
+        record that the user is typing in the chat for `CHAT_TYPING_INTERVAL` seconds.
+        return type: bool, True if the user was not already marked as typing, i.e.
+        a typing event should be broadcast. A burst of typing frames, from any
+        node, yields at most one broadcast per interval.
+        """
+        if not self.enabled:
+            return True
+        try:
+            was_set = await self._connection(user_id).set(
+                self._key('typing', chat_id, user_id), 1, ex=settings.CHAT_TYPING_INTERVAL, nx=True
+            )
+            return bool(was_set)
+        except Exception as e:
+            log.error('PresenceStore.start_typing@Error')
+            log.error(e)
+            return False
+
+    async def stop_typing(self, chat_id: str, user_id: str):
+        if not self.enabled:
+            return
+        try:
+            await self._connection(user_id).delete(self._key('typing', chat_id, user_id))
+        except Exception as e:
+            log.error('PresenceStore.stop_typing@Error')
+            log.error(e)
@@ -0,0 +1,165 @@
+import logging
+import time
+import weakref
+from collections import Counter
+
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    `burst` tokens refilled at `rate` tokens per second
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        return type: float, seconds until `amount` tokens are available, 0 if they are now
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if amount <= self.tokens:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= amount
+
+
+class UserRateLimiter:
+    """
+    Per-user buckets shared by all of the user's sockets in this process.
+
+    With Redis sync enabled the tokens taken are also added up per user across
+    nodes in `CHAT_RATE_LIMIT_SYNC_WINDOW` second windows, at most once every
+    `CHAT_RATE_LIMIT_SYNC_INTERVAL` seconds, and a user over the per-user limit
+    summed over all nodes is blocked on this node for the rest of the window.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.buckets: dict = {
+            kind: TokenBucket(*limits['user']) for kind, limits in settings.CHAT_RATE_LIMITS.items()
+        }
+        self.blocked_until: dict = {}
+        self.pending = Counter()
+        self.synced_at = time.monotonic()
+
+    def refilled_at(self) -> float:
+        """
+        return type: float, the `time.monotonic()` time every bucket is full and
+        no kind is blocked anymore
+        """
+        return max([
+            bucket.updated + (bucket.burst - bucket.tokens) / bucket.rate
+            for bucket in self.buckets.values() if bucket.tokens < bucket.burst
+        ] + list(self.blocked_until.values()), default=0.0)
+
+    def wait_time(self, kind: str, amount: float, now: float) -> float:
+        blocked_for = self.blocked_until.get(kind, 0.0) - now
+        if blocked_for > 0:
+            return blocked_for
+        return self.buckets[kind].wait_time(amount, now)
+
+    async def sync(self, channel_layer: RedisChannelLayer, now: float):
+        if now - self.synced_at < settings.CHAT_RATE_LIMIT_SYNC_INTERVAL or not self.pending:
+            return
+        self.synced_at = now
+        pending, self.pending = self.pending, Counter()
+        window = settings.CHAT_RATE_LIMIT_SYNC_WINDOW
+        window_index, window_elapsed = divmod(time.time(), window)
+        try:
+            connection = channel_layer.connection(channel_layer.consistent_hash(self.user_id))
+            async with connection.pipeline(transaction=False) as pipe:
+                for kind, amount in pending.items():
+                    key = f'{channel_layer.prefix}:rate:{kind}:{self.user_id}:{int(window_index)}'
+                    pipe.incrbyfloat(key, amount)
+                    pipe.expire(key, window * 2)
+                results = await pipe.execute()
+        except Exception as e:
+            log.error('UserRateLimiter.sync@Error')
+            log.error(e)
+            return
+        for kind, total in zip(pending, results[::2]):
+            rate, burst = settings.CHAT_RATE_LIMITS[kind]['user']
+            if float(total) > rate * window + burst:
+                self.blocked_until[kind] = now + window - window_elapsed
+
+
+# the limiters of every user with a socket in this process, and those of users
+# who took tokens lately kept until their buckets have refilled, so closing
+# every socket and reconnecting does not reset the user's limits
+_user_limiters = weakref.WeakValueDictionary()
+_retained_user_limiters: dict = {}
+_pruned_at = 0.0
+
+USER_LIMITER_PRUNE_INTERVAL = 60  # in seconds
+
+
+def get_user_limiter(user_id: str) -> UserRateLimiter:
+    limiter = _user_limiters.get(user_id)
+    if limiter is None:
+        limiter = _user_limiters[user_id] = _retained_user_limiters.get(user_id) or UserRateLimiter(user_id)
+    prune_user_limiters(time.monotonic())
+    return limiter
+
+
+def prune_user_limiters(now: float):
+    """
+    stop retaining the limiters whose buckets have refilled, at most once
+    every `USER_LIMITER_PRUNE_INTERVAL` seconds
+    """
+    global _pruned_at
+    if now - _pruned_at < USER_LIMITER_PRUNE_INTERVAL:
+        return
+    _pruned_at = now
+    for user_id, limiter in list(_retained_user_limiters.items()):
+        if limiter.refilled_at() <= now:
+            del _retained_user_limiters[user_id]
+
+
+class RateLimiter:
+    """
+    Token buckets for one socket, checked together with its user's buckets.
+    Limits are set per kind of frame in `CHAT_RATE_LIMITS`, as
+    (tokens per second, burst) tuples for the connection and for the user.
+    Kinds without limits there are not limited.
+    """
+
+    def __init__(self, user_id: str, channel_layer):
+        self.buckets: dict = {
+            kind: TokenBucket(*limits['connection']) for kind, limits in settings.CHAT_RATE_LIMITS.items()
+        }
+        self.user = get_user_limiter(user_id)
+        self.channel_layer = None
+        if settings.CHAT_RATE_LIMIT_REDIS_SYNC and isinstance(channel_layer, RedisChannelLayer):
+            self.channel_layer = channel_layer
+
+    async def check(self, kind: str, amount: float = 1) -> float:
+        """
+        take `amount` tokens from the connection and user buckets of the kind.
+        return type: float, 0 if the tokens were taken, otherwise the seconds to
+        wait before retrying (nothing is taken then).
+        """
+        if kind not in self.buckets:
+            return 0.0
+        now = time.monotonic()
+        retry_after = max(self.buckets[kind].wait_time(amount, now), self.user.wait_time(kind, amount, now))
+        if retry_after:
+            return retry_after
+        self.buckets[kind].take(amount)
+        self.user.buckets[kind].take(amount)
+        _retained_user_limiters[self.user.user_id] = self.user
+        if self.channel_layer is not None:
+            self.user.pending[kind] += amount
+            await self.user.sync(self.channel_layer, now)
+        return 0.0
@@ -1,75 +1,212 @@
-from django.db.models import Q
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-from rest_framework.generics import get_object_or_404
 from django.core.exceptions import ObjectDoesNotExist
 
+from ...base import helpers as base_repo_helpers
 from ...users.models import User
+from ..entity import model_helpers as chat_model_helpers
 from ..entity.models import Chat, Message
 from ...users.db_queries import base as user_db_queries
+from ..attachments import reference_attachment, store_attachment
 from ..db_queries import base as chat_db_queries
 
 
 class ChatRepository:
     @staticmethod
     def create_chat(user: User, target_user_id: str) -> Chat | None:
-        if not user_db_queries.get_user_by_id(target_user_id):
+        """
+        the direct chat of the two users, created if they have none yet
+        """
+        if not isinstance(target_user_id, str) or not target_user_id:
             return None
-
-        target_user = get_object_or_404(User, id=target_user_id)
-        existing_chat = Chat.objects.filter(  # noqa
-            participants__in=[user, target_user]
-        ).filter(
-            participants__in=[target_user, user]
-        ).first()
-
+        direct_key = chat_model_helpers.direct_chat_key(user.id, target_user_id)
+        existing_chat = chat_db_queries.get_direct_chat(direct_key)
         if existing_chat:
             return existing_chat
 
-        new_chat = Chat.objects.create()  # noqa
-        new_chat.participants.add(user)
-        new_chat.participants.add(target_user)
-        return new_chat
+        target_user = user_db_queries.get_user_by_id(target_user_id)
+        if not target_user:
+            return None
+
+        # participants are added before the insert is visible to a concurrent
+        # request for the same pair
+        with transaction.atomic():
+            chat, created = chat_db_queries.insert_direct_chat(direct_key)
+            if created:
+                chat.participants.add(user, target_user)
+        return chat
 
     @staticmethod
-    def get_existing_chats(user):
-        existing_chat = Chat.objects.filter( # noqa
-            Q(participants=user)
-        )
-        return existing_chat
+    def list_chats(user_id: str, limit: int, before: tuple = None) -> tuple:
+        """
+        a page of the user's chats, most recently active first.
+        return type: tuple (list of chats, whether there are more chats past the page)
+        """
+        chats = list(chat_db_queries.get_chat_list(
+            user_id, limit + 1, settings.CHAT_LIST_PREVIEW_LENGTH, before
+        ))
+        return chats[:limit], len(chats) > limit
+
+    @staticmethod
+    def chat_cursor(chat: Chat) -> str:
+        return base_repo_helpers.encode_cursor([chat.last_activity.isoformat(), chat.id])
+
+    @staticmethod
+    def parse_chat_cursor(cursor: str) -> tuple | None:
+        """
+        return type: tuple (last activity, chat id) of a `chat_cursor`, None if it is invalid
+        """
+        return ChatRepository._parse_cursor(cursor)
 
     @staticmethod
     def send_message(chat_id: str, sender_id: str, content: str, attachment):
         chat = chat_db_queries.get_chat_by_id(chat_id)
         sender = user_db_queries.get_user_by_id(sender_id)
         if chat is not None and sender is not None:
-            message = Message.objects.create(  # noqa
-                chat=chat, sender=sender,
-                content=content, attachment=attachment
-            )
+            # the file is written before the transaction, which only takes its reference
+            attachment_name = store_attachment(attachment) if attachment is not None else None
+            with transaction.atomic():
+                message = Message.objects.create(  # noqa
+                    chat=chat, sender=sender, content=content,
+                    attachment=reference_attachment(attachment, attachment_name) if attachment is not None else None
+                )
+                chat_db_queries.increment_unread_counts(chat_id, sender_id)
             return message
         else:
             return None
 
     @staticmethod
-    def list_messages(chat_id: str):
-        messages = chat_db_queries.get_messages_by_chat_id(chat_id)
-        if messages.count() > 0:
-            return messages
-        return None
+    def list_messages(chat_id: str, limit: int, before: tuple = None, after: tuple = None) -> tuple | None:
+        """
+        a page of the chat's messages, newest first.
+        return type: tuple (list of messages, whether there are more messages
+        past the page), None if the chat does not exist.
+        """
+        # one extra row tells whether there is a next page without a COUNT
+        messages = list(chat_db_queries.get_messages_page(chat_id, limit + 1, before, after))
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if after is not None:
+            messages.reverse()
+        if not messages and chat_db_queries.get_chat_by_id(chat_id) is None:
+            return None
+        return messages, has_more
+
+    @staticmethod
+    def message_cursor(message: Message) -> str:
+        return base_repo_helpers.encode_cursor([message.timestamp.isoformat(), message.id])
+
+    @staticmethod
+    def parse_message_cursor(cursor: str) -> tuple | None:
+        """
+        return type: tuple (timestamp, message id) of a `message_cursor`, None if it is invalid
+        """
+        return ChatRepository._parse_cursor(cursor)
+
+    @staticmethod
+    def _parse_cursor(cursor: str) -> tuple | None:
+        return ChatRepository._parse_keyset(base_repo_helpers.decode_cursor(cursor))
+
+    @staticmethod
+    def _parse_keyset(values) -> tuple | None:
+        # a (timestamp, id) keyset as encoded in a cursor
+        if not values or len(values) != 2 or not all(isinstance(value, str) for value in values):
+            return None
+        try:
+            timestamp = datetime.fromisoformat(values[0])
+        except ValueError:
+            return None
+        if timezone.is_naive(timestamp):
+            return None
+        return timestamp, values[1]
+
+    @staticmethod
+    def export_messages(chat_id: str, user_id: str):
+        """
+        return type: tuple (iterator of the chat's message rows oldest first, see
+        `get_export_rows`, the chat's read pointers), None if the user is not a
+        participant of the chat.
+        """
+        if not chat_db_queries.is_chat_member(chat_id, user_id):
+            return None
+        return (
+            chat_db_queries.get_export_rows(chat_id, settings.CHAT_EXPORT_CHUNK_SIZE),
+            chat_db_queries.get_read_pointers([chat_id])
+        )
+
+    @staticmethod
+    def get_message_attachment(message_id: str, user_id: str) -> str | None:
+        """
+        return type: storage name of the message's attachment, None if the message
+        has none or the user is not a participant of its chat.
+        """
+        return chat_db_queries.get_member_message_attachment(message_id, user_id)
+
+    @staticmethod
+    def search_messages(user_id: str, query: str, limit: int, after: tuple = None, chat_id: str = None) -> tuple:
+        """
+        a page of the messages of the user's chats matching the query, best match first.
+        return type: tuple (list of messages, whether there are more matches past the page)
+        """
+        messages = list(chat_db_queries.search_messages(user_id, query, limit + 1, after, chat_id))
+        return messages[:limit], len(messages) > limit
+
+    @staticmethod
+    def search_cursor(message: Message) -> str:
+        return base_repo_helpers.encode_cursor([message.rank, message.timestamp.isoformat(), message.id])
+
+    @staticmethod
+    def parse_search_cursor(cursor: str) -> tuple | None:
+        """
+        return type: tuple (rank, timestamp, message id) of a `search_cursor`, None if it is invalid
+        """
+        values = base_repo_helpers.decode_cursor(cursor)
+        if not values or len(values) != 3 or not isinstance(values[0], (int, float)) \
+                or isinstance(values[0], bool):
+            return None
+        parsed = ChatRepository._parse_keyset(values[1:])
+        if parsed is None:
+            return None
+        return (values[0], *parsed)
+
+    @staticmethod
+    def get_read_pointers(chat_ids: list[str]) -> dict:
+        return chat_db_queries.get_read_pointers(chat_ids)
 
     @staticmethod
     def read_message(message_id, user_id):
+        """
+        move the reader's read pointer up to the message, None if the message
+        does not exist or is not a message to the reader.
+        """
         message = chat_db_queries.get_message_by_id(message_id)
-        if message is None or user_id != message.receiver.id:
+        if message is None or user_id != message.receiver_id:
             return None
-        message.is_read = True
-        message.read_time = timezone.now()
-        message.save()
+        chat_db_queries.advance_read_pointer(user_id, message.chat_id, message.timestamp, message.id, timezone.now())
         return message
 
     @staticmethod
-    def read_messages(chat_id: str, user_id: str):
-        messages = chat_db_queries.get_messages_by_receiver(user_id, chat_id)
-        if messages.count() > 0:
-            messages.update(is_read=True, read_time=timezone.now())
-            return messages
+    def read_messages(chat_id: str, user_id: str, up_to: str = None) -> tuple | None:
+        """
+        move the reader's read pointer to the `up_to` message, or to the chat's
+        latest message: one query for the message, joined to the user's
+        membership, and the single UPDATE of `advance_read_pointer`.
+        return type: tuple (number of messages newly read, read time, id of the
+        message read up to), None if the user is not a participant of the chat
+        or `up_to` is not one of its messages.
+        """
+        messages = chat_db_queries.get_messages_by_chat_id(chat_id).filter(chat__members__user_id=user_id)
+        if up_to is not None:
+            messages = messages.filter(id=up_to)
+        target = messages.order_by('-timestamp', '-id').values_list('timestamp', 'id').first()
+        read_time = timezone.now()
+        if target is None:
+            if up_to is None and chat_db_queries.is_chat_member(chat_id, user_id):
+                # nothing to read yet
+                return 0, read_time, None
+            return None
+        count = chat_db_queries.advance_read_pointer(user_id, chat_id, *target, read_time) or 0
+        return count, read_time, target[1]
@@ -1,4 +1,6 @@
 from ..repository.chat_repository import ChatRepository
+from ..broadcasts import broadcast_read_receipts, read_receipts_frame
+from ..export import encode_message_row
 
 
 class ChatService:
@@ -8,14 +10,66 @@ class ChatService:
     def create_chat(self, user, target_user_id: str):
         return self.chat_repository.create_chat(user, target_user_id)
 
-    def get_chat(self, user):
-        return self.chat_repository.get_existing_chats(user)
+    def list_chats(self, user_id: str, limit: int, before: tuple = None):
+        return self.chat_repository.list_chats(user_id, limit, before)
+
+    def chat_cursor(self, chat) -> str:
+        return self.chat_repository.chat_cursor(chat)
+
+    def parse_chat_cursor(self, cursor: str) -> tuple | None:
+        return self.chat_repository.parse_chat_cursor(cursor)
 
     def send_message(self, chat_id: str, sender_id: str, content: str, attachment):
         return self.chat_repository.send_message(chat_id, sender_id, content, attachment)
 
-    def list_messages(self, chat_id: str):
-        return self.chat_repository.list_messages(chat_id)
+    def list_messages(self, chat_id: str, limit: int, before: tuple = None, after: tuple = None):
+        return self.chat_repository.list_messages(chat_id, limit, before, after)
+
+    def message_cursor(self, message) -> str:
+        return self.chat_repository.message_cursor(message)
+
+    def parse_message_cursor(self, cursor: str) -> tuple | None:
+        return self.chat_repository.parse_message_cursor(cursor)
+
+    def export_messages(self, chat_id: str, user_id: str):
+        """
+        the chat's messages oldest first as lines of JSON shaped like
+        `MessageSerializer`, None if the user is not a participant of the chat.
+        """
+        export = self.chat_repository.export_messages(chat_id, user_id)
+        if export is None:
+            return None
+        rows, read_pointers = export
+        return (encode_message_row(row, chat_id, read_pointers) for row in rows)
+
+    def get_message_attachment(self, message_id: str, user_id: str):
+        return self.chat_repository.get_message_attachment(message_id, user_id)
+
+    def search_messages(self, user_id: str, query: str, limit: int, after: tuple = None, chat_id: str = None):
+        return self.chat_repository.search_messages(user_id, query, limit, after, chat_id)
+
+    def search_cursor(self, message) -> str:
+        return self.chat_repository.search_cursor(message)
+
+    def parse_search_cursor(self, cursor: str) -> tuple | None:
+        return self.chat_repository.parse_search_cursor(cursor)
+
+    def get_read_pointers(self, chat_ids: list[str]) -> dict:
+        return self.chat_repository.get_read_pointers(chat_ids)
 
     def read_message(self, message_id: str, user_id):
         return self.chat_repository.read_message(message_id, user_id)
+
+    def read_messages(self, chat_id: str, user_id: str, up_to: str = None) -> dict | None:
+        """
+        read every message of the chat, or up to the `up_to` message, and tell
+        the chat's sockets with a single aggregated receipt.
+        """
+        result = self.chat_repository.read_messages(chat_id, user_id, up_to)
+        if result is None:
+            return None
+        count, read_time, up_to = result
+        receipt = read_receipts_frame(chat_id, user_id, count, read_time, up_to=up_to)
+        if count:
+            broadcast_read_receipts(receipt)
+        return receipt
@@ -0,0 +1,97 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from ..users.models import User
+from .broadcasts import chat_group_names
+from .db_queries import base as chat_db_queries
+from .entity.models import Chat
+
+
+log = logging.getLogger(__name__)
+
+
+def broadcast_participants_changed(chat_ids, user_ids):
+    """
+    tell every socket of the chats' current participants, and of the users that
+    were just added or removed, that the participant list changed, so they can
+    refresh their cached membership.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for chat_id in chat_ids:
+        try:
+            participant_ids = set(user_ids) | set(
+                Chat.participants.through.objects.filter(chat_id=chat_id).values_list('user_id', flat=True)
+            )
+            for group in chat_group_names(participant_ids, chat_id):
+                async_to_sync(channel_layer.group_send)(
+                    group, {'type': 'participants_changed', 'chat_id': chat_id}
+                )
+        except Exception as e:
+            log.error('broadcast_participants_changed@Error')
+            log.error(e)
+
+
+@receiver(m2m_changed, sender=Chat.participants.through)
+def chat_participants_changed(sender, instance, action, reverse, pk_set, **kwargs):  # noqa
+    if reverse:
+        # `user.chats.<add|remove|clear>()`, `instance` is the user
+        user_ids = [instance.pk]
+        if action == 'pre_clear':
+            # the chat ids are gone once the clear runs, so keep them for `post_clear`
+            instance._cleared_chat_ids = list(instance.chats.values_list('id', flat=True))
+            return
+        elif action == 'post_clear':
+            chat_ids = instance.__dict__.pop('_cleared_chat_ids', [])
+        elif action in ('post_add', 'post_remove'):
+            chat_ids = list(pk_set)
+        else:
+            return
+    else:
+        # `chat.participants.<add|remove|clear>()`, `instance` is the chat
+        chat_ids = [instance.pk]
+        if action == 'pre_clear':
+            instance._cleared_user_ids = list(instance.participants.values_list('id', flat=True))
+            return
+        elif action == 'post_clear':
+            user_ids = instance.__dict__.pop('_cleared_user_ids', [])
+        elif action in ('post_add', 'post_remove'):
+            user_ids = list(pk_set)
+        else:
+            return
+
+    transaction.on_commit(lambda: broadcast_participants_changed(chat_ids, user_ids))
+
+
+def release_deleted_attachments(origin, messages: Q):
+    """
+    release the attachments of the `messages` deleted along with `origin` (the
+    instance or queryset being deleted). Messages are deleted in bulk without
+    signals of their own, so their references are released by the objects they
+    cascade from, each message once however many of them are deleted together.
+    Code deleting messages by themselves releases their attachments itself.
+    """
+    released = getattr(origin, '_released_messages', None)
+    if released is not None:
+        chat_db_queries.release_message_attachments(messages & ~released)
+        messages |= released
+    else:
+        chat_db_queries.release_message_attachments(messages)
+    origin._released_messages = messages
+
+
+@receiver(pre_delete, sender=Chat)
+def chat_deleted(sender, instance, origin=None, **kwargs):  # noqa
+    release_deleted_attachments(origin or instance, Q(chat_id=instance.pk))
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, origin=None, **kwargs):  # noqa
+    release_deleted_attachments(origin or instance, Q(sender_id=instance.pk) | Q(receiver_id=instance.pk))
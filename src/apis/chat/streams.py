@@ -0,0 +1,161 @@
+import asyncio
+import logging
+
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+
+from .frames import msgpack_codec
+
+
+log = logging.getLogger(__name__)
+
+
+def parse_stream_id(stream_id) -> tuple | None:
+    """
+    return type: tuple (milliseconds, sequence) of a Redis stream id, None if it is not one
+    """
+    if isinstance(stream_id, bytes):
+        stream_id = stream_id.decode()
+    if not isinstance(stream_id, str):
+        return None
+    milliseconds, _, sequence = stream_id.partition('-')
+    if not milliseconds.isdigit() or not sequence.isdigit():
+        return None
+    return int(milliseconds), int(sequence)
+
+
+class InboxStreams:
+    """
+    Durable per-user inbox of chat events, kept in the Redis instance the
+    channel layer already uses.
+
+    Every chat message and read receipt broadcast is also appended, encoded
+    with `codec`, to a Redis Stream per participant capped at about
+    `CHAT_INBOX_STREAM_MAXLEN` entries. Each of the user's devices keeps its
+    own acknowledged stream id, an inbox socket replays the entries after
+    its device's id on connect, and the stream is trimmed up to the oldest id
+    acknowledged by any device, giving at-least-once delivery to every device
+    without querying the message table. A device that stops acknowledging
+    holds back trimming until `CHAT_INBOX_STREAM_MAXLEN` caps the stream.
+
+    Disabled (every call is a no-op) when `CHAT_INBOX_STREAMS` is off or the
+    channel layer is not Redis backed.
+    """
+
+    # the encoding of the stored frames, sockets of other codecs encode them again on replay
+    codec = msgpack_codec
+
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.enabled = settings.CHAT_INBOX_STREAMS and isinstance(channel_layer, RedisChannelLayer)
+
+    def _key(self, *parts) -> str:
+        return ':'.join([self.channel_layer.prefix, *parts])
+
+    def _connection_index(self, user_id: str) -> int:
+        # the stream and its ack ids live on the same host as the user's presence keys
+        return self.channel_layer.consistent_hash(user_id)
+
+    async def append(self, user_ids: list[str], chat_id: str, frame: dict) -> dict:
+        """
+        append the frame to the inbox of every user.
+        return type: dict of user id to the stream id of the entry, users
+        whose append failed are left out.
+        """
+        if not self.enabled:
+            return {}
+        fields = {'chat_id': chat_id, 'frame': self.codec.dumps(frame)}
+        by_connection: dict = {}
+        for user_id in user_ids:
+            by_connection.setdefault(self._connection_index(user_id), []).append(user_id)
+
+        async def append_on(index: int, connection_user_ids: list[str]) -> dict:
+            async with self.channel_layer.connection(index).pipeline(transaction=False) as pipe:
+                for user_id in connection_user_ids:
+                    key = self._key('inbox', user_id)
+                    pipe.xadd(key, fields, maxlen=settings.CHAT_INBOX_STREAM_MAXLEN, approximate=True)
+                    pipe.expire(key, settings.CHAT_INBOX_STREAM_TTL)
+                results = await pipe.execute()
+            return {user_id: stream_id.decode() for user_id, stream_id in zip(connection_user_ids, results[::2])}
+
+        stream_ids = {}
+        try:
+            for result in await asyncio.gather(*(
+                append_on(index, connection_user_ids) for index, connection_user_ids in by_connection.items()
+            )):
+                stream_ids.update(result)
+        except Exception as e:
+            log.error('InboxStreams.append@Error')
+            log.error(e)
+        return stream_ids
+
+    async def get_ack(self, user_id: str, device_id: str) -> str | None:
+        """
+        the stream id the device acknowledged last. A device seen for the first
+        time starts after the latest id acknowledged by the user's other
+        devices, and is registered so the stream is not trimmed past it.
+        return type: str, None if every entry of the stream is unacknowledged
+        """
+        if not self.enabled:
+            return None
+        key = self._key('inbox_acks', user_id)
+        connection = self.channel_layer.connection(self._connection_index(user_id))
+        try:
+            acks = await connection.hgetall(key)
+            stream_id = acks.get(device_id.encode())
+            if stream_id is None:
+                stream_id = max(acks.values(), key=parse_stream_id, default=b'0-0')
+                async with connection.pipeline(transaction=True) as pipe:
+                    pipe.hsetnx(key, device_id, stream_id)
+                    pipe.expire(key, settings.CHAT_INBOX_STREAM_TTL)
+                    await pipe.execute()
+        except Exception as e:
+            log.error('InboxStreams.get_ack@Error')
+            log.error(e)
+            return None
+        return stream_id.decode()
+
+    async def read(self, user_id: str, after: str | None, count: int) -> list[tuple]:
+        """
+        read up to `count` entries after the `after` stream id, from the start
+        of the stream if None.
+        return type: list of tuple (stream id, chat id, frame payload encoded with `codec`)
+        """
+        if not self.enabled:
+            return []
+        connection = self.channel_layer.connection(self._connection_index(user_id))
+        try:
+            start = f'({after}' if after else '-'
+            entries = await connection.xrange(self._key('inbox', user_id), start, '+', count=count)
+        except Exception as e:
+            log.error('InboxStreams.read@Error')
+            log.error(e)
+            return []
+        return [
+            (stream_id.decode(), fields.get(b'chat_id', b'').decode(), fields.get(b'frame'))
+            for stream_id, fields in entries
+        ]
+
+    async def ack(self, user_id: str, device_id: str, stream_id: str):
+        """
+        record that the device has processed every entry up to `stream_id`, and
+        trim the entries every device of the user has processed
+        """
+        if not self.enabled:
+            return
+        key = self._key('inbox_acks', user_id)
+        connection = self.channel_layer.connection(self._connection_index(user_id))
+        try:
+            async with connection.pipeline(transaction=True) as pipe:
+                pipe.hset(key, device_id, stream_id)
+                pipe.expire(key, settings.CHAT_INBOX_STREAM_TTL)
+                pipe.hvals(key)
+                _, _, acks = await pipe.execute()
+            # entries from the oldest acknowledged one onwards are kept, replay
+            # starts after a device's ack id
+            await connection.xtrim(
+                self._key('inbox', user_id), minid=min(acks, key=parse_stream_id).decode(), approximate=True
+            )
+        except Exception as e:
+            log.error('InboxStreams.ack@Error')
+            log.error(e)
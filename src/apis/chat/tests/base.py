@@ -0,0 +1,172 @@
+import shutil
+import tempfile
+import uuid
+from datetime import timedelta
+
+import redis
+from channels.layers import DEFAULT_CHANNEL_LAYER, channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.test import APIClient
+
+from ...clients import enums as client_enums
+from ...users.models import User
+from .. import routing
+from ..db_queries import base as chat_db_queries
+from ..entity.models import Chat, Message
+from ..middleware import TokenAuthMiddleware
+from ..repository.chat_repository import ChatRepository
+
+# the sockets are tested over the in-memory channel layer, which disables the
+# Redis backed features (presence, typing, inbox streams)
+IN_MEMORY_CHANNEL_LAYERS: dict = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+# the layer of the settings the tests run with, read before any test overrides it
+CONFIGURED_CHANNEL_LAYER: dict = settings.CHANNEL_LAYERS[DEFAULT_CHANNEL_LAYER]
+
+websocket_application = TokenAuthMiddleware(URLRouter(routing.websocket_urlpatterns))
+
+
+def redis_available() -> bool:
+    """
+    whether the configured channel layer is Redis backed and reachable, the
+    tests of the Redis backed features are skipped otherwise
+    """
+    backend = import_string(CONFIGURED_CHANNEL_LAYER['BACKEND'])
+    if not issubclass(backend, RedisChannelLayer):
+        return False
+    host = backend(**CONFIGURED_CHANNEL_LAYER.get('CONFIG', {})).hosts[0]
+    try:
+        if 'address' in host:
+            client = redis.Redis.from_url(host['address'], socket_timeout=1)
+        else:
+            client = redis.Redis(**{**host, 'socket_timeout': 1})
+        with client:
+            return client.ping()
+    except redis.RedisError:
+        return False
+
+
+def create_user(username: str) -> User:
+    return User.objects.create(username=username, role=client_enums.RoleEnum.APP_USER)
+
+
+def create_chat(user: User, target_user: User) -> Chat:
+    return ChatRepository.create_chat(user, target_user.id)
+
+
+def create_messages(chat: Chat, sender: User, receiver: User, count: int) -> list[Message]:
+    """
+    `count` messages a second apart, the latest sent now
+    """
+    now = timezone.now()
+    messages = Message.objects.bulk_create([  # noqa
+        Message(chat=chat, sender=sender, receiver=receiver, content=f'message {number}',
+                timestamp=now - timedelta(seconds=count - number))
+        for number in range(count)
+    ])
+    chat_db_queries.increment_unread_counts(chat.id, sender.id, count)
+    return messages
+
+
+def use_temporary_media_root(test_case):
+    """
+    store the files `test_case` saves in a directory removed after the test
+    """
+    media_root = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    media_settings = override_settings(MEDIA_ROOT=media_root)
+    media_settings.enable()
+    test_case.addCleanup(media_settings.disable)
+    return media_root
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChatAPITestCase(TestCase):
+    """
+    `alice` and `bob` share `chat`, `carol` is in no chat. `api(user)` is a
+    client authenticated as the user.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = create_user('alice')
+        cls.bob = create_user('bob')
+        cls.carol = create_user('carol')
+        cls.chat = create_chat(cls.alice, cls.bob)
+
+    def api(self, user: User) -> APIClient:
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {user.get_token("read write")}')
+        return client
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChatSocketTestCase(TransactionTestCase):
+    """
+    `alice` and `bob` share `chat`, `carol` is in no chat.
+
+    consumers reach the database from worker threads, so the test data is
+    committed (`TransactionTestCase`) rather than kept in a test transaction.
+    """
+
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.carol = create_user('carol')
+        self.chat = create_chat(self.alice, self.bob)
+        # tokens are signed here, outside the event loop
+        self.tokens = {user.id: user.get_token('read write') for user in (self.alice, self.bob, self.carol)}
+
+    def communicator(self, path: str, user: User = None, subprotocols: list[str] = None) -> WebsocketCommunicator:
+        headers = [(b'authorization', f'Bearer {self.tokens[user.id]}'.encode())] if user else []
+        return WebsocketCommunicator(websocket_application, path, headers=headers, subprotocols=subprotocols)
+
+    async def connect(self, path: str, user: User = None, **kwargs) -> WebsocketCommunicator:
+        socket = self.communicator(path, user, **kwargs)
+        connected, _ = await socket.connect()
+        self.assertTrue(connected, f'{path} rejected the connection')
+        return socket
+
+    async def receive_frame(self, socket: WebsocketCommunicator, frame_type: str, timeout: float = 2) -> dict:
+        """
+        the next frame of the type, frames of other types are skipped
+        """
+        while True:
+            frame = await socket.receive_json_from(timeout=timeout)
+            if frame.get('type') == frame_type:
+                return frame
+
+    async def assert_no_frame(self, socket: WebsocketCommunicator, timeout: float = 0.2):
+        self.assertTrue(await socket.receive_nothing(timeout=timeout), 'unexpected frame')
+
+
+class RedisSocketTestCase(ChatSocketTestCase):
+    """
+    sockets over the configured Redis channel layer, under a prefix of their
+    own so tests don't see each other's keys.
+
+    every socket gets a channel layer instance of its own, as if it were
+    connected to a server of its own: the sockets of one instance share a
+    blocking receive, and a server that does not abort the blocked commands of
+    a closed connection would hand the next message of the others to the
+    receive a disconnecting socket cancelled.
+    """
+
+    def setUp(self):
+        super().setUp()
+        config = CONFIGURED_CHANNEL_LAYER.get('CONFIG', {})
+        layers = {DEFAULT_CHANNEL_LAYER: {
+            **CONFIGURED_CHANNEL_LAYER, 'CONFIG': {**config, 'prefix': f'test-{uuid.uuid4().hex}'}
+        }}
+        layer_settings = override_settings(CHANNEL_LAYERS=layers)
+        layer_settings.enable()
+        self.addCleanup(layer_settings.disable)
+
+    def communicator(self, *args, **kwargs) -> WebsocketCommunicator:
+        channel_layers.backends.pop(DEFAULT_CHANNEL_LAYER, None)
+        return super().communicator(*args, **kwargs)
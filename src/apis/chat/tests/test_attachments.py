@@ -0,0 +1,137 @@
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from ...users.models import User
+from .. import attachments
+from ..db_queries import base as chat_db_queries
+from ..entity.models import Attachment, Chat, Message
+from ..repository.chat_repository import ChatRepository
+from .base import ChatAPITestCase, create_chat, create_user, use_temporary_media_root
+
+
+def upload(content: bytes, name: str = 'photo.png') -> SimpleUploadedFile:
+    return SimpleUploadedFile(name, content)
+
+
+def stored_files() -> list[str]:
+    if not default_storage.exists(attachments.ATTACHMENT_DIR):
+        return []
+    return [
+        f'{directory}/{filename}'
+        for directory in default_storage.listdir(attachments.ATTACHMENT_DIR)[0]
+        for filename in default_storage.listdir(f'{attachments.ATTACHMENT_DIR}/{directory}')[1]
+    ]
+
+
+class AttachmentStoreTests(ChatAPITestCase):
+    def setUp(self):
+        use_temporary_media_root(self)
+
+    def send(self, content: bytes, chat: Chat = None, sender: User = None) -> Message:
+        return ChatRepository.send_message((chat or self.chat).id, (sender or self.alice).id, 'file', upload(content))
+
+    def test_the_same_content_is_stored_once(self):
+        first, second = self.send(b'content'), self.send(b'content')
+        self.assertEqual(first.attachment.name, second.attachment.name)
+        self.assertEqual(len(stored_files()), 1)
+        attachment = Attachment.objects.get()  # noqa
+        self.assertEqual((attachment.name, attachment.ref_count), (first.attachment.name, 2))
+
+    def test_an_identical_upload_saved_in_between_is_not_kept_twice(self):
+        file = upload(b'content')
+        name = attachments.store_attachment(file)
+        exists = default_storage.exists
+        answers = [False]
+
+        def exists_once_missing(path):
+            # the identical upload lands right after this check
+            return answers.pop() if answers else exists(path)
+
+        with mock.patch.object(default_storage, 'exists', side_effect=exists_once_missing):
+            self.assertEqual(attachments.store_attachment(upload(b'content')), name)
+        self.assertEqual(len(stored_files()), 1)
+
+    def test_a_file_collected_before_its_reference_is_stored_again(self):
+        file = upload(b'content')
+        name = attachments.store_attachment(file)
+        default_storage.delete(name)
+        with transaction.atomic():
+            attachments.reference_attachment(file, name)
+        self.assertEqual(default_storage.size(name), file.size)
+        self.assertEqual(Attachment.objects.get(name=name).ref_count, 1)  # noqa
+
+    def test_lost_references_are_retried_a_bounded_number_of_times(self):
+        with mock.patch.object(chat_db_queries, 'reference_attachment', return_value=0) as reference:
+            with self.assertRaises(attachments.AttachmentError):
+                self.send(b'content')
+            self.assertEqual(reference.call_count, attachments.REFERENCE_ATTEMPTS)
+
+            response = self.api(self.alice).post(
+                f'/v1/chat/messages/{self.chat.id}', {'message': 'file', 'attachment': upload(b'content')},
+                format='multipart'
+            )
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Message.objects.exists())  # noqa
+
+    def test_deleting_a_chat_releases_its_attachments_in_bulk(self):
+        for content in (b'first', b'first', b'second'):
+            self.send(content)
+        with CaptureQueriesContext(connection) as queries:
+            self.chat.delete()
+        self.assertEqual(list(Attachment.objects.values_list('ref_count', flat=True)), [0, 0])  # noqa
+        message_queries = [query['sql'] for query in queries if '"chat_message"' in query['sql']]
+        # one query counting the references, one deleting the messages
+        self.assertEqual(len(message_queries), 2, message_queries)
+        self.assertTrue(message_queries[1].startswith('DELETE FROM "chat_message"'))
+
+    def test_users_deleted_together_release_each_message_once(self):
+        dave = create_user('dave')
+        self.send(b'content')
+        self.send(b'content', create_chat(self.carol, dave), self.carol)
+        User.objects.filter(id__in=[self.alice.id, self.bob.id]).delete()
+        self.assertEqual(Attachment.objects.get().ref_count, 1)  # noqa
+        self.assertEqual(Message.objects.count(), 1)  # noqa
+
+    def test_orphan_files_are_deleted_with_their_placeholder_row(self):
+        orphan = attachments.store_attachment(upload(b'orphan'))
+        referenced = self.send(b'referenced').attachment.name
+        self.assertEqual(attachments.collect_orphan_files(timedelta(0)), [orphan])
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(referenced))
+        self.assertEqual(list(Attachment.objects.values_list('name', flat=True)), [referenced])  # noqa
+
+
+class OrphanCollectionRaceTests(TransactionTestCase):
+    def setUp(self):
+        use_temporary_media_root(self)
+
+    def test_files_referenced_by_an_uncommitted_message_are_kept(self):
+        file = upload(b'content')
+        name = attachments.store_attachment(file)
+        referenced = threading.Event()
+
+        def send():
+            try:
+                with transaction.atomic():
+                    attachments.reference_attachment(file, name)
+                    referenced.set()
+                    # the collection below waits for this transaction
+                    threading.Event().wait(0.5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=send)
+        thread.start()
+        referenced.wait()
+        collected = attachments.collect_orphan_files(timedelta(0))
+        thread.join()
+        self.assertEqual(collected, [])
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(Attachment.objects.get(name=name).ref_count, 1)  # noqa
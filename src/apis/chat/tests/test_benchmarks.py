@@ -0,0 +1,37 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+
+from ...users.models import User
+from ..entity.models import Chat, Message
+from ..write_behind import MessageWriteBehind
+from .base import IN_MEMORY_CHANNEL_LAYERS
+
+
+# the command swaps in its own channel layer and limits, the overrides put them back
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ConsumerBenchmarkTests(TransactionTestCase):
+    def run_benchmark(self, **options) -> str:
+        out = StringIO()
+        with override_settings(CHAT_RATE_LIMITS={}):
+            call_command('benchmark_chat_consumer', chats=2, messages=3, timeout=5, seed=1, stdout=out, **options)
+        return out.getvalue()
+
+    def test_chat_sockets(self):
+        output = self.run_benchmark(group_size=3, read_ratio=1)
+        self.assertIn('frames delivered: 12', output)
+        # the seeded users and chats are removed
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Chat.objects.exists())  # noqa
+        self.assertFalse(Message.objects.exists())  # noqa
+
+    def test_inbox_sockets_with_write_behind(self):
+        writer = MessageWriteBehind()
+        self.addCleanup(writer.stop)
+        with mock.patch('apis.chat.consumers.message_writer', writer), \
+                mock.patch('apis.chat.management.commands.benchmark_chat_consumer.message_writer', writer):
+            output = self.run_benchmark(endpoint='inbox', write_behind=True)
+        self.assertIn('frames delivered: 6', output)
+        self.assertIn('write-behind:', output)
@@ -0,0 +1,63 @@
+import threading
+
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..entity import model_helpers as chat_model_helpers
+from ..entity.models import Chat
+from ..repository.chat_repository import ChatRepository
+from .base import ChatAPITestCase, create_user
+
+
+class DirectChatTests(ChatAPITestCase):
+    def create(self, user, target_user_id):
+        return self.api(user).post('/v1/chat/', {'target_user_id': target_user_id}, format='json')
+
+    def test_the_pair_has_one_chat_whoever_starts_it(self):
+        responses = [self.create(self.alice, self.bob.id), self.create(self.bob, self.alice.id)]
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual({response.data['data']['id'] for response in responses}, {self.chat.id})
+        self.assertEqual(Chat.objects.count(), 1)  # noqa
+
+    def test_a_new_pair_gets_a_chat_of_its_own(self):
+        response = self.create(self.carol, self.alice.id)
+        self.assertEqual(response.status_code, 200)
+        chat = Chat.objects.get(id=response.data['data']['id'])  # noqa
+        self.assertEqual(chat.direct_key, chat_model_helpers.direct_chat_key(self.alice.id, self.carol.id))
+        self.assertEqual(set(chat.participants.values_list('id', flat=True)), {self.alice.id, self.carol.id})
+
+    def test_existing_chat_is_one_indexed_lookup(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(ChatRepository.create_chat(self.bob, self.alice.id), self.chat)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"direct_key" =', queries.captured_queries[0]['sql'])
+
+    def test_invalid_target_users(self):
+        for target_user_id in ('user_unknown', '', None, ['list']):
+            response = self.create(self.alice, target_user_id)
+            self.assertEqual((response.status_code, response.data['message']), (404, 'Invalid target_user_id!'))
+        self.assertEqual(Chat.objects.count(), 1)  # noqa
+
+
+class ConcurrentDirectChatTests(TransactionTestCase):
+    def test_concurrent_requests_get_the_same_chat(self):
+        alice, bob = create_user('alice'), create_user('bob')
+        barrier = threading.Barrier(4)
+        chats = []
+
+        def create(user, target_user):
+            try:
+                barrier.wait()
+                chats.append(ChatRepository.create_chat(user, target_user.id))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=create, args=pair) for pair in [(alice, bob), (bob, alice)] * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({chat.id for chat in chats}), 1)
+        self.assertEqual(Chat.objects.count(), 1)  # noqa
+        self.assertEqual(chats[0].participants.count(), 2)
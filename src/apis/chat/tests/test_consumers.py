@@ -0,0 +1,274 @@
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from ..db_queries import base as chat_db_queries
+from ..entity.models import ChatMember, Message
+from ..broadcasts import chat_group_name, user_group_name
+from .base import ChatSocketTestCase, create_chat, create_messages
+
+
+class ChatConsumerTests(ChatSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = f'/ws/chat/{self.chat.id}/'
+
+    async def test_rejects_sockets_without_a_token(self):
+        connected, _ = await self.communicator(self.path).connect()
+        self.assertFalse(connected)
+
+    async def test_rejects_users_outside_the_chat(self):
+        connected, _ = await self.communicator(self.path, self.carol).connect()
+        self.assertFalse(connected)
+
+    async def test_rejects_unknown_chats(self):
+        connected, _ = await self.communicator('/ws/chat/chat_unknown/', self.alice).connect()
+        self.assertFalse(connected)
+
+    async def test_message_is_saved_and_sent_to_every_participant(self):
+        alice = await self.connect(self.path, self.alice)
+        bob = await self.connect(self.path, self.bob)
+
+        await alice.send_json_to({'message': 'hello'})
+        received = [await self.receive_frame(socket, 'chat_message') for socket in (alice, bob)]
+
+        self.assertEqual(received[0], received[1])
+        message = received[0]['message']
+        self.assertEqual(message['content'], 'hello')
+        self.assertEqual(message['sender']['id'], self.alice.id)
+        self.assertEqual(message['receiver']['id'], self.bob.id)
+        self.assertFalse(message['is_read'])
+        saved = await sync_to_async(Message.objects.get)(id=message['id'])
+        self.assertEqual((saved.chat_id, saved.sender_id, saved.receiver_id), (self.chat.id, self.alice.id, self.bob.id))
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_read_message_sends_a_receipt_to_every_participant(self):
+        alice = await self.connect(self.path, self.alice)
+        bob = await self.connect(self.path, self.bob)
+        await alice.send_json_to({'message': 'hello'})
+        message = (await self.receive_frame(bob, 'chat_message'))['message']
+
+        await bob.send_json_to({'type': 'read_message', 'message_id': message['id']})
+        for socket in (alice, bob):
+            receipt = await self.receive_frame(socket, 'read_receipt')
+            self.assertEqual((receipt['message_id'], receipt['status']), (message['id'], 'read'))
+
+        await bob.send_json_to({'type': 'read_message', 'message_id': message['id']})
+        self.assertEqual((await self.receive_frame(bob, 'error'))['message'], 'Message already read')
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_read_message_errors(self):
+        alice = await self.connect(self.path, self.alice)
+        await alice.send_json_to({'message': 'hello'})
+        message = (await self.receive_frame(alice, 'chat_message'))['message']
+
+        # only the receiver reads a message
+        await alice.send_json_to({'type': 'read_message', 'message_id': message['id']})
+        self.assertEqual((await self.receive_frame(alice, 'error'))['message'], 'Invalid user')
+        await alice.send_json_to({'type': 'read_message', 'message_id': 'message_unknown'})
+        self.assertEqual((await self.receive_frame(alice, 'error'))['message'], 'Message not found.')
+        await alice.disconnect()
+
+    async def test_invalid_frames_get_an_error(self):
+        alice = await self.connect(self.path, self.alice)
+        await alice.send_to(text_data='not json')
+        self.assertEqual((await self.receive_frame(alice, 'error'))['message'], 'Invalid JSON frame.')
+        await alice.send_to(text_data='[1, 2]')
+        self.assertEqual((await self.receive_frame(alice, 'error'))['message'], 'Frame must be an object.')
+        await alice.send_json_to({'message': 'hi', 'attachment': 'aGVsbG8='})
+        self.assertEqual(
+            (await self.receive_frame(alice, 'error'))['message'],
+            'Inline attachments are not supported, use upload_init.'
+        )
+        await self.assert_no_frame(alice)
+        self.assertFalse(await sync_to_async(Message.objects.exists)())
+        await alice.disconnect()
+
+
+class MembershipCacheTests(ChatSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = f'/ws/chat/{self.chat.id}/'
+
+    async def test_participants_are_loaded_once_per_connection(self):
+        with mock.patch.object(
+                chat_db_queries, 'get_chat_memberships', wraps=chat_db_queries.get_chat_memberships
+        ) as get_chat_memberships:
+            alice = await self.connect(self.path, self.alice)
+            for content in ('one', 'two', 'three'):
+                await alice.send_json_to({'message': content})
+                await self.receive_frame(alice, 'chat_message')
+            self.assertEqual(get_chat_memberships.call_count, 1)
+        await alice.disconnect()
+
+    async def test_added_participants_receive_messages_of_open_sockets(self):
+        alice = await self.connect(self.path, self.alice)
+        await sync_to_async(self.chat.participants.add)(self.carol)
+        carol = await self.connect(self.path, self.carol)
+        # alice's socket refreshes its participants when it is told of the change
+        await alice.receive_nothing(timeout=0.2)
+
+        await alice.send_json_to({'message': 'welcome'})
+        self.assertEqual((await self.receive_frame(carol, 'chat_message'))['message']['content'], 'welcome')
+        await alice.disconnect()
+        await carol.disconnect()
+
+    async def test_single_chat_sockets_only_join_their_chats_group(self):
+        other_chat = await sync_to_async(create_chat)(self.alice, self.carol)
+        alice = await self.connect(self.path, self.alice)
+        alice_other = await self.connect(f'/ws/chat/{other_chat.id}/', self.alice)
+        inbox = await self.connect('/ws/inbox/', self.alice)
+        groups = get_channel_layer().groups
+        self.assertEqual(len(groups.get(chat_group_name(self.chat.id), {})), 1)
+        self.assertEqual(len(groups.get(chat_group_name(other_chat.id), {})), 1)
+        # only the inbox socket gets the events of every chat of the user
+        self.assertEqual(len(groups.get(user_group_name(self.alice.id), {})), 1)
+
+        bob = await self.connect(self.path, self.bob)
+        await bob.send_json_to({'message': 'hello'})
+        for socket in (alice, inbox):
+            self.assertEqual((await self.receive_frame(socket, 'chat_message'))['message']['content'], 'hello')
+        await self.assert_no_frame(alice_other)
+        for socket in (alice, alice_other, inbox, bob):
+            await socket.disconnect()
+
+    async def test_removed_participants_are_disconnected(self):
+        alice = await self.connect(self.path, self.alice)
+        bob = await self.connect(self.path, self.bob)
+
+        await sync_to_async(self.chat.participants.remove)(self.bob)
+        self.assertEqual((await bob.receive_output(timeout=2))['type'], 'websocket.close')
+
+        await alice.send_json_to({'message': 'bob left'})
+        await self.receive_frame(alice, 'chat_message')
+        await alice.disconnect()
+
+
+@override_settings(CHAT_READ_MESSAGES_MAX_IDS=3)
+class ReadMessagesTests(ChatSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = f'/ws/chat/{self.chat.id}/'
+        self.messages = create_messages(self.chat, self.alice, self.bob, 5)
+
+    def unread_count(self) -> int:
+        return ChatMember.objects.get(chat=self.chat, user=self.bob).unread_count  # noqa
+
+    async def test_message_ids_send_one_receipt(self):
+        alice = await self.connect(self.path, self.alice)
+        bob = await self.connect(self.path, self.bob)
+        message_ids = [self.messages[0].id, self.messages[2].id]
+
+        await bob.send_json_to({'type': 'read_messages', 'message_ids': message_ids})
+        for socket in (alice, bob):
+            receipt = await self.receive_frame(socket, 'read_receipts')
+            self.assertEqual(
+                (receipt['reader_id'], receipt['message_ids'], receipt['up_to'], receipt['count']),
+                (self.bob.id, message_ids, None, 3)
+            )
+        await self.assert_no_frame(alice)
+        self.assertEqual(await sync_to_async(self.unread_count)(), 2)
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_up_to_reads_every_earlier_message(self):
+        alice = await self.connect(self.path, self.alice)
+        bob = await self.connect(self.path, self.bob)
+
+        await bob.send_json_to({'type': 'read_messages', 'up_to': self.messages[3].id})
+        for socket in (alice, bob):
+            receipt = await self.receive_frame(socket, 'read_receipts')
+            self.assertEqual((receipt['up_to'], receipt['count']), (self.messages[3].id, 4))
+        self.assertEqual(await sync_to_async(self.unread_count)(), 1)
+
+        # nothing newly read, only the reader is answered
+        await bob.send_json_to({'type': 'read_messages', 'up_to': self.messages[1].id})
+        self.assertEqual((await self.receive_frame(bob, 'read_receipts'))['count'], 0)
+        await self.assert_no_frame(alice)
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_reads_over_rest_send_the_same_receipt(self):
+        alice = await self.connect(self.path, self.alice)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.tokens[self.bob.id]}')
+
+        response = await sync_to_async(client.put)(f'/v1/chat/read-all/{self.chat.id}/{self.messages[3].id}')
+        receipt = await self.receive_frame(alice, 'read_receipts')
+        self.assertEqual(receipt, response.data['data'])
+        self.assertEqual(await sync_to_async(self.unread_count)(), 1)
+        await alice.disconnect()
+
+    async def test_invalid_read_messages_frames(self):
+        bob = await self.connect(self.path, self.bob)
+        for frame in ({'message_ids': []}, {'message_ids': 'id'}, {'message_ids': [1]},
+                      {'message_ids': [message.id for message in self.messages]}):
+            await bob.send_json_to({'type': 'read_messages', **frame})
+            self.assertEqual(
+                (await self.receive_frame(bob, 'error'))['message'], 'message_ids must be a list of 1 to 3 message ids.'
+            )
+        await bob.send_json_to({'type': 'read_messages'})
+        self.assertEqual((await self.receive_frame(bob, 'error'))['message'], 'Either message_ids or up_to is required.')
+        self.assertEqual(await sync_to_async(self.unread_count)(), 5)
+        await bob.disconnect()
+
+
+@override_settings(CHAT_REPLAY_BATCH_SIZE=2, CHAT_REPLAY_MAX_MESSAGES=10)
+class ReplayHistoryTests(ChatSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.messages = create_messages(self.chat, self.alice, self.bob, 6)
+
+    async def replay(self, socket) -> list[dict]:
+        frames = []
+        while not frames or frames[-1]['has_more']:
+            frames.append(await self.receive_frame(socket, 'history'))
+        return frames
+
+    async def test_missed_messages_are_sent_in_batches(self):
+        bob = await self.connect(f'/ws/chat/{self.chat.id}/?since={self.messages[0].id}', self.bob)
+        frames = await self.replay(bob)
+        self.assertEqual([len(frame['messages']) for frame in frames], [2, 2, 1])
+        self.assertEqual(
+            [message['id'] for frame in frames for message in frame['messages']],
+            [message.id for message in self.messages[1:]]
+        )
+        self.assertFalse(frames[-1]['truncated'])
+        await bob.disconnect()
+
+    @override_settings(CHAT_REPLAY_MAX_MESSAGES=3)
+    async def test_replay_is_truncated(self):
+        bob = await self.connect(f'/ws/chat/{self.chat.id}/?since={self.messages[0].id}', self.bob)
+        frames = await self.replay(bob)
+        self.assertEqual([len(frame['messages']) for frame in frames], [2, 1])
+        self.assertTrue(frames[-1]['truncated'])
+        await bob.disconnect()
+
+    async def test_nothing_is_replayed_without_since(self):
+        bob = await self.connect(f'/ws/chat/{self.chat.id}/', self.bob)
+        await self.assert_no_frame(bob)
+        await bob.disconnect()
+
+    async def test_invalid_since_cursor(self):
+        other_chat = await sync_to_async(create_chat)(self.alice, self.carol)
+        other_message, = await sync_to_async(create_messages)(other_chat, self.alice, self.carol, 1)
+        for since in ('message_unknown', other_message.id):
+            bob = await self.connect(f'/ws/chat/{self.chat.id}/?since={since}', self.bob)
+            self.assertEqual((await self.receive_frame(bob, 'error'))['message'], 'Invalid since cursor.')
+            await bob.disconnect()
+
+    async def test_inbox_replays_every_subscribed_chat(self):
+        other_chat = await sync_to_async(create_chat)(self.carol, self.bob)
+        other_message, = await sync_to_async(create_messages)(other_chat, self.carol, self.bob, 1)
+        bob = await self.connect(f'/ws/inbox/?since={self.messages[3].id}', self.bob)
+        frames = await self.replay(bob)
+        self.assertEqual(
+            [message['id'] for frame in frames for message in frame['messages']],
+            [self.messages[4].id, self.messages[5].id, other_message.id]
+        )
+        await bob.disconnect()
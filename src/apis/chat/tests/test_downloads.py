@@ -0,0 +1,92 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.utils.http import http_date
+
+from ..downloads import attachment_response, parse_range
+from ..repository.chat_repository import ChatRepository
+from .base import ChatAPITestCase, use_temporary_media_root
+
+CONTENT = b'0123456789'
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_ranges(self):
+        for header, expected in (
+            ('bytes=2-5', (2, 5)),
+            ('bytes=2-', (2, 9)),
+            ('bytes=-3', (7, 9)),
+            ('bytes=5-20', (5, 9)),
+            # unsatisfiable
+            ('bytes=10-', (0, -1)),
+            ('bytes=-0', (0, -1)),
+            # ignored, the whole file is sent
+            ('bytes=5-2', None),
+            ('bytes=-', None),
+            ('bytes=0-1,4-5', None),
+            ('items=0-1', None),
+            (None, None),
+        ):
+            with self.subTest(header=header):
+                self.assertEqual(parse_range(header, len(CONTENT)), expected)
+
+
+@override_settings(CHAT_ATTACHMENT_SENDFILE=None)
+class AttachmentDownloadTests(ChatAPITestCase):
+    def setUp(self):
+        use_temporary_media_root(self)
+        self.message = ChatRepository.send_message(
+            self.chat.id, self.alice.id, 'file', SimpleUploadedFile('notes.txt', CONTENT)
+        )
+        self.url = f'/v1/chat/attachments/{self.message.id}'
+        self.token = self.bob.get_token('read write')
+
+    def download(self, **headers):
+        return self.api(self.bob).get(self.url, headers=headers)
+
+    def test_whole_files_are_sent_as_files(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.getvalue(), CONTENT)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        # the test client wraps the content, the response itself is left to the WSGI server's sendfile
+        response = attachment_response(RequestFactory().get(self.url), self.message.attachment.name)
+        self.addCleanup(response.file_to_stream.close)
+        self.assertFalse(response.is_async)
+
+    def test_ranges_are_partial_content(self):
+        response = self.download(Range='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual((response['Content-Range'], response['Content-Length']), ('bytes 2-5/10', '4'))
+
+    def test_invalid_ranges_are_ignored(self):
+        response = self.download(Range='bytes=5-2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.getvalue(), CONTENT)
+
+    def test_unsatisfiable_ranges(self):
+        response = self.download(Range='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_if_range_keeps_the_range_of_the_same_file_only(self):
+        etag = self.download()['ETag']
+        self.assertEqual(self.download(Range='bytes=2-5', If_Range=etag).status_code, 206)
+        self.assertEqual(self.download(Range='bytes=2-5', If_Range='"other"').status_code, 200)
+        self.assertEqual(self.download(Range='bytes=2-5', If_Range=f'W/{etag}').status_code, 200)
+        self.assertEqual(self.download(Range='bytes=2-5', If_Range=http_date(0)).status_code, 200)
+
+    def test_conditional_requests_are_not_modified(self):
+        response = self.download()
+        for headers in ({'If-None-Match': response['ETag']}, {'If-Modified-Since': response['Last-Modified']}):
+            with self.subTest(headers=headers):
+                not_modified = self.download(**headers)
+                self.assertEqual(not_modified.status_code, 304)
+                self.assertEqual(not_modified['ETag'], response['ETag'])
+                self.assertEqual(not_modified.content, b'')
+
+    async def test_asgi_requests_stream_the_file_in_the_request_thread(self):
+        response = await self.async_client.get(self.url, headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), CONTENT)
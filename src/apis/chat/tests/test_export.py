@@ -0,0 +1,74 @@
+import gzip
+import json
+
+from django.test import TestCase
+from django.utils import timezone
+
+from ..db_queries import base as chat_db_queries
+from ..entity.models import Message
+from ..entity.serializers import MessageSerializer
+from ..export import accepts_gzip
+from .base import ChatAPITestCase, create_messages
+
+
+class AcceptsGzipTests(TestCase):
+    def test_accept_encoding_headers(self):
+        for header, accepted in (
+                ('gzip', True),
+                ('deflate, gzip;q=0.5', True),
+                ('GZIP', True),
+                ('*', True),
+                ('br;q=1.0, gzip; q=0.001', True),
+                ('', False),
+                ('identity', False),
+                ('gzip;q=0', False),
+                ('gzip;q=0.0, deflate', False),
+                ('*;q=0', False),
+                ('x-gzipped', False),
+                ('nogzip', False),
+        ):
+            with self.subTest(header=header):
+                self.assertEqual(accepts_gzip(header), accepted)
+
+
+class ExportTests(ChatAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.messages = create_messages(cls.chat, cls.alice, cls.bob, 3)
+        Message.objects.filter(id=cls.messages[0].id).update(attachment='attachments/file.txt')  # noqa
+        chat_db_queries.advance_read_pointer(
+            cls.bob.id, cls.chat.id, cls.messages[1].timestamp, cls.messages[1].id, timezone.now()
+        )
+        cls.url = f'/v1/chat/export/{cls.chat.id}'
+
+    def export(self, **headers):
+        response = self.api(self.alice).get(self.url, **headers)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_lines_are_shaped_like_the_message_serializer(self):
+        response, content = self.export()
+        self.assertNotIn('Content-Encoding', response)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        lines = [json.loads(line) for line in content.decode().splitlines()]
+        messages = Message.objects.filter(  # noqa
+            chat=self.chat
+        ).select_related('sender', 'receiver').order_by('timestamp', 'id')
+        expected = MessageSerializer(messages, many=True, context={
+            'read_pointers': chat_db_queries.get_read_pointers([self.chat.id])
+        }).data
+        self.assertEqual(lines, json.loads(json.dumps(expected)))
+        self.assertEqual([line['is_read'] for line in lines], [True, True, False])
+        self.assertIsNotNone(lines[0]['read_time'])
+
+    def test_gzip_unless_refused(self):
+        response, content = self.export(HTTP_ACCEPT_ENCODING='deflate, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(gzip.decompress(content).decode().splitlines()), 3)
+        response, content = self.export(HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(len(content.decode().splitlines()), 3)
+
+    def test_only_participants_export(self):
+        self.assertEqual(self.api(self.carol).get(self.url).status_code, 404)
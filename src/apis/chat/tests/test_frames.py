@@ -0,0 +1,106 @@
+import json
+from io import StringIO
+from unittest import mock
+
+import msgpack
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from .. import frames as chat_frames
+from ..frames import FrameError, encode_once, json_codec, msgpack_codec, negotiate
+from .base import ChatSocketTestCase
+
+
+class FrameCodecTests(SimpleTestCase):
+    def test_negotiate_picks_the_first_known_subprotocol(self):
+        self.assertEqual(negotiate(['mqtt', 'chat.msgpack', 'chat.json']), (msgpack_codec, 'chat.msgpack'))
+        self.assertEqual(negotiate(['chat.json']), (json_codec, 'chat.json'))
+        self.assertEqual(negotiate(['mqtt']), (json_codec, None))
+        self.assertEqual(negotiate(None), (json_codec, None))
+
+    def test_frames_round_trip(self):
+        content = {'type': 'chat_message', 'message': {'id': 'message_1', 'content': 'héllo'}}
+        self.assertEqual(json_codec.decode(**json_codec.encode(content)), content)
+        self.assertEqual(msgpack_codec.decode(**msgpack_codec.encode(content)), content)
+        self.assertIsInstance(msgpack_codec.encode(content)['bytes_data'], bytes)
+
+    def test_invalid_frames(self):
+        for codec, frame, error in (
+                (json_codec, {'bytes_data': b'{}'}, 'Expected a text frame.'),
+                (json_codec, {'text_data': '{'}, 'Invalid JSON frame.'),
+                (json_codec, {'text_data': '[]'}, 'Frame must be an object.'),
+                (msgpack_codec, {'text_data': '{}'}, 'Expected a binary frame.'),
+                (msgpack_codec, {'bytes_data': b'\xc1'}, 'Invalid MessagePack frame.'),
+                (msgpack_codec, {'bytes_data': msgpack.packb([1])}, 'Frame must be a map.'),
+        ):
+            with self.subTest(error=error), self.assertRaisesMessage(FrameError, error):
+                codec.decode(**frame)
+
+    def test_codec_benchmark_runs(self):
+        out = StringIO()
+        call_command('benchmark_chat_codecs', iterations=10, stdout=out)
+        self.assertIn('chat.msgpack', out.getvalue())
+
+
+class MessagePackSocketTests(ChatSocketTestCase):
+    async def test_msgpack_sockets_exchange_binary_frames(self):
+        path = f'/ws/chat/{self.chat.id}/'
+        alice = await self.connect(path, self.alice, subprotocols=['chat.msgpack'])
+        bob = await self.connect(path, self.bob)
+
+        await alice.send_to(bytes_data=msgpack.packb({'message': 'packed'}))
+        frame = msgpack.unpackb(await alice.receive_from())
+        self.assertEqual((frame['type'], frame['message']['content']), ('chat_message', 'packed'))
+        # JSON sockets get the same message as text
+        self.assertEqual((await self.receive_frame(bob, 'chat_message'))['message'], frame['message'])
+
+        await alice.send_to(text_data='{"message": "text"}')
+        self.assertEqual(msgpack.unpackb(await alice.receive_from())['message'], 'Expected a binary frame.')
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_broadcast_frames_are_encoded_once(self):
+        path = f'/ws/chat/{self.chat.id}/'
+        sockets = [await self.connect(path, user) for user in (self.alice, self.bob, self.alice)]
+        with mock.patch.object(json_codec, 'dumps', wraps=json_codec.dumps) as dumps, \
+                mock.patch.object(msgpack_codec, 'dumps', wraps=msgpack_codec.dumps) as msgpack_dumps:
+            await sockets[1].send_json_to({'message': 'once'})
+            frames = [await socket.receive_from() for socket in sockets]
+        self.assertEqual(len(set(frames)), 1)
+        self.assertEqual(dumps.call_count, 1)
+        # no socket uses MessagePack
+        self.assertEqual(msgpack_dumps.call_count, 0)
+        for socket in sockets:
+            await socket.disconnect()
+
+
+class EncodeOnceTests(SimpleTestCase):
+    def test_encode_once_encodes_once_per_codec(self):
+        content = {'type': 'typing', 'chat_id': 'chat_1'}
+        with mock.patch.object(json_codec, 'dumps', wraps=json_codec.dumps) as dumps:
+            payloads = [encode_once('frame_1', content, json_codec) for _ in range(2)]
+        self.assertEqual(dumps.call_count, 1)
+        self.assertEqual(json.loads(payloads[0]), content)
+        self.assertEqual(msgpack.unpackb(encode_once('frame_1', content, msgpack_codec)), content)
+
+    def test_encoded_frames_are_bounded(self):
+        with mock.patch.object(chat_frames, 'ENCODED_FRAMES_MAX', 2):
+            for number in range(3):
+                encode_once(f'frame_{number}', {'number': number}, json_codec)
+            self.assertLessEqual(len(chat_frames._encoded_frames), 2)  # noqa
+            self.assertNotIn(('frame_0', 'chat.json'), chat_frames._encoded_frames)  # noqa
+
+    def test_add_field_matches_encoding_the_field(self):
+        # map headers change at 16 and 65536 entries
+        for size in (0, 1, 14, 15, 16, 65534, 65535, 65536):
+            content = {f'key{number}': number for number in range(size)}
+            with self.subTest(size=size):
+                for codec in (json_codec, msgpack_codec):
+                    payload = codec.add_field(codec.dumps(content), 'stream_id', '1-0')
+                    decoded = codec.decode(**codec.frame(payload))
+                    self.assertEqual(decoded, {'stream_id': '1-0', **content})
+
+    def test_fanout_benchmark_runs(self):
+        out = StringIO()
+        call_command('benchmark_chat_fanout', group_sizes=[2], rounds=2, stdout=out)
+        self.assertTrue(out.getvalue())
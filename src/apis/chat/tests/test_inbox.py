@@ -0,0 +1,171 @@
+import asyncio
+from unittest import mock, skipUnless
+
+import msgpack
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from redis.asyncio import Redis
+
+from ..streams import InboxStreams, parse_stream_id
+from .base import ChatSocketTestCase, RedisSocketTestCase, create_chat, create_user, redis_available
+
+
+class InboxConsumerTests(ChatSocketTestCase):
+    path = '/ws/inbox/'
+
+    def setUp(self):
+        super().setUp()
+        self.dave = create_user('dave')
+        self.tokens[self.dave.id] = self.dave.get_token('read write')
+        self.other_chat = create_chat(self.alice, self.dave)
+
+    async def test_every_chat_of_the_user_is_subscribed(self):
+        alice = await self.connect(self.path, self.alice)
+        subscribed = await self.receive_frame(alice, 'subscribed')
+        self.assertCountEqual(subscribed['chat_ids'], [self.chat.id, self.other_chat.id])
+
+        bob = await self.connect(f'/ws/chat/{self.chat.id}/', self.bob)
+        dave = await self.connect(f'/ws/chat/{self.other_chat.id}/', self.dave)
+        await bob.send_json_to({'message': 'from bob'})
+        await dave.send_json_to({'message': 'from dave'})
+        received = {
+            frame['message']['chat']: frame['message']['content']
+            for frame in [await self.receive_frame(alice, 'chat_message') for _ in range(2)]
+        }
+        self.assertEqual(received, {self.chat.id: 'from bob', self.other_chat.id: 'from dave'})
+        for socket in (bob, dave):
+            await self.receive_frame(socket, 'chat_message')
+
+        # frames from the inbox name their chat
+        await alice.send_json_to({'chat_id': self.other_chat.id, 'message': 'to dave'})
+        self.assertEqual((await self.receive_frame(dave, 'chat_message'))['message']['content'], 'to dave')
+        await self.assert_no_frame(bob)
+        await alice.send_json_to({'message': 'no chat'})
+        self.assertEqual((await self.receive_frame(alice, 'error'))['message'], 'Not subscribed to chat.')
+        for socket in (alice, bob, dave):
+            await socket.disconnect()
+
+    async def test_chats_are_unsubscribed_and_subscribed_again(self):
+        alice = await self.connect(self.path, self.alice)
+        await self.receive_frame(alice, 'subscribed')
+        bob = await self.connect(f'/ws/chat/{self.chat.id}/', self.bob)
+
+        await alice.send_json_to({'type': 'unsubscribe', 'chat_id': self.chat.id})
+        self.assertEqual((await self.receive_frame(alice, 'unsubscribed'))['chat_ids'], [self.chat.id])
+        await bob.send_json_to({'message': 'missed'})
+        await self.receive_frame(bob, 'chat_message')
+        await self.assert_no_frame(alice)
+        await alice.send_json_to({'chat_id': self.chat.id, 'message': 'unsubscribed'})
+        self.assertEqual((await self.receive_frame(alice, 'error'))['message'], 'Not subscribed to chat.')
+
+        await alice.send_json_to({'type': 'subscribe', 'chat_id': self.chat.id})
+        self.assertEqual((await self.receive_frame(alice, 'subscribed'))['chat_ids'], [self.chat.id])
+        await bob.send_json_to({'message': 'received'})
+        self.assertEqual((await self.receive_frame(alice, 'chat_message'))['message']['content'], 'received')
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_only_the_users_chats_can_be_subscribed(self):
+        carol_chat = await sync_to_async(create_chat)(self.bob, self.carol)
+        alice = await self.connect(self.path, self.alice)
+        await self.receive_frame(alice, 'subscribed')
+        for chat_id, error in ((carol_chat.id, 'Invalid chat_id!'), ('', 'chat_id is required.')):
+            await alice.send_json_to({'type': 'subscribe', 'chat_id': chat_id})
+            self.assertEqual((await self.receive_frame(alice, 'error'))['message'], error)
+        await alice.disconnect()
+
+    async def test_new_chats_of_the_user_are_subscribed(self):
+        carol = await self.connect(self.path, self.carol)
+        self.assertEqual((await self.receive_frame(carol, 'subscribed'))['chat_ids'], [])
+
+        chat = await sync_to_async(create_chat)(self.alice, self.carol)
+        self.assertEqual((await self.receive_frame(carol, 'subscribed'))['chat_ids'], [chat.id])
+        alice = await self.connect(f'/ws/chat/{chat.id}/', self.alice)
+        await alice.send_json_to({'message': 'hi carol'})
+        self.assertEqual((await self.receive_frame(carol, 'chat_message'))['message']['content'], 'hi carol')
+        await alice.disconnect()
+        await carol.disconnect()
+
+
+@skipUnless(redis_available(), 'the channel layer is not a reachable Redis')
+class InboxStreamTests(RedisSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chat_path = f'/ws/chat/{self.chat.id}/'
+
+    async def send_messages(self, count: int):
+        alice = await self.connect(self.chat_path, self.alice)
+        for number in range(count):
+            await alice.send_json_to({'message': f'message {number}'})
+            await self.receive_frame(alice, 'chat_message')
+        await alice.disconnect()
+
+    async def replay(self, device: str) -> list[dict]:
+        socket = await self.connect(f'/ws/inbox/?device={device}', self.bob)
+        frames = []
+        while (frame := await socket.receive_json_from())['type'] != 'inbox_replayed':
+            if frame['type'] == 'chat_message':
+                frames.append(frame)
+        self.assertEqual(frame['count'], len(frames))
+        await socket.disconnect()
+        return frames
+
+    async def test_live_frames_carry_their_stream_id(self):
+        bob = await self.connect('/ws/inbox/', self.bob)
+        await self.receive_frame(bob, 'inbox_replayed')
+        await self.send_messages(1)
+        frame = await self.receive_frame(bob, 'chat_message')
+        self.assertEqual(frame['stream_id'], (await self.replay('default'))[0]['stream_id'])
+        await bob.disconnect()
+
+    async def test_entries_are_replayed_in_every_codec(self):
+        await self.send_messages(1)
+        replayed = (await self.replay('laptop'))[0]
+        socket = await self.connect('/ws/inbox/?device=phone', self.bob, subprotocols=['chat.msgpack'])
+        while (frame := msgpack.unpackb(await socket.receive_from()))['type'] != 'chat_message':
+            pass
+        self.assertEqual(frame, replayed)
+        await socket.disconnect()
+
+    async def test_each_device_replays_what_it_has_not_acknowledged(self):
+        # both devices are known before the messages are sent
+        self.assertEqual(await self.replay('phone'), [])
+        self.assertEqual(await self.replay('laptop'), [])
+        await self.send_messages(3)
+
+        phone = await self.replay('phone')
+        self.assertEqual([frame['message']['content'] for frame in phone], ['message 0', 'message 1', 'message 2'])
+        socket = await self.connect('/ws/inbox/?device=phone', self.bob)
+        await self.receive_frame(socket, 'inbox_replayed')
+        await socket.send_json_to({'type': 'ack', 'stream_id': phone[1]['stream_id']})
+        await socket.send_json_to({'type': 'ack', 'stream_id': 'not a stream id'})
+        self.assertEqual((await self.receive_frame(socket, 'error'))['message'], 'stream_id must be an inbox stream id.')
+        await socket.disconnect()
+
+        self.assertEqual([frame['stream_id'] for frame in await self.replay('phone')], [phone[2]['stream_id']])
+        # the phone's ack does not trim what the laptop has not seen
+        self.assertEqual(len(await self.replay('laptop')), 3)
+        # a new device starts after the latest acknowledged entry
+        self.assertEqual(len(await self.replay('tablet')), 1)
+
+    async def test_acks_trim_up_to_the_oldest_device(self):
+        inbox = InboxStreams(get_channel_layer())
+        for device in ('phone', 'laptop'):
+            self.assertEqual(await inbox.get_ack(self.bob.id, device), '0-0')
+        stream_ids = await asyncio.gather(*(
+            inbox.append([self.bob.id], self.chat.id, {'number': number}) for number in range(3)
+        ))
+        stream_ids = sorted((ids[self.bob.id] for ids in stream_ids), key=parse_stream_id)
+
+        with mock.patch.object(Redis, 'xtrim', autospec=True, side_effect=Redis.xtrim) as xtrim:
+            await inbox.ack(self.bob.id, 'phone', stream_ids[2])
+            await inbox.ack(self.bob.id, 'laptop', stream_ids[1])
+        # the entry at the oldest ack id is kept
+        self.assertEqual([call.kwargs['minid'] for call in xtrim.call_args_list], ['0-0', stream_ids[1]])
+        self.assertEqual(await inbox.get_ack(self.bob.id, 'laptop'), stream_ids[1])
+        self.assertEqual(await inbox.get_ack(self.bob.id, 'phone'), stream_ids[2])
+
+    async def test_invalid_device_ids_are_rejected(self):
+        for device in ('a' * 65, 'bad%20device', 'bad.device'):
+            connected, _ = await self.communicator(f'/ws/inbox/?device={device}', self.bob).connect()
+            self.assertFalse(connected, device)
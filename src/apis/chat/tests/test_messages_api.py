@@ -0,0 +1,180 @@
+from datetime import timedelta
+
+from django.contrib.postgres.search import SearchQuery
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ..entity import model_helpers as chat_model_helpers
+from ..entity.models import Message
+from .base import ChatAPITestCase, create_chat, create_messages, create_user
+
+
+class MessageListTests(ChatAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.messages = create_messages(cls.chat, cls.alice, cls.bob, 25)
+        cls.url = f'/v1/chat/messages/{cls.chat.id}'
+
+    def get_page(self, **params) -> dict:
+        response = self.api(self.bob).get(self.url, {'items_per_page': 10, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['data']
+
+    def ids(self, page: dict) -> list[str]:
+        return [message['id'] for message in page['results']]
+
+    def test_pages_back_with_before_cursors(self):
+        newest_first = [message.id for message in reversed(self.messages)]
+        pages = [self.get_page()]
+        while pages[-1]['has_more']:
+            pages.append(self.get_page(before=pages[-1]['before']))
+        self.assertEqual([len(page['results']) for page in pages], [10, 10, 5])
+        self.assertEqual([message_id for page in pages for message_id in self.ids(page)], newest_first)
+
+        # an empty page past the end keeps its cursor
+        last = self.get_page(before=pages[-1]['before'])
+        self.assertEqual((last['results'], last['has_more'], last['before']), ([], False, pages[-1]['before']))
+
+    def test_pages_forward_with_after_cursors(self):
+        oldest = self.get_page(before=self.get_page(before=self.get_page()['before'])['before'])
+        newer = self.get_page(after=oldest['after'])
+        # still newest first within the page
+        self.assertEqual(self.ids(newer), [message.id for message in reversed(self.messages[5:15])])
+        self.assertTrue(newer['has_more'])
+
+    def test_pages_serialize_read_state_and_participants(self):
+        page = self.get_page(items_per_page=1)
+        message = page['results'][0]
+        self.assertEqual((message['sender']['id'], message['receiver']['id']), (self.alice.id, self.bob.id))
+        self.assertFalse(message['is_read'])
+
+    def test_only_the_page_is_queried(self):
+        with CaptureQueriesContext(connection) as small:
+            self.get_page(items_per_page=2)
+        with CaptureQueriesContext(connection) as large:
+            self.get_page(items_per_page=20)
+        self.assertEqual(len(small), len(large))
+        self.assertFalse([query for query in large.captured_queries if 'COUNT(' in query['sql']])
+
+    def test_invalid_requests(self):
+        client = self.api(self.bob)
+        for params, message in (
+                ({'before': 'garbage'}, 'Invalid before cursor!'),
+                ({'after': 'garbage'}, 'Invalid after cursor!'),
+        ):
+            response = client.get(self.url, params)
+            self.assertEqual((response.status_code, response.data['message']), (400, message))
+        cursor = self.get_page()['before']
+        response = client.get(self.url, {'before': cursor, 'after': cursor})
+        self.assertEqual((response.status_code, response.data['message']),
+                         (400, 'Only one of before and after can be used!'))
+        self.assertEqual(client.get('/v1/chat/messages/chat_unknown').status_code, 404)
+
+
+@override_settings(CHAT_LIST_PREVIEW_LENGTH=5)
+class ChatListTests(ChatAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # alice's chats by last activity: carol (no messages, created last), bob, dave
+        cls.dave = create_user('dave')
+        cls.dave_chat = create_chat(cls.alice, cls.dave)
+        create_messages(cls.dave_chat, cls.dave, cls.alice, 1)
+        Message.objects.filter(chat=cls.dave_chat).update(timestamp=timezone.now() - timedelta(hours=1))  # noqa
+        cls.messages = create_messages(cls.chat, cls.bob, cls.alice, 3)
+        Message.objects.filter(id=cls.messages[-1].id).update(attachment='attachments/file')  # noqa
+        cls.carol_chat = create_chat(cls.alice, cls.carol)
+
+    def get_page(self, user=None, **params) -> dict:
+        response = self.api(user or self.alice).get('/v1/chat/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['data']
+
+    def test_chats_are_listed_by_last_activity(self):
+        chats = self.get_page()['results']
+        self.assertEqual([chat['id'] for chat in chats], [self.carol_chat.id, self.chat.id, self.dave_chat.id])
+        carol_chat, chat, _ = chats
+        self.assertIsNone(carol_chat['last_message'])
+        self.assertEqual(carol_chat['unread_count'], 0)
+        self.assertEqual({user['id'] for user in chat['participants']}, {self.alice.id, self.bob.id})
+        self.assertEqual(chat['unread_count'], 3)
+        last = self.messages[-1]
+        self.assertEqual(
+            {key: chat['last_message'][key] for key in ('id', 'sender', 'content', 'has_attachment')},
+            {'id': last.id, 'sender': self.bob.id, 'content': last.content[:5], 'has_attachment': True}
+        )
+        self.assertEqual(chat['last_activity'], chat['last_message']['timestamp'])
+
+    def test_unread_count_is_the_users(self):
+        chats = self.get_page(self.bob)['results']
+        self.assertEqual([(chat['id'], chat['unread_count']) for chat in chats], [(self.chat.id, 0)])
+
+    def test_pages_back_with_before_cursors(self):
+        first = self.get_page(items_per_page=2)
+        self.assertTrue(first['has_more'])
+        second = self.get_page(items_per_page=2, before=first['before'])
+        self.assertFalse(second['has_more'])
+        self.assertEqual(
+            [chat['id'] for chat in first['results'] + second['results']],
+            [self.carol_chat.id, self.chat.id, self.dave_chat.id]
+        )
+        response = self.api(self.alice).get('/v1/chat/', {'before': 'garbage'})
+        self.assertEqual((response.status_code, response.data['message']), (400, 'Invalid before cursor!'))
+
+    def test_a_page_is_two_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get_page()
+        # the page and its participants, besides authenticating the user
+        chat_queries = [query['sql'] for query in queries.captured_queries if 'chat_' in query['sql']]
+        self.assertEqual(len(chat_queries), 2, chat_queries)
+
+
+class MessageSearchTests(ChatAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.carol_chat = create_chat(cls.alice, cls.carol)
+        cls.messages = Message.objects.bulk_create([  # noqa
+            Message(chat=chat, sender=cls.alice, receiver=receiver, content=content)
+            for chat, receiver, content in (
+                (cls.chat, cls.bob, 'the deploy failed again'),
+                (cls.chat, cls.bob, 'deploying the fix, deploy logs attached'),
+                (cls.chat, cls.bob, 'lunch?'),
+                (cls.carol_chat, cls.carol, 'deploy went fine'),
+            )
+        ])
+
+    def search(self, user, **params):
+        response = self.api(user).get('/v1/chat/search', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['data']
+
+    def test_matches_of_the_users_chats_best_first(self):
+        # stemmed, so `deploying` matches too
+        results = self.search(self.alice, q='deploy')['results']
+        self.assertEqual(results[0]['id'], self.messages[1].id)
+        self.assertEqual({result['id'] for result in results}, {self.messages[i].id for i in (0, 1, 3)})
+        self.assertEqual({result['id'] for result in self.search(self.bob, q='deploy')['results']},
+                         {self.messages[0].id, self.messages[1].id})
+        results = self.search(self.alice, q='deploy', chat_id=self.carol_chat.id)['results']
+        self.assertEqual([result['id'] for result in results], [self.messages[3].id])
+
+    def test_pages_with_after_cursors(self):
+        first = self.search(self.alice, q='deploy', items_per_page=2)
+        self.assertTrue(first['has_more'])
+        second = self.search(self.alice, q='deploy', items_per_page=2, after=first['after'])
+        self.assertFalse(second['has_more'])
+        self.assertEqual(len({result['id'] for result in first['results'] + second['results']}), 3)
+
+    def test_matching_uses_the_search_index(self):
+        # the search filter, apart from the rest of the query the planner may start from
+        matches = Message.objects.alias(  # noqa
+            search_vector=chat_model_helpers.message_search_vector()
+        ).filter(search_vector=SearchQuery('deploy', config=chat_model_helpers.SEARCH_CONFIG)).values('id')
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = matches.explain()
+        self.assertIn('search_idx', plan)
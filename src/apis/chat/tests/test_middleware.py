@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from .. import middleware
+from ..middleware import TokenCache, UserCache, get_token_payload
+
+
+def payload(hours: float = 1) -> dict:
+    return {'sub': 'user_1', 'expiry_time': datetime.now() + timedelta(hours=hours)}
+
+
+class TokenCacheTests(SimpleTestCase):
+    def test_least_recently_used_and_expired_tokens_are_dropped(self):
+        cache = TokenCache(max_size=2)
+        cache.set('a', {'sub': 'a'}, time.time() + 60)
+        cache.set('b', {'sub': 'b'}, time.time() + 60)
+        cache.get('a')
+        cache.set('c', {'sub': 'c'}, time.time() + 60)
+        self.assertEqual((cache.get('a'), cache.get('b')), ({'sub': 'a'}, None))
+
+        cache.set('d', {'sub': 'd'}, time.time() - 1)
+        self.assertIsNone(cache.get('d'))
+
+    def test_users_expire_after_the_ttl(self):
+        cache = UserCache(ttl=60, max_size=2)
+        cache.set('user_1', 'alice')
+        self.assertEqual(cache.get('user_1'), 'alice')
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('user_1'))
+
+
+class TokenPayloadTests(SimpleTestCase):
+    def setUp(self):
+        middleware.token_cache._entries.clear()
+        self.addCleanup(middleware.token_cache._entries.clear)
+
+    async def test_tokens_are_verified_once(self):
+        with mock.patch.object(middleware, 'verify_token', return_value=payload()) as verify_token:
+            payloads = await asyncio.gather(*(get_token_payload('token') for _ in range(3)))
+            self.assertEqual(await get_token_payload('token'), payloads[0])
+        self.assertEqual(verify_token.call_count, 1)
+        self.assertEqual(middleware._pending, {})
+
+    async def test_invalid_and_expired_tokens(self):
+        for verified in (None, payload(hours=-1)):
+            with self.subTest(verified=verified), mock.patch.object(middleware, 'verify_token', return_value=verified):
+                self.assertIsNone(await get_token_payload(f'token {verified}'))
+
+    async def test_a_cancelled_connect_does_not_fail_the_others(self):
+        verifying = threading.Event()
+
+        def verify_token(token_key: str) -> dict:
+            verifying.wait(5)
+            return payload()
+
+        with mock.patch.object(middleware, 'verify_token', verify_token):
+            first = asyncio.ensure_future(get_token_payload('shared'))
+            second = asyncio.ensure_future(get_token_payload('shared'))
+            await asyncio.sleep(0.05)
+            first.cancel()
+            await asyncio.sleep(0)
+            verifying.set()
+            self.assertEqual((await asyncio.wait_for(second, 5))['sub'], 'user_1')
+        self.assertTrue(first.cancelled())
+        self.assertEqual(middleware._pending, {})
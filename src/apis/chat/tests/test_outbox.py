@@ -0,0 +1,166 @@
+import asyncio
+import functools
+import gc
+from types import SimpleNamespace
+from unittest import mock
+
+from channels.layers import InMemoryChannelLayer
+from django.test import SimpleTestCase, override_settings
+
+from ...clients import enums as client_enums
+from ...users.models import User
+from .. import consumers
+from ..outbox import SendQueue, SendQueueFull, channel_layer_backlog, send_queue_stats, transport_write_buffer
+from .base import ChatAPITestCase, ChatSocketTestCase
+
+
+def frame(text: str) -> dict:
+    return {'type': 'websocket.send', 'text': text}
+
+
+class SendQueueTests(SimpleTestCase):
+    async def test_keyed_frames_still_queued_are_coalesced(self):
+        queue = SendQueue(10)
+        queue.put(frame('typing 1'), key='typing')
+        queue.put(frame('message'))
+        queue.put(frame('typing 2'), key='typing')
+        self.assertEqual(len(queue), 2)
+        self.assertEqual([await queue.get(), await queue.get()], [frame('typing 2'), frame('message')])
+
+        # sent frames are not replaced
+        queue.put(frame('typing 3'), key='typing')
+        self.assertEqual(await queue.get(), frame('typing 3'))
+        self.assertEqual(queue.stats, {'sent': 3, 'coalesced': 1, 'dropped': 0, 'max_depth': 2})
+
+    def test_keyed_frames_are_dropped_first_at_the_high_water_mark(self):
+        queue = SendQueue(3)
+        queue.put(frame('message 1'))
+        queue.put(frame('typing'), key='typing')
+        queue.put(frame('message 2'))
+        # full, a keyed frame is dropped rather than queued
+        queue.put(frame('receipt'), key='receipt')
+        # and queued keyed frames make room for chat messages
+        queue.put(frame('message 3'))
+        self.assertEqual([message for _, message in queue._entries], [  # noqa
+            frame('message 1'), frame('message 2'), frame('message 3')
+        ])
+        self.assertEqual(queue.stats['dropped'], 2)
+        with self.assertRaises(SendQueueFull):
+            queue.put(frame('message 4'))
+        self.assertTrue(queue.closed)
+
+    def test_events_waiting_in_the_channel_layer_count_as_undelivered(self):
+        backlog = 2
+        queue = SendQueue(3, backlog=lambda: backlog)
+        queue.put(frame('message 1'))
+        self.assertEqual(queue.depth, 3)
+        with self.assertRaises(SendQueueFull):
+            queue.put(frame('message 2'))
+
+    async def test_close_is_sent_after_the_queued_frames(self):
+        queue = SendQueue(10)
+        queue.put(frame('message'))
+        queue.close({'type': 'websocket.close'})
+        queue.put(frame('too late'))
+        self.assertEqual(await queue.get(), frame('message'))
+        self.assertEqual(await queue.get(), {'type': 'websocket.close'})
+        self.assertEqual(len(queue), 0)
+
+    async def test_get_waits_for_a_frame(self):
+        queue = SendQueue(10)
+        waiting = asyncio.ensure_future(queue.get())
+        await asyncio.sleep(0)
+        self.assertFalse(waiting.done())
+        queue.put(frame('message'))
+        self.assertEqual(await asyncio.wait_for(waiting, 1), frame('message'))
+
+    async def test_join_waits_for_the_queue_to_drain(self):
+        queue = SendQueue(10)
+        queue.put(frame('one'))
+        queue.put(frame('two'))
+        joined = asyncio.ensure_future(queue.join(1))
+        await asyncio.sleep(0)
+        self.assertFalse(joined.done())
+        await queue.get()
+        await asyncio.wait_for(joined, 1)
+
+    def test_stats_are_gauges_of_the_open_queues(self):
+        queues = [SendQueue(10, write_buffer=lambda: 100), SendQueue(10, backlog=lambda: 1)]
+        queues[0].put(frame('one'))
+        queues[1].put(frame('two'))
+        queues[1].put(frame('three'))
+        stats = send_queue_stats()
+        self.assertGreaterEqual(stats['connections'], 2)
+        self.assertGreaterEqual(stats['queued_frames'], 4)
+        self.assertGreaterEqual(stats['max_queue_depth'], 3)
+        self.assertGreaterEqual(stats['buffered_bytes'], 100)
+
+        connections = stats['connections']
+        queues[1].discard()
+        self.assertEqual(send_queue_stats()['connections'], connections - 1)
+
+
+class UndeliveredFrameTests(SimpleTestCase):
+    def test_daphne_write_buffer(self):
+        tcp = SimpleNamespace(dataBuffer=b'abcdef', offset=2, _tempDataLen=3)
+        protocol = SimpleNamespace(transport=SimpleNamespace(transport=tcp))  # TLS over TCP
+
+        async def handle_reply(_protocol, message):
+            pass
+
+        self.assertEqual(transport_write_buffer(functools.partial(handle_reply, protocol)), 7)
+        # not a Daphne connection
+        self.assertIsNone(transport_write_buffer(handle_reply))
+
+    async def test_channel_layer_backlog(self):
+        layer = InMemoryChannelLayer()
+        channel = await layer.new_channel()
+        self.assertEqual(channel_layer_backlog(layer, channel), 0)
+        await layer.send(channel, {'type': 'chat_message'})
+        await layer.send(channel, {'type': 'chat_message'})
+        self.assertEqual(channel_layer_backlog(layer, channel), 2)
+
+
+class SocketSendQueueTests(ChatSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        # as if served by Daphne, with `unread` bytes the clients have not read
+        self.unread = 0
+        patcher = mock.patch.object(consumers, 'transport_write_buffer', side_effect=lambda send: self.unread)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_frames_are_sent_while_the_client_reads(self):
+        # so the queues other tests left behind are not collected in between
+        gc.collect()
+        connections = send_queue_stats()['connections']
+        alice = await self.connect(f'/ws/chat/{self.chat.id}/', self.alice)
+        await alice.send_json_to({'message': 'hello'})
+        self.assertEqual((await self.receive_frame(alice, 'chat_message'))['message']['content'], 'hello')
+        self.assertEqual(send_queue_stats()['connections'], connections + 1)
+        await alice.disconnect()
+        self.assertEqual(send_queue_stats()['connections'], connections)
+
+    @override_settings(CHAT_SEND_QUEUE_HIGH_WATER=3, CHAT_SEND_BUFFER_HIGH_WATER=1024)
+    async def test_clients_that_stop_reading_are_closed(self):
+        alice = await self.connect(f'/ws/chat/{self.chat.id}/', self.alice)
+        bob = await self.connect(f'/ws/chat/{self.chat.id}/', self.bob)
+        self.unread = 4096
+        for number in range(4):
+            await bob.send_json_to({'message': f'message {number}'})
+        # nothing is sent while the client is not reading, then the socket is closed
+        self.assertEqual(await alice.receive_output(timeout=2), {
+            'type': 'websocket.close', 'code': consumers.SLOW_CONSUMER_CLOSE_CODE
+        })
+        await bob.disconnect()
+
+
+class ChatMetricsAPITests(ChatAPITestCase):
+    def test_admins_get_the_send_queue_gauges(self):
+        admin = User.objects.create(username='admin', role=client_enums.RoleEnum.ADMIN_USER)
+        response = self.api(admin).get('/v1/chat/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['data']), {'send_queues', 'write_behind'})
+        self.assertIn('max_queue_depth', response.json()['data']['send_queues'])
+
+        self.assertNotEqual(self.api(self.alice).get('/v1/chat/metrics').status_code, 200)
@@ -0,0 +1,91 @@
+from datetime import datetime, timezone as dt_timezone
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from .. import partitions
+from ..entity.models import Message
+from .base import create_chat, create_user
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+class PartitionHelperTests(TestCase):
+    def test_month_start(self):
+        self.assertEqual(partitions.month_start(utc(2026, 10, 18, 21, 30)), utc(2026, 10, 1))
+        self.assertEqual(partitions.month_start(utc(2026, 12, 31), 1), utc(2027, 1, 1))
+        self.assertEqual(partitions.month_start(utc(2026, 1, 15), -13), utc(2024, 12, 1))
+        self.assertEqual(partitions.partition_name(utc(2027, 3, 1)), 'chat_message_y2027m03')
+
+    def test_parse_bound(self):
+        self.assertIsNone(partitions._parse_bound('MINVALUE'))  # noqa
+        self.assertIsNone(partitions._parse_bound('MAXVALUE'))  # noqa
+        self.assertEqual(partitions._parse_bound("'2026-11-01 00:00:00+00'"), utc(2026, 11, 1))  # noqa
+
+    def test_list_partitions(self):
+        listed = partitions.list_partitions()
+        self.assertEqual(listed[0].name, partitions.LEGACY_PARTITION)
+        self.assertIsNone(listed[0].start)
+        self.assertNotIn(partitions.DEFAULT_PARTITION, [partition.name for partition in listed])
+        # contiguous monthly ranges after the legacy one
+        for previous, partition in zip(listed, listed[1:]):
+            self.assertEqual(partition.start, previous.end)
+            self.assertEqual(partition.end, partitions.month_start(partition.start, 1))
+            self.assertEqual(partition.name, partitions.partition_name(partition.start))
+
+
+class CreatePartitionsTests(TestCase):
+    # far past the partitions created by the migration, so these rows land in the default partition
+    now = utc(2031, 6, 15)
+
+    @classmethod
+    def setUpTestData(cls):
+        alice, bob = create_user('alice'), create_user('bob')
+        chat = create_chat(alice, bob)
+        cls.messages = Message.objects.bulk_create([  # noqa
+            Message(chat=chat, sender=alice, receiver=bob, content=f'{timestamp:%Y-%m}', timestamp=timestamp)
+            for timestamp in [utc(2031, 6, day) for day in range(1, 6)] + [utc(2031, 7, 1), utc(2035, 1, 1)]
+        ])
+        # check their foreign keys now, as a commit would, a table with pending checks can't be altered
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    def partition_of(self) -> dict:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT tableoid::regclass::text, id FROM "{partitions.TABLE}"')
+            return {message_id: table for table, message_id in cursor.fetchall()}
+
+    def test_rows_of_new_months_move_out_of_the_default_partition(self):
+        with CaptureQueriesContext(connection) as queries:
+            created = partitions.create_partitions(1, self.now, batch_size=2)
+        self.assertEqual(created, ['chat_message_y2031m06', 'chat_message_y2031m07'])
+        self.assertTrue([query for query in queries.captured_queries if 'SET LOCAL lock_timeout' in query['sql']])
+
+        located = self.partition_of()
+        self.assertEqual(
+            [located[message.id] for message in self.messages],
+            ['chat_message_y2031m06'] * 5 + ['chat_message_y2031m07', partitions.DEFAULT_PARTITION]
+        )
+        self.assertNotIn(partitions.DETACHED_DEFAULT, {table for table in located.values()})
+        self.assertEqual(partitions.create_partitions(1, self.now), [])
+
+    def test_empty_default_partition_is_kept(self):
+        created = partitions.create_partitions(0, utc(2033, 1, 1))
+        self.assertEqual(created, ['chat_message_y2033m01'])
+        self.assertEqual(set(self.partition_of().values()), {partitions.DEFAULT_PARTITION})
+
+    def test_an_interrupted_move_is_resumed(self):
+        with mock.patch.object(partitions, 'move_detached_default'):
+            partitions.create_partitions(0, self.now)
+        # only the rows of months that still have no partition are in the table
+        self.assertEqual(Message.objects.count(), 0)  # noqa
+
+        self.assertEqual(partitions.move_detached_default(batch_size=3), 7)
+        located = self.partition_of()
+        self.assertEqual(len(located), 7)
+        self.assertEqual(located[self.messages[-2].id], partitions.DEFAULT_PARTITION)
+        self.assertEqual(partitions.move_detached_default(), 0)
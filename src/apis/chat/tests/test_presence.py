@@ -0,0 +1,90 @@
+import asyncio
+import time
+from unittest import skipUnless
+
+from channels.layers import get_channel_layer
+from django.test import override_settings
+
+from ..presence import PresenceStore
+
+from .base import ChatSocketTestCase, RedisSocketTestCase, redis_available
+
+
+@override_settings(CHAT_TYPING_INTERVAL=60)
+class TypingTests(ChatSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = f'/ws/chat/{self.chat.id}/'
+
+    async def test_typing_is_sent_to_the_other_participants_once_per_interval(self):
+        alice = await self.connect(self.path, self.alice)
+        bob = await self.connect(self.path, self.bob)
+
+        for _ in range(3):
+            await alice.send_json_to({'type': 'typing'})
+        typing = await self.receive_frame(bob, 'typing')
+        self.assertEqual((typing['chat_id'], typing['user_id'], typing['expires_in']), (self.chat.id, self.alice.id, 60))
+        await self.assert_no_frame(bob)
+        await self.assert_no_frame(alice)
+
+        # a sent message ends the indicator
+        await alice.send_json_to({'message': 'done typing'})
+        await self.receive_frame(bob, 'chat_message')
+        await alice.send_json_to({'type': 'typing'})
+        await self.receive_frame(bob, 'typing')
+        await alice.disconnect()
+        await bob.disconnect()
+
+
+@skipUnless(redis_available(), 'the channel layer is not a reachable Redis')
+@override_settings(CHAT_TYPING_INTERVAL=60)
+class PresenceTests(RedisSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = f'/ws/chat/{self.chat.id}/'
+
+    async def test_partners_are_told_when_a_user_comes_online(self):
+        bob = await self.connect(self.path, self.bob)
+        # bob's snapshot of alice, offline and never seen
+        presence = await self.receive_frame(bob, 'presence')
+        self.assertEqual((presence['user_id'], presence['status'], presence['last_seen']), (self.alice.id, 'offline', None))
+
+        alice = await self.connect(self.path, self.alice)
+        self.assertEqual((await self.receive_frame(alice, 'presence'))['status'], 'online')
+        presence = await self.receive_frame(bob, 'presence')
+        self.assertEqual((presence['user_id'], presence['status']), (self.alice.id, 'online'))
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_a_user_is_offline_once_every_connection_is_closed(self):
+        presence = PresenceStore(get_channel_layer())
+        self.assertTrue(await presence.connect(self.alice.id, 'first'))
+        self.assertFalse(await presence.connect(self.alice.id, 'second'))
+        self.assertEqual((await presence.get_status(self.alice.id))['status'], 'online')
+
+        self.assertFalse(await presence.disconnect(self.alice.id, 'first'))
+        self.assertTrue(await presence.disconnect(self.alice.id, 'second'))
+        status = await presence.get_status(self.alice.id)
+        self.assertEqual(status['status'], 'offline')
+        self.assertAlmostEqual(status['last_seen'], time.time(), delta=5)
+
+    @override_settings(CHAT_PRESENCE_TTL=1)
+    async def test_connections_without_heartbeat_expire(self):
+        presence = PresenceStore(get_channel_layer())
+        await presence.connect(self.alice.id, 'crashed')
+        await presence.connect(self.bob.id, 'alive')
+        await asyncio.sleep(0.6)
+        await presence.heartbeat(self.bob.id, 'alive')
+        await asyncio.sleep(0.6)
+        self.assertEqual((await presence.get_status(self.alice.id))['status'], 'offline')
+        self.assertEqual((await presence.get_status(self.bob.id))['status'], 'online')
+
+    async def test_typing_is_coalesced_across_the_sockets_of_a_user(self):
+        bob = await self.connect(self.path, self.bob)
+        sockets = [await self.connect(self.path, self.alice) for _ in range(2)]
+        for socket in sockets:
+            await socket.send_json_to({'type': 'typing'})
+        await self.receive_frame(bob, 'typing')
+        self.assertTrue(await bob.receive_nothing(timeout=0.3))
+        for socket in (bob, *sockets):
+            await socket.disconnect()
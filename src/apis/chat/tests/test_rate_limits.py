@@ -0,0 +1,138 @@
+import gc
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase, override_settings
+
+from ..entity.models import Message
+from .. import rate_limits
+from ..rate_limits import RateLimiter, TokenBucket, UserRateLimiter
+from .base import ChatSocketTestCase, RedisSocketTestCase, redis_available
+
+LIMITS: dict = {'message': {'connection': (1, 3), 'user': (1, 4)}}
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_tokens_refill_up_to_the_burst(self):
+        bucket = TokenBucket(rate=2, burst=4)
+        now = bucket.updated
+        self.assertEqual(bucket.wait_time(4, now), 0)
+        bucket.take(4)
+        self.assertEqual(bucket.wait_time(1, now), 0.5)
+        self.assertEqual(bucket.wait_time(1, now + 0.5), 0)
+        self.assertEqual(bucket.wait_time(4, now + 100), 0)
+        self.assertEqual(bucket.tokens, 4)
+
+
+@override_settings(CHAT_RATE_LIMITS=LIMITS, CHAT_RATE_LIMIT_REDIS_SYNC=False)
+class RateLimiterTests(SimpleTestCase):
+    async def test_connection_limit(self):
+        limiter = RateLimiter('user_connection', None)
+        for _ in range(3):
+            self.assertEqual(await limiter.check('message'), 0)
+        self.assertGreater(await limiter.check('message'), 0)
+
+    async def test_user_limit_is_shared_by_the_users_sockets(self):
+        sockets = [RateLimiter('user_shared', None) for _ in range(2)]
+        self.assertIs(sockets[0].user, sockets[1].user)
+        for limiter in (*sockets, *sockets):
+            self.assertEqual(await limiter.check('message'), 0)
+        # both sockets are under their own limit, the user is over theirs
+        self.assertGreater(await sockets[0].check('message'), 0)
+        self.assertAlmostEqual(sockets[0].buckets['message'].tokens, 1, delta=0.1)
+
+    async def test_user_limits_outlive_the_users_sockets_until_refilled(self):
+        limiter = RateLimiter('user_reconnecting', None)
+        for _ in range(3):
+            await limiter.check('message')
+        user = limiter.user
+        del limiter
+        gc.collect()
+        reconnected = RateLimiter('user_reconnecting', None)
+        self.assertIs(reconnected.user, user)
+        self.assertAlmostEqual(user.buckets['message'].tokens, 1, delta=0.1)
+
+        # refilled in 3 seconds, then the limiter is let go
+        bucket = user.buckets['message']
+        self.assertAlmostEqual(user.refilled_at(), bucket.updated + (4 - bucket.tokens), delta=0.01)
+        with mock.patch.object(rate_limits, '_pruned_at', 0.0):
+            rate_limits.prune_user_limiters(user.refilled_at())
+        self.assertNotIn('user_reconnecting', rate_limits._retained_user_limiters)  # noqa
+
+
+@override_settings(CHAT_RATE_LIMITS=LIMITS)
+class RateLimitedSocketTests(ChatSocketTestCase):
+    async def test_frames_over_the_limit_are_rejected(self):
+        alice = await self.connect(f'/ws/chat/{self.chat.id}/', self.alice)
+        for number in range(3):
+            await alice.send_json_to({'message': f'message {number}'})
+            await self.receive_frame(alice, 'chat_message')
+        await alice.send_json_to({'message': 'too many'})
+        error = await self.receive_frame(alice, 'error')
+        self.assertEqual((error['message'], error['kind']), ('Rate limit exceeded.', 'message'))
+        self.assertGreater(error['retry_after'], 0)
+        self.assertEqual(await sync_to_async(Message.objects.count)(), 3)
+        await alice.disconnect()
+
+    async def test_reconnecting_does_not_refill_the_user_bucket(self):
+        alice = await self.connect(f'/ws/chat/{self.chat.id}/', self.alice)
+        for number in range(3):
+            await alice.send_json_to({'message': f'message {number}'})
+            await self.receive_frame(alice, 'chat_message')
+        await alice.disconnect()
+        gc.collect()
+
+        alice = await self.connect(f'/ws/chat/{self.chat.id}/', self.alice)
+        await alice.send_json_to({'message': 'message 3'})
+        await self.receive_frame(alice, 'chat_message')
+        # a new connection bucket, but the user's is drained
+        await alice.send_json_to({'message': 'too many'})
+        self.assertEqual((await self.receive_frame(alice, 'error'))['kind'], 'message')
+        self.assertEqual(await sync_to_async(Message.objects.count)(), 4)
+        await alice.disconnect()
+
+
+@override_settings(CHAT_RATE_LIMITS={
+    kind: {'connection': (0.01, 1), 'user': (0.01, 1)} for kind in ('control', 'typing', 'subscribe', 'upload_init')
+})
+class FrameKindRateLimitTests(ChatSocketTestCase):
+    async def test_every_type_of_frame_is_limited(self):
+        alice = await self.connect('/ws/inbox/', self.alice)
+        for frame, kind in (
+            ({'type': 'heartbeat'}, 'control'),
+            ({'type': 'typing', 'chat_id': self.chat.id}, 'typing'),
+            # unknown chats are looked up in the database, until the limit is reached
+            ({'type': 'subscribe', 'chat_id': 'chat_unknown'}, 'subscribe'),
+            ({'type': 'upload_init', 'chat_id': self.chat.id, 'format': 'png', 'size': 4}, 'upload_init'),
+        ):
+            with self.subTest(frame=frame):
+                await alice.send_json_to(frame)
+                await alice.send_json_to(frame)
+                error = await self.receive_frame(alice, 'error')
+                while error['message'] != 'Rate limit exceeded.':
+                    error = await self.receive_frame(alice, 'error')
+                self.assertEqual(error['kind'], kind)
+        await alice.disconnect()
+
+
+@skipUnless(redis_available(), 'the channel layer is not a reachable Redis')
+@override_settings(CHAT_RATE_LIMITS=LIMITS, CHAT_RATE_LIMIT_SYNC_INTERVAL=0, CHAT_RATE_LIMIT_SYNC_WINDOW=60)
+class RateLimitSyncTests(RedisSocketTestCase):
+    async def test_users_over_the_limit_across_nodes_are_blocked(self):
+        channel_layer = get_channel_layer()
+        # the same user's limiters on two nodes
+        nodes = [UserRateLimiter(self.alice.id), UserRateLimiter(self.alice.id)]
+        for node in nodes:
+            now = node.synced_at + 1
+            self.assertEqual(node.wait_time('message', 3, now), 0)
+            node.buckets['message'].take(3)
+            node.pending['message'] += 3
+            await node.sync(channel_layer, now)
+        # 6 tokens in the window, the limit is 1 per second for 60 seconds plus a burst of 4
+        self.assertEqual(nodes[1].blocked_until, {})
+
+        for _ in range(60):
+            nodes[1].pending['message'] += 1
+            await nodes[1].sync(channel_layer, nodes[1].synced_at + 1)
+        self.assertGreater(nodes[1].wait_time('message', 1, nodes[1].synced_at), 0)
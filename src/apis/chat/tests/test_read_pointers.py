@@ -0,0 +1,120 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ..db_queries import base as chat_db_queries
+from ..entity.models import ChatMember, Message
+from .base import ChatAPITestCase, create_chat, create_messages, create_user
+
+
+class ReadPointerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = create_user('alice')
+        cls.bob = create_user('bob')
+        cls.carol = create_user('carol')
+        cls.chat = create_chat(cls.alice, cls.bob)
+        # bob's own messages between alice's are never unread for him
+        cls.messages = sorted(
+            create_messages(cls.chat, cls.alice, cls.bob, 4) + create_messages(cls.chat, cls.bob, cls.alice, 2),
+            key=lambda message: (message.timestamp, message.id)
+        )
+
+    def advance(self, message: Message, user=None) -> int | None:
+        return chat_db_queries.advance_read_pointer(
+            (user or self.bob).id, self.chat.id, message.timestamp, message.id, timezone.now()
+        )
+
+    def member(self, user=None) -> ChatMember:
+        return ChatMember.objects.get(chat=self.chat, user=user or self.bob)  # noqa
+
+    def newly_read_of_alice(self, up_to: Message, after: Message = None) -> int:
+        return sum(
+            1 for message in self.messages
+            if message.sender_id == self.alice.id and (message.timestamp, message.id) <= (up_to.timestamp, up_to.id)
+            and (after is None or (message.timestamp, message.id) > (after.timestamp, after.id))
+        )
+
+    def test_pointer_moves_forward_in_one_statement(self):
+        target = self.messages[3]
+        with self.assertNumQueries(1):
+            newly_read = self.advance(target)
+        self.assertEqual(newly_read, self.newly_read_of_alice(target))
+        member = self.member()
+        self.assertEqual((member.last_read_message_id, member.last_read_timestamp), (target.id, target.timestamp))
+        self.assertEqual(member.unread_count, 4 - newly_read)
+
+        self.assertEqual(self.advance(self.messages[-1]), self.newly_read_of_alice(self.messages[-1], target))
+        self.assertEqual(self.member().unread_count, 0)
+
+    def test_pointer_never_moves_back(self):
+        self.advance(self.messages[3])
+        for message in self.messages[:4]:
+            self.assertIsNone(self.advance(message))
+        self.assertEqual(self.member().last_read_message_id, self.messages[3].id)
+
+    def test_pointer_of_a_deleted_message_keeps_its_timestamp(self):
+        self.advance(self.messages[2])
+        Message.objects.filter(id=self.messages[2].id).delete()  # noqa
+        ChatMember.objects.filter(id=self.member().id).update(last_read_message=None)  # noqa
+        self.assertEqual(self.advance(self.messages[-1]), self.newly_read_of_alice(self.messages[-1], self.messages[2]))
+
+    def test_unread_count_does_not_go_negative(self):
+        ChatMember.objects.filter(id=self.member().id).update(unread_count=1)  # noqa
+        self.assertEqual(self.advance(self.messages[-1]), 4)
+        self.assertEqual(self.member().unread_count, 0)
+
+    def test_only_members_have_a_pointer(self):
+        self.assertIsNone(self.advance(self.messages[-1], self.carol))
+
+    def test_mark_messages_read_moves_to_the_latest_message(self):
+        read = chat_db_queries.mark_messages_read(
+            self.bob.id, self.chat.id, timezone.now(), message_ids=[self.messages[1].id, self.messages[4].id]
+        )
+        self.assertEqual(read, self.newly_read_of_alice(self.messages[4]))
+        self.assertEqual(self.member().last_read_message_id, self.messages[4].id)
+        self.assertEqual(chat_db_queries.mark_messages_read(self.bob.id, self.chat.id, timezone.now(), up_to='none'), 0)
+
+
+class ReadAllMessagesAPITests(ChatAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.messages = create_messages(cls.chat, cls.alice, cls.bob, 3)
+
+    def read_all(self, user, chat_id: str, message_id: str = None):
+        path = f'/v1/chat/read-all/{chat_id}' + (f'/{message_id}' if message_id else '')
+        return self.api(user).put(path)
+
+    def test_read_all_returns_the_receipt(self):
+        response = self.read_all(self.bob, self.chat.id, self.messages[0].id)
+        self.assertEqual(response.status_code, 200)
+        receipt = response.data['data']
+        self.assertEqual(
+            {key: receipt[key] for key in ('type', 'chat_id', 'reader_id', 'message_ids', 'up_to', 'count')},
+            {'type': 'read_receipts', 'chat_id': self.chat.id, 'reader_id': self.bob.id, 'message_ids': None,
+             'up_to': self.messages[0].id, 'count': 1}
+        )
+        receipt = self.read_all(self.bob, self.chat.id).data['data']
+        self.assertEqual((receipt['up_to'], receipt['count']), (self.messages[-1].id, 2))
+
+    def test_nothing_new_is_two_chat_queries(self):
+        self.read_all(self.bob, self.chat.id)
+        with CaptureQueriesContext(connection) as queries:
+            receipt = self.read_all(self.bob, self.chat.id).data['data']
+        self.assertEqual(receipt['count'], 0)
+        chat_queries = [query['sql'] for query in queries.captured_queries if 'chat_' in query['sql']]
+        self.assertEqual(len(chat_queries), 2, chat_queries)
+
+    def test_empty_chats_and_invalid_requests(self):
+        empty_chat = create_chat(self.carol, self.alice)
+        response = self.read_all(self.carol, empty_chat.id)
+        self.assertEqual((response.status_code, response.data['data']['count']), (200, 0))
+        for user, chat_id, message_id in (
+                (self.carol, self.chat.id, None),
+                (self.carol, self.chat.id, self.messages[0].id),
+                (self.bob, self.chat.id, 'message_unknown'),
+                (self.bob, empty_chat.id, None),
+        ):
+            self.assertEqual(self.read_all(user, chat_id, message_id).status_code, 404)
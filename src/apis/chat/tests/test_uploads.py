@@ -0,0 +1,120 @@
+import hashlib
+
+import msgpack
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.test import SimpleTestCase, override_settings
+
+from ..entity.model_helpers import attachment_name
+from ..entity.models import Message
+from ..uploads import AttachmentUpload, UploadError
+from .base import ChatSocketTestCase, use_temporary_media_root
+
+
+@override_settings(CHAT_ATTACHMENT_MAX_SIZE=16, CHAT_ATTACHMENT_CHUNK_SIZE=4)
+class AttachmentUploadTests(SimpleTestCase):
+    def test_rejects_invalid_formats_and_sizes(self):
+        for file_format, size in (('', 4), ('p/ng', 4), ('png', 0), ('png', 17)):
+            with self.subTest(file_format=file_format, size=size), self.assertRaises(UploadError):
+                AttachmentUpload(file_format, size)
+
+    def test_chunks_are_spooled_and_hashed(self):
+        upload = AttachmentUpload('png', 6)
+        upload.write(b'abcd')
+        upload.write(b'ef')
+        file = upload.complete()
+        self.assertEqual(file.read(), b'abcdef')
+        self.assertEqual(file.sha256, hashlib.sha256(b'abcdef').hexdigest())
+        upload.close()
+
+    def test_rejects_oversized_chunks_and_uploads(self):
+        upload = AttachmentUpload('png', 6)
+        with self.assertRaises(UploadError):
+            upload.write(b'abcde')
+        upload.write(b'abcd')
+        with self.assertRaises(UploadError):
+            upload.write(b'abc')
+        with self.assertRaises(UploadError):
+            # smaller than declared
+            upload.complete()
+        upload.close()
+
+
+@override_settings(CHAT_ATTACHMENT_CHUNK_SIZE=4)
+class UploadSocketTests(ChatSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        use_temporary_media_root(self)
+        self.path = f'/ws/chat/{self.chat.id}/'
+
+    async def upload(self, socket, data: bytes, message: str):
+        await socket.send_json_to({'type': 'upload_init', 'format': 'png', 'size': len(data)})
+        ready = await self.receive_frame(socket, 'upload_ready')
+        self.assertEqual((ready['chat_id'], ready['chunk_size']), (self.chat.id, 4))
+        for start in range(0, len(data), 4):
+            await socket.send_to(bytes_data=data[start:start + 4])
+        await socket.send_json_to({'type': 'upload_commit', 'message': message})
+
+    async def test_upload_is_stored_under_its_hash_when_committed(self):
+        alice = await self.connect(self.path, self.alice)
+        bob = await self.connect(self.path, self.bob)
+
+        await self.upload(alice, b'image bytes', 'a picture')
+        message = (await self.receive_frame(bob, 'chat_message'))['message']
+
+        name = attachment_name(hashlib.sha256(b'image bytes').hexdigest(), 'png')
+        self.assertEqual(message['content'], 'a picture')
+        self.assertTrue(message['attachment'].endswith(name))
+        saved = await sync_to_async(Message.objects.get)(id=message['id'])
+        self.assertEqual(saved.attachment.name, name)
+        with default_storage.open(name) as file:
+            self.assertEqual(file.read(), b'image bytes')
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_msgpack_clients_send_upload_chunk_frames(self):
+        alice = await self.connect(self.path, self.alice, subprotocols=['chat.msgpack'])
+
+        async def send_chunk(bytes_data):
+            await alice.send_to(bytes_data=msgpack.packb({'type': 'upload_chunk', 'data': bytes_data}))
+
+        await alice.send_to(bytes_data=msgpack.packb({'type': 'upload_init', 'format': 'png', 'size': 6}))
+        while msgpack.unpackb(await alice.receive_from())['type'] != 'upload_ready':
+            pass
+        for start in (0, 4):
+            await send_chunk(b'abcdef'[start:start + 4])
+        await alice.send_to(bytes_data=msgpack.packb({'type': 'upload_commit', 'message': ''}))
+        while (frame := msgpack.unpackb(await alice.receive_from()))['type'] != 'chat_message':
+            pass
+        self.assertTrue(frame['message']['attachment'])
+        await alice.disconnect()
+
+    async def test_chunks_and_commits_need_an_upload(self):
+        alice = await self.connect(self.path, self.alice)
+        await alice.send_to(bytes_data=b'data')
+        self.assertEqual((await self.receive_frame(alice, 'error'))['message'], 'No upload in progress.')
+        await alice.send_json_to({'type': 'upload_commit', 'message': 'nothing'})
+        self.assertEqual((await self.receive_frame(alice, 'error'))['message'], 'No upload in progress.')
+        await alice.disconnect()
+
+    async def test_failed_uploads_create_no_message(self):
+        alice = await self.connect(self.path, self.alice)
+        await alice.send_json_to({'type': 'upload_init', 'format': 'png', 'size': 6})
+        await self.receive_frame(alice, 'upload_ready')
+        await alice.send_to(bytes_data=b'abcd')
+        await alice.send_json_to({'type': 'upload_commit', 'message': 'short'})
+        self.assertEqual(
+            (await self.receive_frame(alice, 'error'))['message'], 'Attachment is smaller than the declared size.'
+        )
+
+        await alice.send_json_to({'type': 'upload_init', 'format': 'png', 'size': 6})
+        await self.receive_frame(alice, 'upload_ready')
+        await alice.send_to(bytes_data=b'abcdefgh')
+        self.assertEqual(
+            (await self.receive_frame(alice, 'error'))['message'], 'Chunk size must not exceed 4 bytes.'
+        )
+        # the upload was aborted
+        await alice.send_json_to({'type': 'upload_commit', 'message': 'aborted'})
+        self.assertEqual((await self.receive_frame(alice, 'error'))['message'], 'No upload in progress.')
+        self.assertFalse(await sync_to_async(Message.objects.exists)())
+        await alice.disconnect()
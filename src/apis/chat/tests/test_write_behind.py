@@ -0,0 +1,99 @@
+import time
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.test import TransactionTestCase, override_settings
+
+from ..entity.models import ChatMember, Message
+from ..write_behind import MessageWriteBehind
+from .base import ChatSocketTestCase, create_chat, create_user
+
+
+def wait_for(condition, timeout: float = 2) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@override_settings(CHAT_WRITE_BEHIND_BATCH_SIZE=3, CHAT_WRITE_BEHIND_FLUSH_INTERVAL=60)
+class MessageWriteBehindTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.chat = create_chat(self.alice, self.bob)
+        self.writer = MessageWriteBehind()
+        self.addCleanup(self.writer.stop)
+
+    def message(self, content: str, chat_id: str = None) -> Message:
+        return Message(sender=self.alice, receiver=self.bob, content=content, chat_id=chat_id or self.chat.id)
+
+    def unread_count(self, user) -> int:
+        return ChatMember.objects.get(chat=self.chat, user=user).unread_count  # noqa
+
+    def test_flushes_once_the_batch_is_full(self):
+        messages = [self.message(str(number)) for number in range(3)]
+        for message in messages[:2]:
+            self.writer.add(message)
+        self.assertEqual(self.writer.queue_depth, 2)
+        self.assertFalse(Message.objects.exists())  # noqa
+
+        self.writer.add(messages[2])
+        self.assertTrue(wait_for(lambda: self.writer.stats()['flushed_messages'] == 3))
+        saved = Message.objects.filter(chat=self.chat).order_by('timestamp', 'id')  # noqa
+        # the ids and timestamps assigned when the messages were queued are kept
+        self.assertEqual(
+            list(saved.values_list('id', 'timestamp')), [(message.id, message.timestamp) for message in messages]
+        )
+        self.assertEqual((self.unread_count(self.bob), self.unread_count(self.alice)), (3, 0))
+        stats = self.writer.stats()
+        self.assertEqual((stats['queue_depth'], stats['flushes']), (0, 1))
+        self.assertGreater(stats['max_flush_latency'], 0)
+
+    @override_settings(CHAT_WRITE_BEHIND_FLUSH_INTERVAL=0.05)
+    def test_flushes_after_the_interval(self):
+        self.writer.add(self.message('alone'))
+        self.assertTrue(wait_for(lambda: Message.objects.filter(content='alone').exists()))  # noqa
+
+    def test_stop_flushes_the_queue(self):
+        self.writer.add(self.message('pending'))
+        self.writer.stop()
+        self.assertTrue(Message.objects.filter(content='pending').exists())  # noqa
+
+    def test_bad_rows_do_not_drop_the_batch(self):
+        self.writer.add(self.message('kept'))
+        self.writer.add(self.message('lost', chat_id='chat_deleted'))
+        with self.assertLogs('apis.chat.write_behind', 'ERROR'):
+            self.writer.flush()
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['kept'])  # noqa
+        stats = self.writer.stats()
+        self.assertEqual((stats['flushed_messages'], stats['failed_messages']), (1, 1))
+        self.assertEqual(self.unread_count(self.bob), 1)
+
+
+@override_settings(CHAT_WRITE_BEHIND=True, CHAT_WRITE_BEHIND_FLUSH_INTERVAL=60)
+class WriteBehindSocketTests(ChatSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = f'/ws/chat/{self.chat.id}/'
+        writer = MessageWriteBehind()
+        self.addCleanup(writer.stop)
+        writer_patch = mock.patch('apis.chat.consumers.message_writer', writer)
+        writer_patch.start()
+        self.addCleanup(writer_patch.stop)
+
+    async def test_messages_are_broadcast_before_they_are_saved(self):
+        alice = await self.connect(self.path, self.alice)
+        bob = await self.connect(self.path, self.bob)
+        await alice.send_json_to({'message': 'queued'})
+        message = (await self.receive_frame(bob, 'chat_message'))['message']
+        self.assertFalse(await sync_to_async(Message.objects.filter(id=message['id']).exists)())
+
+        # acknowledging a queued message flushes it first
+        await bob.send_json_to({'type': 'read_message', 'message_id': message['id']})
+        self.assertEqual((await self.receive_frame(bob, 'read_receipt'))['message_id'], message['id'])
+        self.assertTrue(await sync_to_async(Message.objects.filter(id=message['id']).exists)())
+        await alice.disconnect()
+        await bob.disconnect()
@@ -0,0 +1,76 @@
+import hashlib
+import mimetypes
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+class UploadError(Exception):
+    pass
+
+
+class AttachmentUpload:
+    """
+    Attachment received over a websocket as a series of binary frames.
+
+    Chunks are spooled to a temporary file (`FILE_UPLOAD_TEMP_DIR`) as they
+    arrive, the same way Django streams large multipart uploads to disk, so
+    memory per upload is bounded by `CHAT_ATTACHMENT_CHUNK_SIZE` no matter how
+    large the file is. Chunks are hashed as they arrive, the storage backend
+    moves or streams the temporary file to its content addressed name when the
+    message is saved.
+    """
+
+    def __init__(self, file_format: str, size: int):
+        if not file_format or not file_format.isalnum() or len(file_format) > 10:
+            raise UploadError('Invalid attachment format.')
+        if size <= 0 or size > settings.CHAT_ATTACHMENT_MAX_SIZE:
+            raise UploadError(f'Attachment size must be between 1 and {settings.CHAT_ATTACHMENT_MAX_SIZE} bytes.')
+
+        # only the format matters, the file is stored under its hash
+        name = f"upload.{file_format}"
+        self.expected_size = size
+        self.sha256 = hashlib.sha256()
+        self.file = TemporaryUploadedFile(
+            name, mimetypes.guess_type(name)[0], 0, None
+        )
+
+    def write(self, chunk: bytes):
+        if len(chunk) > settings.CHAT_ATTACHMENT_CHUNK_SIZE:
+            raise UploadError(f'Chunk size must not exceed {settings.CHAT_ATTACHMENT_CHUNK_SIZE} bytes.')
+        if self.file.size + len(chunk) > self.expected_size:
+            raise UploadError('Attachment is larger than the declared size.')
+        self.file.write(chunk)
+        self.file.size += len(chunk)
+        self.sha256.update(chunk)
+
+    def complete(self) -> TemporaryUploadedFile:
+        if self.file.size != self.expected_size:
+            raise UploadError('Attachment is smaller than the declared size.')
+        self.file.seek(0)
+        self.file.sha256 = self.sha256.hexdigest()
+        return self.file
+
+    def close(self):
+        self.file.close()
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """
+    streams multipart file uploads to a temporary file as Django does by
+    default, hashing them on the way, the SHA-256 is set as `file.sha256`.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.sha256.hexdigest()
+        return file
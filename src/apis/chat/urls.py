@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import ChatAPIView, MessageAPIView, ReadMessageAPIView
+from .views import AttachmentAPIView, ChatAPIView, ChatMetricsAPIView, ExportChatAPIView, MessageAPIView, MessageSearchAPIView, ReadAllMessagesAPIView, ReadMessageAPIView
 
 
 app_name: str = "chat"
@@ -7,5 +7,11 @@ app_name: str = "chat"
 urlpatterns = [
     path('', ChatAPIView.as_view()),
     path('messages/<chat_id>', MessageAPIView.as_view()),
-    path('read/<message_id>', ReadMessageAPIView.as_view())
+    path('search', MessageSearchAPIView.as_view()),
+    path('metrics', ChatMetricsAPIView.as_view()),
+    path('export/<chat_id>', ExportChatAPIView.as_view()),
+    path('attachments/<message_id>', AttachmentAPIView.as_view()),
+    path('read/<message_id>', ReadMessageAPIView.as_view()),
+    path('read-all/<chat_id>', ReadAllMessagesAPIView.as_view()),
+    path('read-all/<chat_id>/<message_id>', ReadAllMessagesAPIView.as_view())
 ]
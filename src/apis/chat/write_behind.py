@@ -0,0 +1,140 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+
+from .db_queries import base as chat_db_queries
+from .entity.models import Message
+
+
+log = logging.getLogger(__name__)
+
+
+class MessageWriteBehind:
+    """
+    Per-process batcher that persists already-broadcast messages.
+
+    Messages are queued with their id and timestamp assigned, and a daemon thread
+    saves them with `bulk_create` once `CHAT_WRITE_BEHIND_BATCH_SIZE` messages are
+    queued or `CHAT_WRITE_BEHIND_FLUSH_INTERVAL` seconds after the oldest one was
+    queued, whichever comes first. Whatever is still queued is flushed on
+    interpreter shutdown.
+    """
+
+    def __init__(self):
+        self._pending: list[Message] = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._stats: dict = {
+            'flushes': 0,
+            'flushed_messages': 0,
+            'failed_messages': 0,
+            'last_flush_latency': 0.0,
+            'max_flush_latency': 0.0,
+        }
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        """
+        queue depth and flush latency (in seconds) metrics for this process
+        """
+        return {'queue_depth': self.queue_depth, **self._stats}
+
+    def add(self, message: Message):
+        with self._condition:
+            self._pending.append(message)
+            if self._thread is None:
+                self._start()
+            if len(self._pending) >= settings.CHAT_WRITE_BEHIND_BATCH_SIZE:
+                self._condition.notify()
+
+    def flush(self):
+        """
+        save everything queued so far, blocks until the rows are committed
+        """
+        with self._flush_lock:
+            with self._condition:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+
+            started = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    Message.objects.bulk_create(batch)  # noqa
+                    self._increment_unread_counts(batch)
+                self._stats['flushed_messages'] += len(batch)
+            except Exception as e:
+                log.error('MessageWriteBehind.flush@Error')
+                log.error(e)
+                self._save_individually(batch)
+            latency = time.perf_counter() - started
+
+            self._stats['flushes'] += 1
+            self._stats['last_flush_latency'] = latency
+            self._stats['max_flush_latency'] = max(self._stats['max_flush_latency'], latency)
+            log.debug(
+                'MessageWriteBehind.flush: %s messages in %.1fms, queue depth %s',
+                len(batch), latency * 1000, self.queue_depth
+            )
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self.flush()
+        if self._thread is not None:
+            self._thread.join(timeout=settings.CHAT_WRITE_BEHIND_FLUSH_INTERVAL + 5)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='message-write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopping:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._stopping)
+                self._condition.wait_for(
+                    lambda: len(self._pending) >= settings.CHAT_WRITE_BEHIND_BATCH_SIZE or self._stopping,
+                    timeout=settings.CHAT_WRITE_BEHIND_FLUSH_INTERVAL
+                )
+            close_old_connections()
+            self.flush()
+        connections.close_all()
+
+    def _save_individually(self, batch: list[Message]):
+        """
+        fall back to one INSERT per message so one bad row (e.g. a chat deleted
+        after the message was broadcast) does not drop the whole batch
+        """
+        for message in batch:
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+                    self._increment_unread_counts([message])
+                self._stats['flushed_messages'] += 1
+            except Exception as e:
+                self._stats['failed_messages'] += 1
+                log.error('MessageWriteBehind._save_individually@Error')
+                log.error(e)
+
+    @staticmethod
+    def _increment_unread_counts(batch: list[Message]):
+        # one UPDATE per chat and sender in the batch
+        for (chat_id, sender_id), count in Counter(
+            (message.chat_id, message.sender_id) for message in batch
+        ).items():
+            chat_db_queries.increment_unread_counts(chat_id, sender_id, count)
+
+
+message_writer = MessageWriteBehind()
@@ -211,3 +211,109 @@ OTP_EXPIRY_TIME: int = int(env_config['OTP_EXPIRY_TIME'])
 REFRESH_TOKEN_EXPIRY_TIME: int = int(env_config['REFRESH_TOKEN_EXPIRY_TIME'])
 
 PASSWORD_RESET_TIMEOUT: int = 480  # in seconds
+
+
+# ======== Chat Settings =========#
+
+CHAT_ATTACHMENT_MAX_SIZE: int = 25 * 1024 * 1024  # in bytes, per websocket upload
+
+CHAT_ATTACHMENT_CHUNK_SIZE: int = 64 * 1024  # in bytes, largest binary frame accepted during an upload
+
+# in seconds, how long a stored attachment no message references is kept by `collect_chat_attachments`
+CHAT_ATTACHMENT_GC_GRACE: int = 24 * 60 * 60
+
+# `x-accel-redirect` (nginx) or `x-sendfile` (apache, lighttpd) to have the web server send
+# attachment downloads, Django streams them itself when not set. With nginx,
+# `CHAT_ATTACHMENT_ACCEL_REDIRECT_PREFIX` must be an `internal` location aliased to MEDIA_ROOT.
+CHAT_ATTACHMENT_SENDFILE: str | None = env_config.get('CHAT_ATTACHMENT_SENDFILE') or None
+
+CHAT_ATTACHMENT_ACCEL_REDIRECT_PREFIX: str = '/protected-media/'
+
+CHAT_ATTACHMENT_MAX_AGE: int = 365 * 24 * 60 * 60  # in seconds, browser cache lifetime of content addressed downloads
+
+# when enabled, websocket messages are broadcast before they are saved and a
+# background thread persists them in batches with `bulk_create`. Messages still
+# queued when the process is killed without a clean shutdown are lost.
+CHAT_WRITE_BEHIND: bool = False
+
+CHAT_WRITE_BEHIND_BATCH_SIZE: int = 200  # flush once this many messages are queued
+
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL: float = 0.2  # in seconds, longest a message waits in the queue
+
+CHAT_READ_MESSAGES_MAX_IDS: int = 500  # most message ids accepted in one `read_messages` frame
+
+CHAT_PRESENCE_TTL: int = 60  # in seconds, a connection without a heartbeat for this long counts as offline
+
+CHAT_LAST_SEEN_TTL: int = 30 * 24 * 60 * 60  # in seconds
+
+CHAT_TYPING_INTERVAL: int = 3  # in seconds, at most one typing broadcast per user per chat in this interval
+
+CHAT_REPLAY_BATCH_SIZE: int = 100  # messages per `history` frame when replaying from a `since` cursor
+
+CHAT_REPLAY_MAX_MESSAGES: int = 1000  # most messages replayed on connect, clients page the rest over http
+
+CHAT_LIST_PREVIEW_LENGTH: int = 100  # characters of the last message returned with each chat in the chat list
+
+CHAT_EXPORT_CHUNK_SIZE: int = 2000  # messages fetched from the database and written per chunk of a chat export
+
+# frames undelivered per websocket (queued, or waiting in the channel layer) before
+# receipts, typing and presence frames are dropped, the socket is closed (code
+# 4008) when chat messages overflow it. Enforced under Daphne only, the server
+# that reports how much the client has not read yet
+CHAT_SEND_QUEUE_HIGH_WATER: int = 256
+
+CHAT_SEND_BUFFER_HIGH_WATER: int = 256 * 1024  # in bytes, unread by the client before a websocket's frames are queued
+
+# token buckets checked before a websocket frame does any database or channel
+# layer work, as (tokens per second, burst) for each socket and for each user
+# across their sockets. Every frame takes from the bucket of its kind: `message`
+# (and `upload_commit`), `read`, `typing`, `subscribe` (and `unsubscribe`),
+# `upload_init`, `control` (`heartbeat`, `ack`, `upload_abort`) and
+# `attachment_bytes` (upload chunk sizes). Attachment bursts must allow a whole upload chunk.
+CHAT_RATE_LIMITS: dict = {
+    'message': {'connection': (5, 20), 'user': (10, 40)},
+    'read': {'connection': (10, 50), 'user': (20, 100)},
+    'typing': {'connection': (5, 20), 'user': (10, 40)},
+    'subscribe': {'connection': (2, 20), 'user': (5, 50)},
+    'upload_init': {'connection': (1, 5), 'user': (2, 10)},
+    'control': {'connection': (10, 50), 'user': (20, 100)},
+    'attachment_bytes': {
+        'connection': (2 * 1024 * 1024, 8 * 1024 * 1024),
+        'user': (4 * 1024 * 1024, 16 * 1024 * 1024)
+    },
+}
+
+# also enforce the per-user limits across nodes through the channel layer's Redis
+CHAT_RATE_LIMIT_REDIS_SYNC: bool = False
+
+CHAT_RATE_LIMIT_SYNC_INTERVAL: float = 1  # in seconds, how often a node reports a user's usage to Redis
+
+CHAT_RATE_LIMIT_SYNC_WINDOW: int = 10  # in seconds, the window per-user usage is summed over across nodes
+
+CHAT_AUTH_TOKEN_CACHE_SIZE: int = 10000  # verified websocket tokens (and users) cached per process
+
+CHAT_AUTH_USER_CACHE_TTL: int = 30  # in seconds, how long a websocket's user is reused across connections
+
+CHAT_AUTH_VERIFY_WORKERS: int = 4  # threads verifying websocket token signatures
+
+# also append chat messages and read receipts to a durable per-user Redis Stream
+# replayed to inbox sockets on connect (needs the Redis channel layer)
+CHAT_INBOX_STREAMS: bool = True
+
+CHAT_INBOX_STREAM_MAXLEN: int = 1000  # about this many unacknowledged entries are kept per user
+
+CHAT_INBOX_STREAM_TTL: int = 7 * 24 * 60 * 60  # in seconds, an inbox untouched for this long is deleted
+
+# chat_message is partitioned by month, `partition_chat_messages` creates the
+# partitions of the coming months and archives the ones past the retention
+CHAT_MESSAGE_PARTITIONS_AHEAD: int = 3  # months
+
+CHAT_MESSAGE_RETENTION_MONTHS: int = 12  # whole months of messages kept in the database
+
+# local directory or `s3://bucket/prefix` archived partitions are written to as gzipped JSON lines
+CHAT_MESSAGE_ARCHIVE_DESTINATION: str = env_config.get('CHAT_MESSAGE_ARCHIVE_DESTINATION') or str(
+    BASE_DIR / 'archive' / 'chat_messages'
+)
+
+# endpoint of S3 compatible storage, AWS when not set
+CHAT_MESSAGE_ARCHIVE_S3_ENDPOINT_URL: str | None = env_config.get('CHAT_MESSAGE_ARCHIVE_S3_ENDPOINT_URL') or None
@@ -11,7 +11,11 @@ DATABASES: dict = {
         "HOST": env_config['DATABASE_HOST'],
         "USER": env_config['DATABASE_USER'],
         "PASSWORD": env_config['DATABASE_PASSWORD'],
-        'PORT': env_config['DATABASE_PORT']
+        'PORT': env_config['DATABASE_PORT'],
+        # keep connections open across `database_sync_to_async` hops in the
+        # websocket consumers instead of reconnecting on every frame
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True
     }
 }
 